@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark chart payload latency vs. window size, with and without
+server-side downsampling.
+
+Simulates a sensor reporting temperature and humidity once a minute, and
+times downsampling plus JSON serialization of the chart series.
+
+usage:
+    python benchmarks/chart_downsample.py [max_points]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import datetime
+import collections
+
+# the usage above runs this file as a script, from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from potnanny_api.chart_utils import downsample_measurements
+
+Row = collections.namedtuple('Row', ['sensor_id', 'type', 'value', 'created'])
+
+
+def make_rows(days):
+    now = datetime.datetime(2019, 1, 1)
+    rows = []
+    for i in range(days * 24 * 60):
+        t = now + datetime.timedelta(minutes=i)
+        rows.append(Row(1, 'temperature', 22 + 3 * math.sin(i / 240.0), t))
+        rows.append(Row(1, 'humidity', 55 + 5 * math.cos(i / 300.0), t))
+
+    return rows
+
+
+def serialize(rows):
+    series = {}
+    for r in rows:
+        series.setdefault(r.type, []).append([r.created.isoformat(), r.value])
+
+    return json.dumps(series)
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - t) * 1000
+
+
+def main():
+    max_points = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print("{:>6} {:>9} {:>10} {:>12} {:>12} {:>12}".format(
+        'days', 'rows', 'raw ms', 'lttb ms', 'minmax ms', 'raw bytes'))
+
+    for days in [1, 7, 30, 90]:
+        rows = make_rows(days)
+        raw, raw_ms = timed(serialize, rows)
+        results = []
+        for method in ['lttb', 'minmax']:
+            t = time.perf_counter()
+            payload = serialize(downsample_measurements(rows, max_points, method))
+            results.append(((time.perf_counter() - t) * 1000, len(payload)))
+
+        print("{:>6} {:>9} {:>10.1f} {:>12.1f} {:>12.1f} {:>12}".format(
+            days, len(rows), raw_ms, results[0][0], results[1][0], len(raw)))
+
+
+if __name__ == '__main__':
+    main()
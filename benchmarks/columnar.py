@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark chart post-processing (unit conversion, splitting into series,
+bucketing and gap detection), with numpy and with plain python lists.
+
+usage:
+    python benchmarks/columnar.py [rows]
+"""
+
+import os
+import sys
+import math
+import time
+import datetime
+import collections
+
+# the usage above runs this file as a script, from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from potnanny_api.timegrid import TimeGrid
+from potnanny_api.columnar import HAVE_NUMPY, MeasurementColumns, find_gaps
+
+Row = collections.namedtuple('Row', ['sensor_id', 'type', 'value', 'created'])
+
+
+def make_rows(count):
+    now = datetime.datetime(2019, 1, 1)
+    rows = []
+    for i in range(count // 4):
+        t = now + datetime.timedelta(seconds=i * 30)
+        for sensor_id in (1, 2):
+            rows.append(Row(sensor_id, 'temperature',
+                            22 + 3 * math.sin(i / 240.0), t))
+            rows.append(Row(sensor_id, 'humidity',
+                            55 + 5 * math.cos(i / 300.0), t))
+
+    return rows
+
+
+def process(rows, use_numpy):
+    grid = TimeGrid(interval=300)
+    cols = MeasurementColumns(rows, use_numpy=use_numpy)
+    cols.convert_temperature()
+    for key, seconds, values in cols.split(by_sensor=True):
+        grid.add_many(key, seconds, values)
+        for s in find_gaps(seconds, 1800):
+            grid.add_break(s)
+
+    return [grid.values(k) for k in grid.keys()]
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - t) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = make_rows(count)
+
+    plain, plain_ms = timed(process, rows, False)
+    print("{:>8} rows  python {:8.1f} ms".format(len(rows), plain_ms))
+
+    if not HAVE_NUMPY:
+        print("numpy is not installed")
+        return
+
+    vector, vector_ms = timed(process, rows, True)
+    print("{:>8} rows  numpy  {:8.1f} ms  ({:.1f}x)".format(
+        len(rows), vector_ms, plain_ms / vector_ms))
+
+    for a, b in zip(plain, vector):
+        assert all(abs(x - y) < 1e-9 for x, y in zip(a, b))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark aligning daily rollups of several grows by grow day, with numpy
+and with plain python lists.
+
+usage:
+    python benchmarks/compare.py [grows]
+"""
+
+import gc
+import os
+import sys
+import time
+import random
+import datetime
+import collections
+
+# the usage above runs this file as a script, from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from potnanny_api.apps.grow.compare import HAVE_NUMPY, GrowWindow, align_days
+
+Grow = collections.namedtuple('Grow', [
+    'id', 'room_id', 'started', 'transitioned', 'ended'])
+
+Row = collections.namedtuple('Row', [
+    'sensor_id', 'type', 'bucket', 'count', 'sum', 'min', 'max'])
+
+TYPES = ['humidity', 'soil_moisture', 'temperature']
+
+
+def make_data(count, sensors=4):
+    """One room per two grows, 120 day grows, daily rollups of every day."""
+
+    start = datetime.datetime(2018, 1, 1)
+    grows, rows, sensor_rooms = [], [], {}
+    for i in range(count):
+        room_id = i // 2 + 1
+        started = start + datetime.timedelta(days=130 * (i % 2), hours=9)
+        grows.append(Grow(i + 1, room_id, started,
+                          started + datetime.timedelta(days=60),
+                          started + datetime.timedelta(days=120)))
+
+    for room_id in range(1, (count + 1) // 2 + 1):
+        for s in range(sensors):
+            sensor_id = room_id * 100 + s
+            sensor_rooms[sensor_id] = room_id
+            for day in range(260):
+                bucket = start + datetime.timedelta(days=day)
+                for t in TYPES:
+                    n = random.randint(100, 1440)
+                    v = random.uniform(10, 60)
+                    rows.append(Row(sensor_id, t, bucket, n, v * n, v - 5,
+                                    v + 5))
+
+    return grows, rows, sensor_rooms
+
+
+def timed(func, *args):
+    gc.collect()
+    t = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - t) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    grows, rows, sensor_rooms = make_data(count)
+    windows = [GrowWindow(g, 'flip') for g in grows]
+    args = (rows, sensor_rooms, windows, TYPES, -60, 60, 'mean')
+
+    plain, plain_ms = timed(align_days, *args, False)
+    print("{:>4} grows  {:>7} rows  python {:8.1f} ms".format(
+        count, len(rows), plain_ms))
+
+    if not HAVE_NUMPY:
+        print("numpy is not installed")
+        return
+
+    vector, vector_ms = timed(align_days, *args, True)
+    print("{:>4} grows  {:>7} rows  numpy  {:8.1f} ms  ({:.1f}x)".format(
+        count, len(rows), vector_ms, plain_ms / vector_ms))
+
+    # sums may be added in a different order
+    for a, b in zip(plain, vector):
+        for x, y in zip(a, b):
+            assert [v if v is None else round(v, 6) for v in x] == \
+                [v if v is None else round(v, 6) for v in y]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark list serialization with plain marshmallow vs. the compiled
+dumpers from potnanny_api.serializer.
+
+usage:
+    python benchmarks/serializer.py [objects]
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+from types import SimpleNamespace
+
+# the usage above runs this file as a script, from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from potnanny_core.schemas.grow import GrowSchema
+from potnanny_core.schemas.schedule import ScheduleOnOffSchema
+from potnanny_core.schemas.sensor import SensorSchema
+from potnanny_api.serializer import compile_schema
+
+
+def make_objects(count):
+    now = datetime.datetime(2019, 1, 1)
+    outlet = json.dumps({'id': '1', 'name': 'lights', 'type': 'wireless'})
+    return {
+        'sensors': (SensorSchema, [SimpleNamespace(
+            id=i, name='sensor %d' % i, address='aa:bb:%d' % i, model='sht',
+            room_id=1, created=now, measurement_types=['temperature'])
+            for i in range(count)]),
+        'schedules': (ScheduleOnOffSchema, [SimpleNamespace(
+            id=i, name='schedule %d' % i, room_id=1, is_active=True,
+            created=now, outlet=outlet, days=127, on_utc_hour=6,
+            on_minute=0, off_utc_hour=18, off_minute=0)
+            for i in range(count)]),
+        'grows': (GrowSchema, [SimpleNamespace(
+            id=i, name='grow %d' % i, room_id=1, started=now,
+            transition=None, ended=None)
+            for i in range(count)]),
+    }
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - t) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    for name, (schema, objects) in make_objects(count).items():
+        slow, slow_ms = timed(
+            lambda: schema(many=True).dump(objects))
+        dump = compile_schema(schema())
+        fast, fast_ms = timed(lambda: dump(objects, many=True))
+        assert tuple(fast) == tuple(slow)
+
+        print("{:>10} x{}  marshmallow {:7.1f} ms  compiled {:7.1f} ms "
+              "({:.1f}x)".format(name, count, slow_ms, fast_ms,
+                                 slow_ms / fast_ms))
+
+
+if __name__ == '__main__':
+    main()
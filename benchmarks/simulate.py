@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark schedule simulation (daily on-hours and the transition timeline)
+over a year, with numpy and with plain python lists.
+
+usage:
+    python benchmarks/simulate.py [outlets]
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import datetime
+import collections
+
+# the usage above runs this file as a script, from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from potnanny_api.apps.schedule.index import ScheduleIndex
+from potnanny_api.apps.schedule.simulate import HAVE_NUMPY, simulate
+
+Schedule = collections.namedtuple('Schedule', [
+    'id', 'is_active', 'outlet', 'days', 'on_utc_hour', 'on_minute',
+    'off_utc_hour', 'off_minute'])
+
+
+def make_schedules(count):
+    schedules = []
+    for i in range(count):
+        outlet = json.dumps({'id': str(i), 'type': 'wireless'})
+        # every day, and a second schedule on weekdays only
+        schedules.append(Schedule(2 * i, True, outlet, 127, i % 24, 0,
+                                  (i + 12) % 24, 30))
+        schedules.append(Schedule(2 * i + 1, True, outlet, 62, (i + 3) % 24,
+                                  15, (i + 4) % 24, 45))
+
+    return schedules
+
+
+def timed(func, *args):
+    gc.collect()
+    t = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - t) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    index, build_ms = timed(ScheduleIndex, make_schedules(count))
+    print("{:>6} outlets  index  {:8.1f} ms".format(count, build_ms))
+
+    start = datetime.datetime(2019, 1, 1)
+    plain, plain_ms = timed(simulate, index, start, 365, True, False)
+    print("{:>6} outlets  python {:8.1f} ms  ({} transitions)".format(
+        count, plain_ms, len(plain['timeline'])))
+
+    if not HAVE_NUMPY:
+        print("numpy is not installed")
+        return
+
+    vector, vector_ms = timed(simulate, index, start, 365, True, True)
+    print("{:>6} outlets  numpy  {:8.1f} ms  ({:.1f}x)".format(
+        count, vector_ms, plain_ms / vector_ms))
+
+    assert plain == vector
+
+
+if __name__ == '__main__':
+    main()
@@ -15,17 +15,31 @@ def create_app(config=Development):
         config_database(app)
         config_api(app)
         config_extensions(app)
+        config_commands(app)
 
     return app
 
 def config_database(app):
+    # import our own models first, so init_db() creates their tables too
+    from potnanny_api import rollup, jobs, grow_report
+
     init_engine(app.config['SQLALCHEMY_DATABASE_URI'])
     init_db()
     init_users()
 
+    from potnanny_core import database
+    from potnanny_api import querycount
+    querycount.init_app(app, database.engine)
+    jobs.runner.init_app(app)
+    rollup.updater.init_app(app)
+
 def config_extensions(app):
     jwt.init_app(app)
 
+def config_commands(app):
+    from potnanny_api.commands import rollup_cli
+    app.cli.add_command(rollup_cli)
+
 def config_api(app):
     from potnanny_api.apps.auth.api import bp as auth_bp
     app.register_blueprint(auth_bp)
@@ -53,3 +67,9 @@ def config_api(app):
 
     from potnanny_api.apps.plugin.api import bp as plugin_bp
     app.register_blueprint(plugin_bp)
+
+    from potnanny_api.apps.job.api import bp as job_bp
+    app.register_blueprint(job_bp)
+
+    from potnanny_api.apps.setting.api import bp as setting_bp
+    app.register_blueprint(setting_bp)
@@ -1,26 +1,38 @@
 from flask import Blueprint, request, url_for, jsonify
 from flask_restful import Api, Resource
+from sqlalchemy.orm import selectinload
 from flask_jwt_extended import jwt_required
 
 from potnanny_core.models.action import Action
 from potnanny_core.schemas.action import ActionSchema
 from potnanny_core.database import db_session
+from potnanny_core.models.trigger import Trigger
+# registers the schema ActionSchema (and so RoomSchema) nests by name
+from potnanny_core.schemas.trigger import TriggerSchema
 from potnanny_api.crud import CrudInterface
+from potnanny_api.conditional import conditional
+from potnanny_api.querycount import query_budget
 
 
 bp = Blueprint('action_api', __name__, url_prefix='/api/1.0/actions')
 api = Api(bp)
-ifc = CrudInterface(db_session, Action, ActionSchema)
+ifc = CrudInterface(db_session, Action, ActionSchema, depends=[Trigger],
+                    filters=['name', 'measurement_type', 'is_active', 'room_id'],
+                    sorts=['name', 'created'], cache_ttl=300,
+                    loader_options=[selectinload(Action.triggers)],
+                    cascades=[Trigger])
 
 
 class ActionListApi(Resource):
     """Class to interface with Actions."""
 
     @jwt_required
+    @query_budget
+    @conditional(ifc.etag)
     def get(self):
         """Get list of all actions."""
 
-        ser, err, code = ifc.get()
+        ser, err, code = ifc.get(args=request.args)
         if err:
             return err, code
 
@@ -44,8 +56,9 @@ class ActionListApi(Resource):
 class ActionApi(Resource):
 
     @jwt_required
+    @conditional(ifc.etag)
     def get(self, pk):
-        ser, err, code = ifc.get(pk)
+        ser, err, code = ifc.get(pk, request.args)
         if err:
             return err, code
 
@@ -72,5 +85,19 @@ class ActionApi(Resource):
         return ser, code
 
 
+class ActionBulkApi(Resource):
+
+    @jwt_required
+    def post(self):
+        """Bulk create, edit and delete (see CrudInterface.bulk)."""
+
+        ser, err, code = ifc.bulk(request.get_json())
+        if err:
+            return err, code
+
+        return ser, code
+
+
 api.add_resource(ActionListApi, '')
+api.add_resource(ActionBulkApi, '/bulk')
 api.add_resource(ActionApi, '/<int:pk>')
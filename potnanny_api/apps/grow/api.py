@@ -1,24 +1,58 @@
+import json
 import datetime
-from flask import Blueprint, request, url_for, jsonify
+from flask import Blueprint, request, url_for, jsonify, Response
 from flask_restful import Api, Resource
 from flask_jwt_extended import jwt_required
+from sqlalchemy import func
 
 from potnanny_core.models.grow import Grow
-from potnanny_core.models.schedule import RoomLightManager
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.models.sensor import Sensor
 from potnanny_core.schemas.grow import GrowSchema
 from potnanny_core.database import db_session
+from potnanny_core.utils import datetime_for_js
+from potnanny_api.settings import settings_snapshot
 from potnanny_api.crud import CrudInterface
+from potnanny_api.conditional import conditional
+from potnanny_api.querycount import query_budget
+from potnanny_api.versions import TableVersions
+from potnanny_api.jobs import runner, JobSchema
+from potnanny_api.grow_report import GrowReport, grow_phases
+from potnanny_api.rollup import RollupManager
+from potnanny_api.timegrid import TimeGrid
+from potnanny_api.chart_utils import (DOWNSAMPLERS, PACKED_MIMETYPE,
+    build_chart, chart_mimetype, fill_grid, pack_chart)
+from potnanny_api.apps.grow.timeline import plan_timeline, timeline_rows
+from potnanny_api.apps.grow.compare import (STATS, GrowWindow, align_days,
+    daily_rows)
+# registers the grow job tasks
+from potnanny_api.apps.grow import tasks
 
 
 bp = Blueprint('grow_api', __name__, url_prefix='/api/1.0/grows')
 api = Api(bp)
-ifc = CrudInterface(db_session, Grow, GrowSchema)
+ifc = CrudInterface(db_session, Grow, GrowSchema,
+                    filters=['name', 'room_id', 'started', 'ended'],
+                    sorts=['name', 'started'], cache_ttl=300,
+                    cascades=[GrowReport])
+
+
+def job_headers(job):
+    """Response headers that point to a background job."""
+
+    return {
+        'Location': url_for('job_api.jobapi', pk=job.id),
+        'X-Job-Id': str(job.id),
+    }
+
 
 class GrowListApi(Resource):
 
     #@jwt_required
+    @query_budget
+    @conditional(ifc.etag)
     def get(self):
-        ser, err, code = ifc.get()
+        ser, err, code = ifc.get(args=request.args)
         if err:
             return err, code
 
@@ -34,19 +68,18 @@ class GrowListApi(Resource):
         if err:
             return err, code
 
-        try:
-            mgr = RoomLightManager(ser['id'])
-            mgr.switch_to_phase('growth')
-        except:
-            pass
-        return ser, code
+        # the room light schedules are switched in the background
+        job = runner.submit('grow_phase', room_id=ser['room_id'],
+                            phase='growth')
+        return ser, code, job_headers(job)
 
 
 class GrowApi(Resource):
 
     #@jwt_required
+    @conditional(ifc.etag)
     def get(self, pk):
-        ser, err, code = ifc.get(pk)
+        ser, err, code = ifc.get(pk, request.args)
         if err:
             return err, code
 
@@ -77,6 +110,20 @@ class GrowApiSwitch(Resource):
 
     #@jwt_required
     def post(self, pk):
+        """
+        Switch a grow to a new phase (growth|flowering|end).
+
+        The grow is updated right away. Switching the room light schedules
+        (or, at the end, building the grow report) is slow, so it runs as a
+        background job, and the response is a 202 with the job (poll
+        /api/1.0/jobs/<id> for its status).
+
+        args:
+            - int: grow id
+        returns:
+            json, like {"grow": {...}, "job": {...}}, http result code
+        """
+
         data = request.get_json()
         if not data or 'phase' not in data:
             return {'msg': 'Invalid POST data'}, 400
@@ -88,41 +135,318 @@ class GrowApiSwitch(Resource):
         if not grow:
             return {'msg': 'Grow id not found'}, 404
 
-        mgr = RoomLightManager(grow.room_id)
-        if data['phase'] == 'growth':
+        phase = data['phase']
+        if phase == 'growth':
             # this is an odd scenario. transitioning from flower back to grow?
             # user must have made mistake. anyway, reset datetime fields.
             if grow.transitioned is not None:
                 grow.transitioned = None
             grow.started = datetime.datetime.utcnow()
-
-            try:
-                if mgr.schedules() is not None:
-                    mgr.switch_to_phase('growth')
-            except:
-                # TODO: log an error here?
-                pass
-        elif data['phase'] == 'flowering':
+        elif phase == 'flowering':
             grow.transitioned = datetime.datetime.utcnow()
-            try:
-                if mgr.schedules() is not None:
-                    mgr.switch_to_phase('flowering')
-            except:
-                # TODO: log an error here?
-                pass
-        elif data['phase'] == 'end':
+        elif phase == 'end':
             grow.ended = datetime.datetime.utcnow()
-            # TODO: run a data aggregation job in backround? To create some
-            # type of report?
 
+        TableVersions.bump('grows')
         db_session.commit()
-        data, errors = GrowSchema().load(grow)
-        if not errors:
-            return data, 201
+
+        if phase == 'end':
+            # summarize the grow's measurements once, for /report
+            job = runner.submit('grow_report', grow_id=grow.id)
         else:
-            errors, 400
+            job = runner.submit('grow_phase', room_id=grow.room_id,
+                                phase=phase)
+
+        # core's computed status fails on ended grows. the switch has
+        # happened by now, so leave the status out rather than fail it
+        exclude = ['status'] if grow.ended else []
+        ser, errors = GrowSchema(exclude=exclude).dump(grow)
+        if errors:
+            return errors, 400
+
+        return {
+            'grow': ser,
+            'job': JobSchema().dump(job).data,
+        }, 202, job_headers(job)
+
+
+class GrowReportApi(Resource):
+
+    #@jwt_required
+    def get(self, pk):
+        """
+        Get the summary report of a grow. Reports are built when a grow
+        ends, or on request (POST).
+
+        args:
+            - int: grow id
+        returns:
+            json, http result code
+        """
+
+        obj = GrowReport.query.filter_by(grow_id=pk).first()
+        if not obj:
+            return {'msg': 'no report for grow id {}'.format(pk)}, 404
+
+        return json.loads(obj.data), 200
+
+    #@jwt_required
+    def post(self, pk):
+        """
+        Build (or rebuild) the summary report of a grow in the background.
+        Unfinished phases are summarized up to now.
+
+        args:
+            - int: grow id
+        returns:
+            json, of the job. http result code
+        """
+
+        if not Grow.query.get(pk):
+            return {'msg': 'Grow id not found'}, 404
+
+        job = runner.submit('grow_report', grow_id=pk)
+        return JobSchema().dump(job).data, 202, job_headers(job)
+
+
+def timeline_etag(**kwargs):
+    """
+    Validator for the timeline and comparison charts. Like chart_etag, but
+    they also depend on the grows, and unfinished grows end now (the minute
+    rollups are the finest resolution used).
+    """
+
+    last_id = db_session.query(func.max(Measurement.id)).scalar()
+    minute = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+    return [last_id, TableVersions.get('settings', 'grows'),
+            chart_mimetype(), minute.isoformat()]
+
+
+class GrowTimelineApi(Resource):
+
+    MAX_POINTS = 10000
+    MAX_WINDOW = 24 * 30
+
+    #@jwt_required
+    @conditional(timeline_etag)
+    def get(self, pk):
+        """
+        Chart the measurements of a grow's room sensors, from the start of
+        the grow to its end (or now), in one request.
+
+        The point count is bounded however long the grow is. Resolution is
+        chosen per segment (see timeline.plan_timeline): finer in windows
+        around the start, the flip to flowering and the end, coarser in
+        between.
+
+        Optional query args:
+            - max_points: points per series, for the whole grow (default 1000)
+            - window: hours on both sides of each phase transition to chart
+              finer (default 24, 0 for a uniform resolution)
+            - method: downsampling method, 'lttb' (default) or 'minmax'
+
+        returns:
+            json, a chart like /rooms/<id>/chart, plus "phases" and
+            "segments" (the window and rollup resolution of each part).
+            http result code
+        """
+
+        try:
+            max_points = int(request.args.get('max_points', 1000))
+            window = int(request.args.get('window', 24))
+        except ValueError:
+            return {'msg': 'max_points and window must be integers'}, 400
+
+        if max_points < 2 or max_points > self.MAX_POINTS:
+            return {'msg': 'max_points must be from 2 to {}'.format(
+                self.MAX_POINTS)}, 400
+
+        if window < 0 or window > self.MAX_WINDOW:
+            return {'msg': 'window must be from 0 to {}'.format(
+                self.MAX_WINDOW)}, 400
+
+        method = request.args.get('method', 'lttb')
+        if method not in DOWNSAMPLERS:
+            return {'msg': "method must be one of [{}]".format(
+                ",".join(sorted(DOWNSAMPLERS)))}, 400
+
+        grow = Grow.query.get(pk)
+        if not grow:
+            return {'msg': 'Grow id not found'}, 404
+
+        sensors = {s.id: s for s in Sensor.query.filter(
+            Sensor.room_id == grow.room_id)} if grow.room_id else {}
+        if not sensors:
+            return {'msg': 'Grow room has no sensors'}, 404
+
+        phases = grow_phases(grow)
+        start, end = phases[0][1], phases[-1][2]
+        marks = [grow.started, grow.transitioned, grow.ended]
+        segments = plan_timeline(start, end, [m for m in marks if m],
+                                 max_points, window)
+
+        # one axis for all segments, in buckets of the finest resolution.
+        # the axis only has labels where there is data, so coarse segments
+        # do not add empty buckets.
+        grid = TimeGrid(interval=min(
+            [RollupManager.seconds(s.resolution) for s in segments] or [60]))
+        results = timeline_rows(segments, list(sensors), method)
+
+        labels = {}
+        for key in sorted({(r.sensor_id, r.type)
+                           for seg, rows in results for r in rows}):
+            grid.add_series(key)
+            labels[key] = "{} {}".format(sensors[key[0]].name, key[1])
+
+        fahrenheit = settings_snapshot().fahrenheit
+        for seg, rows in results:
+            gap = max(1800, 3 * RollupManager.seconds(seg.resolution),
+                      3 * seg.seconds / seg.points)
+            fill_grid(grid, rows, fahrenheit, by_sensor=True, max_gap=gap)
+
+        if chart_mimetype() == PACKED_MIMETYPE:
+            return Response(pack_chart(grid, labels), mimetype=PACKED_MIMETYPE)
+
+        chart = build_chart(grid, labels)
+        chart['phases'] = [{
+            'phase': name,
+            'start': datetime_for_js(a),
+            'end': datetime_for_js(b),
+        } for name, a, b in phases]
+        chart['segments'] = [{
+            'start': datetime_for_js(s.start),
+            'end': datetime_for_js(s.end),
+            'resolution': s.resolution,
+            'max_points': s.points,
+        } for s in segments]
+
+        return chart, 200
+
+
+class GrowCompareApi(Resource):
+
+    MAX_GROWS = 20
+    MAX_DAYS = 400
+
+    #@jwt_required
+    @conditional(timeline_etag)
+    def get(self):
+        """
+        Compare grows day by day, aligned on their start (or their flip to
+        flowering), from the daily rollups of their room sensors.
+
+        Query args (one of ids or room_id is required):
+            - ids: comma separated grow ids
+            - room_id: compare the latest grows of a room instead
+            - align: 'start' (default) or 'flip'. Day 0 is the day the grows
+              started (or flipped). With 'flip', grows that did not flip
+              are left out.
+            - types: comma separated measurement types (default all but
+              battery)
+            - stat: daily 'mean' (default), 'min' or 'max'
+            - first_day, last_day: grow days to return (default all days
+              of the grows)
+
+        returns:
+            json, like {"days": [0, 1, ...], "metrics": ["humidity", ...],
+            "grows": [{...}], "values": [grow][day][metric]}.
+            http result code
+        """
+
+        align = request.args.get('align', 'start')
+        if align not in ['start', 'flip']:
+            return {'msg': "align must be 'start' or 'flip'"}, 400
+
+        stat = request.args.get('stat', 'mean')
+        if stat not in STATS:
+            return {'msg': "stat must be one of [{}]".format(
+                ",".join(STATS))}, 400
+
+        types = None
+        if request.args.get('types'):
+            types = sorted(set(request.args['types'].split(',')))
+
+        try:
+            if request.args.get('ids'):
+                ids = [int(i) for i in request.args['ids'].split(',')]
+                query = Grow.query.filter(Grow.id.in_(ids))
+            elif request.args.get('room_id'):
+                query = Grow.query.filter(
+                    Grow.room_id == int(request.args['room_id'])).order_by(
+                    Grow.started.desc()).limit(self.MAX_GROWS)
+            else:
+                return {'msg': 'ids or room_id is required'}, 400
+        except ValueError:
+            return {'msg': 'ids and room_id must be integers'}, 400
+
+        grows = sorted(query.all(), key=lambda g: g.started)
+        if not grows:
+            return {'msg': 'no grows found'}, 404
+
+        if len(grows) > self.MAX_GROWS:
+            return {'msg': 'compare at most {} grows'.format(
+                self.MAX_GROWS)}, 400
+
+        windows = []
+        for grow in grows:
+            if align == 'flip' and grow.transitioned is None:
+                continue
+            windows.append(GrowWindow(grow, align))
+
+        if not windows:
+            return {'msg': 'none of the grows flipped to flowering'}, 404
+
+        try:
+            first_day = int(request.args.get(
+                'first_day', min(w.days[0] for w in windows)))
+            last_day = int(request.args.get(
+                'last_day', max(w.days[1] for w in windows)))
+        except ValueError:
+            return {'msg': 'first_day and last_day must be integers'}, 400
+
+        if last_day < first_day or last_day - first_day >= self.MAX_DAYS:
+            return {'msg': 'compare from 1 to {} days'.format(
+                self.MAX_DAYS)}, 400
+
+        rows, sensor_rooms = daily_rows(windows, types)
+        if types is None:
+            types = sorted({r.type for r in rows})
+
+        values = align_days(rows, sensor_rooms, windows, types, first_day,
+                            last_day, stat)
+
+        fahrenheit = settings_snapshot().fahrenheit
+        for grid in values:
+            for day in grid:
+                for m, v in enumerate(day):
+                    if v is None:
+                        continue
+                    if fahrenheit and types[m] == 'temperature':
+                        v = v * 1.8 + 32
+                    day[m] = round(v, 2)
+
+        return {
+            'align': align,
+            'stat': stat,
+            'temperature_unit': 'fahrenheit' if fahrenheit else 'celsius',
+            'days': list(range(first_day, last_day + 1)),
+            'metrics': types,
+            'grows': [{
+                'id': w.grow.id,
+                'name': w.grow.name,
+                'room_id': w.room_id,
+                'started': datetime_for_js(w.grow.started),
+                'transitioned': w.grow.transitioned and datetime_for_js(
+                    w.grow.transitioned),
+                'ended': w.grow.ended and datetime_for_js(w.grow.ended),
+            } for w in windows],
+            'values': values,
+        }, 200
 
 
 api.add_resource(GrowListApi, '')
+api.add_resource(GrowCompareApi, '/compare')
 api.add_resource(GrowApi, '/<int:pk>')
 api.add_resource(GrowApiSwitch, '/<int:pk>/switch')
+api.add_resource(GrowReportApi, '/<int:pk>/report')
+api.add_resource(GrowTimelineApi, '/<int:pk>/timeline')
@@ -0,0 +1,210 @@
+import datetime
+from potnanny_core.database import db_session
+from potnanny_core.models.sensor import Sensor
+from potnanny_api.rollup import MeasurementRollup, RollupManager
+from potnanny_api.timegrid import EPOCH
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAVE_NUMPY = np is not None
+
+STATS = ['mean', 'min', 'max']
+
+
+def epoch_day(dt):
+    """Get the number of days from 1970-01-01 to a (naive UTC) datetime."""
+
+    return (dt - EPOCH).days
+
+
+class GrowWindow(object):
+    """
+    The days of one grow to compare, and the day it is aligned on.
+
+    Initialization args:
+        - Grow
+        - str: align on the grow 'start' or the 'flip' to flowering
+        - datetime: (optional) end of an unfinished grow. default is now
+    raises:
+        ValueError if aligned on the flip, and the grow has not flipped
+    """
+
+    def __init__(self, grow, align='start', now=None):
+        anchor = grow.started if align == 'start' else grow.transitioned
+        if anchor is None:
+            raise ValueError("grow {} has no {} time".format(grow.id, align))
+
+        self.grow = grow
+        self.room_id = grow.room_id
+        self.first = epoch_day(grow.started)
+        self.last = epoch_day(grow.ended or now or datetime.datetime.utcnow())
+        self.anchor = epoch_day(anchor)
+
+    @property
+    def days(self):
+        """The first and last grow day (relative to the anchor)."""
+
+        return self.first - self.anchor, self.last - self.anchor
+
+
+def daily_rows(windows, types):
+    """
+    Query the daily rollups of the room sensors of every grow, plus the
+    measurements not rolled up yet.
+
+    args:
+        - list of GrowWindow
+        - list: (optional) measurement types. Default is every type except
+          'battery'.
+    returns:
+        tuple, (list of (sensor_id, type, bucket, count, sum, min, max)
+        tuples, dict of sensor id: room id)
+    """
+
+    rooms = {w.room_id for w in windows if w.room_id is not None}
+    if not rooms or not windows:
+        return [], {}
+
+    sensor_rooms = dict(db_session.query(Sensor.id, Sensor.room_id).filter(
+        Sensor.room_id.in_(rooms)))
+    if not sensor_rooms:
+        return [], sensor_rooms
+
+    first = EPOCH + datetime.timedelta(days=min(w.first for w in windows))
+    last = EPOCH + datetime.timedelta(days=max(w.last for w in windows))
+    rows = db_session.query(
+        MeasurementRollup.sensor_id, MeasurementRollup.type,
+        MeasurementRollup.bucket, MeasurementRollup.count,
+        MeasurementRollup.sum, MeasurementRollup.min,
+        MeasurementRollup.max).filter(
+        MeasurementRollup.resolution == 'day').filter(
+        MeasurementRollup.sensor_id.in_(list(sensor_rooms))).filter(
+        MeasurementRollup.bucket >= first,
+        MeasurementRollup.bucket <= last)
+    if types is None:
+        rows = rows.filter(MeasurementRollup.type != 'battery')
+    else:
+        rows = rows.filter(MeasurementRollup.type.in_(types))
+
+    # plus the measurements not rolled up yet. align_days adds up rows of
+    # the same day.
+    pending = RollupManager.pending('day', list(sensor_rooms), types, first,
+                                    last)
+    if types is None:
+        pending = [p for p in pending if p.type != 'battery']
+
+    return rows.all() + pending, sensor_rooms
+
+
+def align_days(rows, sensor_rooms, windows, types, first_day, last_day,
+               stat='mean', use_numpy=None):
+    """
+    Aggregate daily rollups per grow, grow day and measurement type.
+
+    A row counts for a grow if its sensor is in the grow's room, and its day
+    is between the grow's start and end. Rows of several sensors on the same
+    day are combined (the mean is weighted by measurement count).
+
+    args:
+        - list of daily rollup rows (see daily_rows)
+        - dict: sensor id: room id
+        - list of GrowWindow
+        - list of measurement types (the metrics)
+        - int: first grow day, relative to each grow's anchor day
+        - int: last grow day
+        - str: (mean|min|max)
+        - bool: (optional) force numpy on or off. Default is on, if installed.
+    returns:
+        list (grows) of lists (days) of lists (metrics) of floats, or None
+        where there is no data
+    """
+
+    use_numpy = HAVE_NUMPY if use_numpy is None else use_numpy
+    if stat not in STATS:
+        raise ValueError("stat must be one of {}".format(STATS))
+
+    ndays = last_day - first_day + 1
+    nmetrics = len(types)
+    codes = {t: i for i, t in enumerate(types)}
+
+    if use_numpy:
+        count = len(rows)
+        room = np.fromiter((sensor_rooms.get(r[0], -1) for r in rows),
+                           dtype=np.int64, count=count)
+        code = np.fromiter((codes[r[1]] for r in rows), dtype=np.int64,
+                           count=count)
+        day = np.fromiter((epoch_day(r[2]) for r in rows), dtype=np.int64,
+                          count=count)
+        column = {'mean': 4, 'min': 5, 'max': 6}[stat]
+        value = np.fromiter((r[column] for r in rows), dtype=np.float64,
+                            count=count)
+        weight = np.fromiter((r[3] for r in rows), dtype=np.float64,
+                             count=count)
+
+        results = []
+        for w in windows:
+            mask = (room == w.room_id) & (day >= w.first) & (day <= w.last)
+            d = day[mask] - w.anchor - first_day
+            keep = (d >= 0) & (d < ndays)
+            idx = d[keep] * nmetrics + code[mask][keep]
+            v = value[mask][keep]
+
+            if stat == 'mean':
+                sums = np.zeros(ndays * nmetrics)
+                counts = np.zeros(ndays * nmetrics)
+                np.add.at(sums, idx, v)
+                np.add.at(counts, idx, weight[mask][keep])
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    out = sums / counts
+            elif stat == 'min':
+                out = np.full(ndays * nmetrics, np.inf)
+                np.minimum.at(out, idx, v)
+            else:
+                out = np.full(ndays * nmetrics, -np.inf)
+                np.maximum.at(out, idx, v)
+
+            out[~np.isfinite(out)] = np.nan
+            out = out.reshape(ndays, nmetrics).tolist()
+            results.append([[None if x != x else x for x in r] for r in out])
+
+        return results
+
+    results = []
+    for w in windows:
+        acc = {}
+        for sensor_id, mtype, bucket, count, total, lo, hi in rows:
+            day = epoch_day(bucket)
+            if sensor_rooms.get(sensor_id) != w.room_id or \
+                    not w.first <= day <= w.last:
+                continue
+
+            d = day - w.anchor - first_day
+            if not 0 <= d < ndays:
+                continue
+
+            key = (d, codes[mtype])
+            item = acc.get(key)
+            if item is None:
+                acc[key] = [total, count, lo, hi]
+                continue
+
+            item[0] += total
+            item[1] += count
+            item[2] = min(item[2], lo)
+            item[3] = max(item[3], hi)
+
+        matrix = [[None] * nmetrics for i in range(ndays)]
+        for (d, m), (total, count, lo, hi) in acc.items():
+            if stat == 'mean':
+                matrix[d][m] = total / count if count else None
+            elif stat == 'min':
+                matrix[d][m] = lo
+            else:
+                matrix[d][m] = hi
+
+        results.append(matrix)
+
+    return results
@@ -0,0 +1,48 @@
+import json
+from potnanny_core.models.schedule import RoomLightManager
+from potnanny_api.jobs import runner
+from potnanny_api.versions import TableVersions
+from potnanny_api.grow_report import save_report
+
+
+@runner.task('grow_phase')
+def switch_phase(room_id, phase):
+    """
+    Switch the light schedules of a room to a grow phase.
+
+    args:
+        - int: room id
+        - str: (growth|flowering)
+    returns:
+        dict, with the room id and its light phase afterwards
+    raises:
+        ValueError if the room is not found, or the phase is invalid
+    """
+
+    mgr = RoomLightManager(room_id)
+    if mgr.schedules():
+        TableVersions.bump('schedules')
+        mgr.switch_to_phase(phase)
+
+    return {'room_id': room_id, 'phase': mgr.current_phase()}
+
+
+@runner.task('grow_report')
+def build_report(grow_id):
+    """
+    Build and store the summary report of a grow.
+
+    args:
+        - int: grow id
+    returns:
+        dict, with the grow id and the number of measurements summarized
+    raises:
+        ValueError if the grow is not found
+    """
+
+    report = save_report(grow_id)
+    return {
+        'grow_id': grow_id,
+        'report_id': report.id,
+        'measurements': json.loads(report.data)['measurements'],
+    }
@@ -0,0 +1,141 @@
+import datetime
+from potnanny_api.rollup import RollupManager
+from potnanny_api.chart_utils import downsample_measurements
+
+
+class TimelineSegment(object):
+    """
+    A time window of a grow timeline, charted at one rollup resolution.
+
+    Initialization args:
+        - datetime: start
+        - datetime: end (exclusive)
+        - bool: focus. True for a window around a phase transition
+    """
+
+    def __init__(self, start, end, focus=False):
+        self.start = start
+        self.end = end
+        self.focus = focus
+        self.points = 2
+        self.resolution = None
+
+    def __repr__(self):
+        return "<TimelineSegment({},{},{})>".format(
+            self.start, self.end, self.resolution)
+
+    @property
+    def seconds(self):
+        return (self.end - self.start).total_seconds()
+
+
+def merge_windows(windows):
+    """
+    Merge overlapping (start, end) windows.
+
+    args:
+        - list of (datetime, datetime) tuples
+    returns:
+        list of (datetime, datetime) tuples, sorted, not overlapping
+    """
+
+    results = []
+    for start, end in sorted(windows):
+        if results and start <= results[-1][1]:
+            results[-1] = (results[-1][0], max(end, results[-1][1]))
+        else:
+            results.append((start, end))
+
+    return results
+
+
+def plan_timeline(start, end, marks, max_points, window=24, focus_share=0.5):
+    """
+    Split a grow into segments, and choose a rollup resolution and a point
+    budget for each one.
+
+    Windows of 'window' hours on both sides of each mark (the phase
+    transitions) are focus segments. They share 'focus_share' of the point
+    budget, the rest of the grow shares the remainder, both in proportion
+    to duration. So a few days around a transition get about as many
+    points as the months between them.
+
+    Each segment uses the coarsest rollup that still has as many buckets as
+    its budget (see RollupManager.choose), minute rollups at the finest, and
+    is downsampled to its budget from there.
+    Segment bounds are moved back to the bucket edges of the coarser
+    neighbour, so no bucket is charted twice.
+
+    args:
+        - datetime: start of the grow
+        - datetime: end of the grow (or now)
+        - list of datetimes: phase transitions
+        - int: point budget per series, for the whole timeline
+        - int: hours around each transition to chart finer (0 for none)
+        - float: share of the budget for the focus segments
+    returns:
+        list of TimelineSegment, sorted
+    """
+
+    delta = datetime.timedelta(hours=window)
+    windows = []
+    if window > 0:
+        windows = merge_windows([(max(m - delta, start), min(m + delta, end))
+                                 for m in marks if start <= m <= end])
+
+    segments = []
+    when = start
+    for a, b in windows:
+        if a > when:
+            segments.append(TimelineSegment(when, a))
+        segments.append(TimelineSegment(a, b, focus=True))
+        when = b
+    if when < end or not segments:
+        segments.append(TimelineSegment(when, end))
+
+    totals = {True: 0.0, False: 0.0}
+    for seg in segments:
+        totals[seg.focus] += seg.seconds
+
+    shares = {True: focus_share, False: 1.0 - focus_share}
+    if not totals[True] or not totals[False]:
+        shares = {True: 1.0, False: 1.0}
+
+    for seg in segments:
+        if totals[seg.focus]:
+            seg.points = max(2, int(max_points * shares[seg.focus] *
+                                    seg.seconds / totals[seg.focus]))
+
+        seg.resolution = RollupManager.choose(
+            seg.start, seg.end, seg.points) or 'minute'
+
+    for a, b in zip(segments, segments[1:]):
+        coarser = max(a.resolution, b.resolution, key=RollupManager.seconds)
+        b.start = a.end = max(RollupManager.floor(b.start, coarser), a.start)
+
+    return [s for s in segments if s.end > s.start]
+
+
+def timeline_rows(segments, sensor_ids, method='lttb'):
+    """
+    Query the rollups of each timeline segment, downsampled to its budget.
+
+    args:
+        - list of TimelineSegment
+        - list of sensor ids
+        - str: downsampling method ('lttb'|'minmax')
+    returns:
+        list of tuples, like (TimelineSegment, rows). rows like
+        ChartQuery.rows (battery measurements excluded)
+    """
+
+    results = []
+    for i, seg in enumerate(segments):
+        last = i + 1 == len(segments)
+        rows = [r for r in RollupManager.query(seg.resolution, sensor_ids,
+                                               None, seg.start, seg.end)
+                if r.type != 'battery' and (last or r.created < seg.end)]
+        results.append((seg, downsample_measurements(rows, seg.points,
+                                                     method)))
+
+    return results
@@ -0,0 +1,52 @@
+from flask import Blueprint, request
+from flask_restful import Api, Resource
+from flask_jwt_extended import jwt_required
+
+from potnanny_core.database import db_session
+from potnanny_api.crud import CrudInterface
+from potnanny_api.jobs import Job, JobSchema
+from potnanny_api.querycount import query_budget
+
+bp = Blueprint('job_api', __name__, url_prefix='/api/1.0/jobs')
+api = Api(bp)
+# not cached. job status changes in background threads, without a bump
+ifc = CrudInterface(db_session, Job, JobSchema,
+                    filters=['name', 'status'],
+                    sorts=['name', 'created'])
+
+
+class JobListApi(Resource):
+
+    # @jwt_required
+    @query_budget
+    def get(self):
+        ser, err, code = ifc.get(args=request.args)
+        if err:
+            return err, code
+
+        return ser, code
+
+
+class JobApi(Resource):
+
+    # @jwt_required
+    def get(self, pk):
+        """
+        Get the status of a background job. Poll until the status is 'done'
+        or 'failed'.
+
+        args:
+            - int: job id
+        returns:
+            json, http result code
+        """
+
+        ser, err, code = ifc.get(pk, request.args)
+        if err:
+            return err, code
+
+        return ser, code
+
+
+api.add_resource(JobListApi, '')
+api.add_resource(JobApi, '/<int:pk>')
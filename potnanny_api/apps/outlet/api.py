@@ -1,31 +1,85 @@
+import time
 from flask import Blueprint, request, current_app
 from flask_restful import Api, Resource
 from flask_jwt_extended import jwt_required
 
+from potnanny_core.database import db_session
 from potnanny_core.models.outlet import OutletController, Outlet
 from potnanny_core.models.wireless import WirelessInterface
 from potnanny_core.schemas.outlet import GenericOutletSchema, OutletSchema
+from potnanny_api.apps.outlet.batch import switch_outlets, commands
+from potnanny_api.apps.outlet.discovery import OutletDiscovery
 
 bp = Blueprint('outlet_api', __name__, url_prefix='/api/1.0/outlets')
 api = Api(bp)
 oc = OutletController()
+discovery = OutletDiscovery(oc)
+
+
+def discovery_args():
+    """
+    Get the discovery cache settings for this request. 'refresh=1' in the
+    query args skips the cache.
+
+    returns:
+        dict, of keyword args for OutletDiscovery.get()
+    """
+
+    return {
+        'ttl': current_app.config['OUTLET_DISCOVERY_TTL'],
+        'max_age': current_app.config['OUTLET_DISCOVERY_MAX_AGE'],
+        'refresh': request.args.get('refresh') in ['1', 'true'],
+    }
+
+
+def switch_args():
+    """
+    Get the switch settings for this request. 'force=1' in the query args
+    sends commands even if outlets are known to be in that state.
+
+    returns:
+        dict, of keyword args for switch_outlets()
+    """
+
+    return {
+        'max_workers': current_app.config['OUTLET_SWITCH_WORKERS'],
+        'state_ttl': current_app.config['OUTLET_STATE_TTL'],
+        'force': request.args.get('force') in ['1', 'true'],
+    }
+
+
+def record_states(results):
+    """Update the discovery cache with the outlets that were switched."""
+
+    for r in results:
+        if r['ok']:
+            discovery.set_state(r['type'], r['id'], r['state'])
+
 
 class OutletListApi(Resource):
     """Class to interface with Generic Power Outlets."""
 
     @jwt_required
     def get(self):
-        """Get list of all available outlets."""
+        """
+        Get list of all available outlets.
 
-        results = oc.available_outlets()
-        if not results:
-            return {'msg': 'no outlets found'}, 404
+        The list is cached (see OutletDiscovery). The X-Outlets-Age header
+        has its age in seconds.
 
-        data, errors = GenericOutletSchema(many=True).load(results)
-        if errors:
-            return errors, 400
+        Optional query args:
+            - refresh: 1 to discover outlets again, instead of using the cache
+        """
 
-        return data, 200
+        try:
+            data, age = discovery.get(**discovery_args())
+        except RuntimeError as x:
+            return {'msg': str(x)}, 503
+
+        if not data:
+            return {'msg': 'no outlets found'}, 404
+
+        return data, 200, {'X-Outlets-Age': str(age)}
 
     @jwt_required
     def post(self):
@@ -38,8 +92,9 @@ class OutletListApi(Resource):
         obj = Outlet(**data)
         db_session.add(obj)
         db_session.commit()
+        discovery.invalidate()
 
-        return OutletSchema().dump(obj), 200
+        return OutletSchema().dump(obj).data, 200
 
 
 class OutletApi(Resource):
@@ -56,14 +111,18 @@ class OutletApi(Resource):
             json, http result code
         """
 
-        outlet = oc.get_outlet(id)
+        try:
+            outlet = discovery.find(id, **discovery_args())
+        except RuntimeError as x:
+            return {'msg': str(x)}, 503
+
         if outlet is None:
             return {'msg': 'outlet not found'}, 404
 
         return outlet, 200
 
     @jwt_required
-    def put(self, pk):
+    def put(self, id):
         """
         Edit details of a Wireless Outlet with id.
 
@@ -73,29 +132,31 @@ class OutletApi(Resource):
             json, http result code
         """
 
-        if type(pk) is not int and not pk.isdigit():
+        if type(id) is not int and not id.isdigit():
             return {'msg': 'invalid outlet id for this operation'}, 400
 
         data, errors = OutletSchema().load(request.get_json())
         if errors:
             return errors, 400
 
-        obj = Outlet.query.get(int(pk))
+        obj = Outlet.query.get(int(id))
         if not obj:
-            return {'msg': 'object with id %s not found' % pk}, 404
+            return {'msg': 'object with id %s not found' % id}, 404
 
         for k, v in data.items():
             setattr(obj, k, v)
 
         db_session.commit()
-        data, errors = OutletSchema().load(obj)
+        discovery.invalidate()
+        commands.forget('wireless', id)
+        data, errors = OutletSchema().dump(obj)
         if errors:
             return errors, 400
 
         return data, 200
 
     @jwt_required
-    def delete(self, pk):
+    def delete(self, id):
         """
         Delete a Wireless Outlet with id.
 
@@ -105,14 +166,19 @@ class OutletApi(Resource):
             json, http result code
         """
 
-        if type(pk) is not int and not pk.isdigit():
+        if type(id) is not int and not id.isdigit():
             return {'msg': 'invalid outlet id for this operation'}, 400
 
-        ser, err, code = ifc.delete(int(pk))
-        if err:
-            return err, code
+        obj = Outlet.query.get(int(id))
+        if not obj:
+            return {'msg': 'object with id %s not found' % id}, 404
+
+        db_session.delete(obj)
+        db_session.commit()
+        discovery.invalidate()
+        commands.forget('wireless', id)
 
-        return ser, code
+        return "", 204
 
 
 class OutletSwitchApi(Resource):
@@ -120,21 +186,128 @@ class OutletSwitchApi(Resource):
 
     @jwt_required
     def post(self):
-        """Accept post data to switch outlet state to 1 (on) or 0 (off)."""
+        """
+        Accept post data to switch outlet state to 1 (on) or 0 (off).
+
+        Optional query args:
+            - force: 1 to send the command even if the outlet is known to
+              be in that state already
+        """
 
         data, errors = GenericOutletSchema().load(request.get_json())
         if errors:
             return errors, 400
 
-        oc = OutletController()
-        result = oc.switch_outlet(data)
+        result = switch_outlets(
+            [data],
+            timeout=current_app.config['OUTLET_SWITCH_TIMEOUT'],
+            **switch_args())[0]
+        record_states([result])
 
-        if result:
+        if result['ok']:
             return data, 200
         else:
             return {'msg': 'failed to switch outlet'}, 500
 
 
+class OutletSwitchBatchApi(Resource):
+    """Class to switch many outlets at once."""
+
+    MAX_OUTLETS = 50
+
+    @jwt_required
+    def post(self):
+        """
+        Switch many outlets concurrently.
+
+        Post a list of outlets, like:
+            [{"id": "1", "type": "wireless", "state": 0}, ...]
+
+        Optional query args:
+            - timeout: seconds every command must finish in
+            - force: 1 to send commands even if outlets are known to be in
+              that state already
+
+        returns:
+            json, with per-outlet results and timings. http result code
+            is 200 if all outlets were switched, 500 otherwise.
+        """
+
+        items = request.get_json()
+        if not isinstance(items, list) or not items:
+            return {'msg': 'expected a list of outlets'}, 400
+
+        if len(items) > self.MAX_OUTLETS:
+            return {'msg': 'at most {} outlets allowed'.format(
+                self.MAX_OUTLETS)}, 400
+
+        max_timeout = current_app.config['OUTLET_SWITCH_TIMEOUT']
+        try:
+            timeout = float(request.args.get('timeout', max_timeout))
+        except ValueError:
+            timeout = 0
+
+        if timeout <= 0 or timeout > max_timeout:
+            return {'msg': 'timeout must be more than 0, and at most {}'.format(
+                max_timeout)}, 400
+
+        outlets = []
+        seen = set()
+        errors = {}
+        for i, item in enumerate(items):
+            if isinstance(item, dict) and type(item.get('id')) is int:
+                item['id'] = str(item['id'])
+
+            data, err = GenericOutletSchema().load(item)
+            if not err and data.get('state') not in [0, 1, True, False]:
+                err = {'state': ['must be 0 or 1']}
+            if not err and (data['type'], data['id']) in seen:
+                err = {'id': ['outlet is listed more than once']}
+
+            if err:
+                errors[i] = err
+                continue
+
+            seen.add((data['type'], data['id']))
+            outlets.append(data)
+
+        if errors:
+            return errors, 400
+
+        started = time.monotonic()
+        results = switch_outlets(outlets, timeout=timeout, **switch_args())
+        record_states(results)
+
+        code = 200
+        if not all(r['ok'] for r in results):
+            code = 500
+
+        return {
+            'results': results,
+            'ms': round((time.monotonic() - started) * 1000, 1),
+        }, code
+
+
+class OutletQueueApi(Resource):
+    """Class to monitor the outlet command queue."""
+
+    @jwt_required
+    def get(self):
+        """
+        Get outlet command queue and discovery cache counters.
+
+        returns:
+            json, http result code
+        """
+
+        return {
+            'commands': commands.stats(),
+            'discovery': discovery.stats(),
+        }, 200
+
+
 api.add_resource(OutletListApi, '')
 api.add_resource(OutletApi, '/<id>')
 api.add_resource(OutletSwitchApi, '/switch')
+api.add_resource(OutletSwitchBatchApi, '/switch/batch')
+api.add_resource(OutletQueueApi, '/queue')
@@ -0,0 +1,116 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from potnanny_core.models.outlet import OutletController
+from potnanny_api.apps.outlet.commands import OutletCommandQueue
+
+VESYNC_TYPES = ['vesync', 'wifi-switch']
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+commands = OutletCommandQueue()
+
+
+def executor(name, max_workers):
+    """
+    Get a shared thread pool for outlet commands.
+
+    Vesync commands use the 'outlet' pool. Wireless commands use the 'rf'
+    pool, with a single thread, because there is one 433Mhz transmitter
+    and codes sent at the same time would garble each other.
+
+    args:
+        - str: pool name
+        - int: number of worker threads (only used on the first call)
+    returns:
+        ThreadPoolExecutor
+    """
+
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=name)
+
+        return _pools[name]
+
+
+def switch_outlets(outlets, timeout=10, max_workers=4, force=False,
+                   state_ttl=60):
+    """
+    Switch many outlets concurrently.
+
+    Commands go through the shared OutletCommandQueue, so commands for an
+    outlet that is already being switched are coalesced, and commands for
+    its last known state are skipped. Vesync commands run in parallel on a
+    bounded thread pool. Wireless commands share the RF transmitter, so
+    they are sent one at a time, in order. Every command must finish within
+    'timeout' seconds of the call. A command that misses its deadline is
+    reported as timed out (the transmitter or Vesync call itself cannot be
+    interrupted).
+
+    args:
+        - list of dicts, like {'id': '1', 'type': 'wireless', 'state': 1}
+        - float: seconds
+        - int: thread pool size
+        - bool: send commands even if outlets are known to be in that state
+        - float: seconds a known outlet state is trusted for
+    returns:
+        list of dicts, one per outlet in order, like
+        {'id': '1', 'type': 'wireless', 'state': 1, 'ok': True,
+         'error': None, 'ms': 212.5, 'command': 'queued'}
+        'command' is 'queued', 'coalesced' or 'skipped'. For coalesced
+        commands, 'state' is the final state that was sent.
+    """
+
+    start = time.monotonic()
+    deadline = start + timeout
+
+    oc = OutletController()
+    vesync_error = None
+    if any(o['type'] in VESYNC_TYPES for o in outlets):
+        try:
+            oc.init_vesync()
+        except Exception as x:
+            vesync_error = str(x)
+
+    futures = []
+    for outlet in outlets:
+        if outlet['type'] in VESYNC_TYPES:
+            if vesync_error:
+                futures.append((None, None))
+                continue
+
+            pool = executor('outlet', max_workers)
+        else:
+            pool = executor('rf', 1)
+
+        futures.append(commands.submit(oc, outlet, deadline, pool,
+                                       force=force, state_ttl=state_ttl))
+
+    results = []
+    for outlet, (future, how) in zip(outlets, futures):
+        result = {
+            'id': outlet['id'],
+            'type': outlet['type'],
+            'state': outlet['state'],
+            'ok': False,
+            'error': vesync_error,
+            'ms': 0.0,
+            'command': how,
+        }
+
+        if future is not None:
+            try:
+                ok, error, ms, state = future.result(
+                    timeout=max(0, deadline - time.monotonic()))
+                result.update(ok=ok, error=error, ms=ms, state=state)
+            except TimeoutError:
+                # the future may be shared with other callers, so it is not
+                # cancelled. the queue drops the command once it is late.
+                result.update(error='timed out',
+                              ms=round((time.monotonic() - start) * 1000, 1))
+
+        results.append(result)
+
+    return results
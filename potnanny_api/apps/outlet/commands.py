@@ -0,0 +1,226 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from potnanny_core.database import db_session
+
+logger = logging.getLogger(__name__)
+
+
+class Command(object):
+    """
+    One queued switch command.
+
+    Initialization args:
+        - OutletController
+        - dict, like {'id': '1', 'type': 'wireless', 'state': 1}
+        - float: time.monotonic() the command must be sent by
+        - ThreadPoolExecutor to run it on
+        - bool: send even if the outlet is known to be in this state
+    """
+
+    def __init__(self, controller, outlet, deadline, pool, force=False):
+        self.controller = controller
+        self.outlet = outlet
+        self.deadline = deadline
+        self.pool = pool
+        self.force = force
+        self.future = Future()
+
+    @property
+    def state(self):
+        return int(self.outlet['state'])
+
+
+    def run(self):
+        """
+        Send the command, unless its deadline has passed.
+
+        returns:
+            tuple, of (bool ok, str error or None, float milliseconds, bool sent)
+        """
+
+        started = time.monotonic()
+        if started >= self.deadline:
+            # waited in the queue too long. don't send a late command.
+            return False, 'timed out', 0.0, False
+
+        try:
+            ok = self.controller.switch_outlet(self.outlet)
+            error = None if ok else 'failed to switch outlet'
+        except Exception as x:
+            logger.warning("switching outlet {} failed: {}".format(
+                self.outlet, x))
+            ok, error = False, str(x)
+        finally:
+            # worker threads get their own scoped session. don't leak it.
+            db_session.remove()
+
+        return ok, error, round((time.monotonic() - started) * 1000, 1), True
+
+
+class OutletCommandQueue(object):
+    """
+    Per-outlet queue of switch commands.
+
+    Each outlet has at most one command running, and at most one waiting.
+    Commands for an outlet that already has one waiting are coalesced into
+    it, so rapid toggles only send the final state. A command for the state
+    that is already being sent joins it. A command for the last known
+    state of an idle outlet is skipped (known states expire, because
+    schedules and actions also switch outlets outside of the API).
+
+    Submitters get a concurrent.futures.Future, which is shared by every
+    coalesced command, with a (ok, error, ms, state) result. 'state' is the
+    state that was actually sent.
+
+    Usage:
+        >>> commands = OutletCommandQueue()
+        >>> future, how = commands.submit(oc, outlet, deadline, pool)
+        >>> ok, error, ms, state = future.result(timeout=10)
+    """
+
+    def __init__(self):
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.failed = 0
+        self._slots = {}
+        self._known = {}
+        self._lock = threading.Lock()
+
+
+    def submit(self, controller, outlet, deadline, pool, force=False,
+               state_ttl=60):
+        """
+        Queue a switch command.
+
+        args:
+            - OutletController
+            - dict, like {'id': '1', 'type': 'wireless', 'state': 1}
+            - float: time.monotonic() the command must be sent by
+            - ThreadPoolExecutor to run it on
+            - bool: send even if the outlet is known to be in this state
+            - float: seconds a known outlet state is trusted for
+        returns:
+            tuple, of (Future, str) where the str is how the command was
+            handled: 'queued', 'coalesced' or 'skipped'
+        """
+
+        key = (outlet['type'], str(outlet['id']))
+        cmd = Command(controller, dict(outlet), deadline, pool, force)
+        with self._lock:
+            self.submitted += 1
+            running, waiting = self._slots.get(key, (None, None))
+
+            if waiting is not None:
+                # replace the waiting command with this one. the final
+                # state is all that matters.
+                self.coalesced += 1
+                waiting.controller = controller
+                waiting.outlet = cmd.outlet
+                waiting.deadline = max(waiting.deadline, deadline)
+                waiting.force = waiting.force or force
+                return waiting.future, 'coalesced'
+
+            if running is not None:
+                if running.state == cmd.state and not force:
+                    self.coalesced += 1
+                    return running.future, 'coalesced'
+
+                self._slots[key] = (running, cmd)
+                return cmd.future, 'queued'
+
+            if not force and self._known_state(key, state_ttl) == cmd.state:
+                self.skipped += 1
+                cmd.future.set_result((True, None, 0.0, cmd.state))
+                return cmd.future, 'skipped'
+
+            self._slots[key] = (cmd, None)
+
+        pool.submit(self._run, key, cmd)
+        return cmd.future, 'queued'
+
+
+    def forget(self, type=None, id=None):
+        """
+        Forget known outlet states, so the next command is always sent.
+
+        args:
+            - str: (optional) outlet type. forget all outlets if not set.
+            - str: (optional) outlet id
+        returns:
+            none
+        """
+
+        with self._lock:
+            if type is None:
+                self._known.clear()
+            else:
+                self._known.pop((type, str(id)), None)
+
+
+    def stats(self):
+        """
+        Get queue counters.
+
+        returns:
+            dict
+        """
+
+        with self._lock:
+            running = len(self._slots)
+            waiting = sum(1 for r, w in self._slots.values() if w)
+            return {
+                'depth': running + waiting,
+                'running': running,
+                'waiting': waiting,
+                'submitted': self.submitted,
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'skipped': self.skipped,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+
+    def _known_state(self, key, state_ttl):
+        known = self._known.get(key)
+        if known is None or time.monotonic() - known[1] > state_ttl:
+            return None
+
+        return known[0]
+
+
+    def _run(self, key, cmd):
+        ok, error, ms, sent = cmd.run()
+        with self._lock:
+            if not sent:
+                self.dropped += 1
+            elif ok:
+                self.sent += 1
+                self._known[key] = (cmd.state, time.monotonic())
+            else:
+                self.sent += 1
+                self.failed += 1
+                self._known.pop(key, None)
+
+            running, waiting = self._slots.pop(key)
+            if (waiting is not None and ok and not waiting.force and
+                    waiting.state == cmd.state):
+                # toggled back to the state that was just sent
+                self.skipped += 1
+                skipped, waiting = waiting, None
+            else:
+                skipped = None
+
+            if waiting is not None:
+                self._slots[key] = (waiting, None)
+
+        cmd.future.set_result((ok, error, ms, cmd.state))
+        if skipped is not None:
+            skipped.future.set_result((True, None, 0.0, skipped.state))
+        if waiting is not None:
+            waiting.pool.submit(self._run, key, waiting)
@@ -0,0 +1,200 @@
+import copy
+import time
+import logging
+import threading
+from potnanny_core.database import db_session
+from potnanny_core.schemas.outlet import GenericOutletSchema
+
+logger = logging.getLogger(__name__)
+
+
+class OutletDiscovery(object):
+    """
+    Cache of the outlets an OutletController can find.
+
+    Discovery asks the Vesync cloud for its outlets and reads the wireless
+    outlets from the database, which can take seconds. The result is kept
+    in memory, with stale-while-revalidate semantics:
+        - fresher than 'ttl': returned as is.
+        - older than 'ttl': returned as is, and a background thread
+          refreshes it for the next caller.
+        - older than 'max_age', missing, or refresh requested: discovered
+          again before returning.
+
+    Only one discovery runs at a time. Callers that need a fresh list while
+    one is running wait for it, instead of starting another.
+
+    Usage:
+        >>> discovery = OutletDiscovery(OutletController())
+        >>> outlets, age = discovery.get(ttl=60)
+
+    Initialization args:
+        - OutletController
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.refreshes = 0
+        self.failures = 0
+        self._outlets = None
+        self._updated = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._discover_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+
+    def get(self, ttl=60, max_age=3600, refresh=False):
+        """
+        Get the list of available outlets.
+
+        args:
+            - float: seconds the list is fresh for
+            - float: seconds a stale list may still be returned for
+            - bool: discover now, even if the list is fresh
+        returns:
+            tuple, of (list of outlet dicts, age of the list in seconds)
+        raises:
+            RuntimeError if discovery fails and there is no list to return
+        """
+
+        with self._lock:
+            age = self._age()
+
+        if refresh or age is None or age > max_age:
+            self._discover()
+        elif age > ttl:
+            self._start_refresher()
+            self._wake.set()
+
+        with self._lock:
+            if self._outlets is None:
+                raise RuntimeError("outlet discovery failed")
+
+            return copy.deepcopy(self._outlets), round(self._age(), 1)
+
+
+    def find(self, id, **kwargs):
+        """
+        Get one outlet from the list of available outlets.
+
+        args:
+            - str: outlet id
+            - keyword args for get()
+        returns:
+            outlet dict, or None
+        """
+
+        outlets, age = self.get(**kwargs)
+        for outlet in outlets:
+            if outlet.get('id') == str(id):
+                return outlet
+
+        return None
+
+
+    def set_state(self, type, id, state):
+        """
+        Record the new state of an outlet that was just switched, so the
+        cached list stays correct without discovering again.
+
+        args:
+            - str: outlet type
+            - str: outlet id
+            - int: state (0|1)
+        returns:
+            none
+        """
+
+        with self._lock:
+            for outlet in self._outlets or []:
+                if outlet.get('type') == type and outlet.get('id') == str(id):
+                    outlet['state'] = int(state)
+
+
+    def invalidate(self):
+        """
+        Drop the cached list. Call after adding, editing or deleting an
+        outlet. A discovery already running does not store its result.
+        """
+
+        with self._lock:
+            self._outlets = None
+            self._updated = None
+            self._generation += 1
+
+
+    def stats(self):
+        """
+        Get discovery counters.
+
+        returns:
+            dict
+        """
+
+        with self._lock:
+            return {
+                'outlets': None if self._outlets is None else len(self._outlets),
+                'age': self._age(),
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+            }
+
+
+    def _age(self):
+        if self._updated is None:
+            return None
+
+        return time.monotonic() - self._updated
+
+
+    def _discover(self):
+        with self._lock:
+            generation = self._generation
+            started = self._updated
+
+        with self._discover_lock:
+            with self._lock:
+                if self._updated is not None and self._updated != started:
+                    # another thread discovered while this one waited
+                    return
+
+            try:
+                results = self.controller.available_outlets()
+                outlets, errors = GenericOutletSchema(many=True).load(results)
+                if errors:
+                    raise ValueError(errors)
+            except Exception as x:
+                logger.warning("outlet discovery failed: {}".format(x))
+                with self._lock:
+                    self.failures += 1
+                return
+
+            with self._lock:
+                self.refreshes += 1
+                if generation == self._generation:
+                    self._outlets = outlets
+                    self._updated = time.monotonic()
+
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._thread = threading.Thread(
+                target=self._refresh_loop, name='outlet-discovery',
+                daemon=True)
+            self._thread.start()
+
+
+    def _refresh_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self._discover()
+            finally:
+                # the refresher thread gets its own scoped session
+                db_session.remove()
@@ -1,5 +1,6 @@
-from flask import Blueprint, request, url_for, jsonify
+from flask import Blueprint, request, url_for, jsonify, Response
 from flask_restful import Api, Resource
+from sqlalchemy.orm import selectinload
 from flask_jwt_extended import jwt_required
 
 from potnanny_core.database import db_session
@@ -7,17 +8,47 @@ from potnanny_core.models.room import Room
 from potnanny_core.schemas.room import RoomSchema
 from potnanny_core.models.schedule import ScheduleOnOff, RoomLightManager
 from potnanny_core.schemas.outlet import GenericOutletSchema
+from potnanny_core.models.sensor import Sensor
+from potnanny_core.models.action import Action
+from potnanny_core.models.trigger import Trigger
+from potnanny_core.models.grow import Grow
+from potnanny_core.models.measurement import Measurement
+from potnanny_api.settings import settings_snapshot
 from potnanny_api.crud import CrudInterface
+from potnanny_api.grow_report import GrowReport
+from potnanny_api.versions import TableVersions
+from potnanny_api.conditional import conditional
+from potnanny_api.querycount import query_budget
+from potnanny_api.prefetch import prefetch_rooms
+from potnanny_api.streams import sse_response
+from potnanny_api.chart_utils import (PACKED_MIMETYPE, ChartQuery,
+    build_chart, build_delta, chart_etag, chart_mimetype, fill_grid,
+    pack_chart)
 
 bp = Blueprint('room_api', __name__, url_prefix='/api/1.0/rooms')
 api = Api(bp)
-ifc = CrudInterface(db_session, Room, RoomSchema)
+# short cache, rooms include live environment readings
+ifc = CrudInterface(db_session, Room, RoomSchema,
+                    depends=[Sensor, Action, Grow, ScheduleOnOff, Measurement],
+                    filters=['name'], sorts=['name', 'created'],
+                    cache_ttl=10,
+                    loader_options=[
+                        selectinload(Room.sensors),
+                        selectinload(Room.actions).selectinload(Action.triggers),
+                        selectinload(Room.grows),
+                        selectinload(Room.schedules),
+                    ],
+                    prefetch=prefetch_rooms,
+                    cascades=[Sensor, Action, Trigger, ScheduleOnOff, Grow,
+                              GrowReport])
 
 class RoomListApi(Resource):
 
     # @jwt_required
+    @query_budget
+    @conditional(ifc.etag)
     def get(self):
-        ser, err, code = ifc.get()
+        ser, err, code = ifc.get(args=request.args)
         if err:
             return err, code
 
@@ -39,8 +70,9 @@ class RoomListApi(Resource):
 class RoomApi(Resource):
 
     # @jwt_required
+    @conditional(ifc.etag)
     def get(self, pk):
-        ser, err, code = ifc.get(pk)
+        ser, err, code = ifc.get(pk, request.args)
         if err:
             return err, code
 
@@ -89,6 +121,10 @@ class RoomLightApi(Resource):
 
             mgr = RoomLightManager(pk)
             mgr.create_default_schedules(outlet)
+            # that commits several times. bump once it is done, so nothing
+            # cached in between outlives it
+            TableVersions.bump('schedules')
+            db_session.commit()
             data, errors = RoomLightManagerSchema().load(mgr)
             if errors:
                 return errors, 400
@@ -129,6 +165,96 @@ class RoomLightApi(Resource):
         return ser, code
 
 
+class RoomChartApi(Resource):
+
+    # @jwt_required
+    @conditional(chart_etag)
+    def get(self, pk, prev_hours=12):
+        """
+        Chart the measurements of every sensor in a room, read with a single
+        query. There is one series per sensor and measurement type.
+
+        Query args are described in chart_utils.ChartQuery. Send
+        'Accept: application/x-potnanny-chart' for the packed binary format,
+        or 'since' for a delta (see chart_utils.build_delta).
+        """
+
+        fahrenheit = settings_snapshot().fahrenheit
+
+        try:
+            cq = ChartQuery(request.args, prev_hours)
+        except ValueError as x:
+            return {'msg': str(x)}, 400
+
+        room = Room.query.get(pk)
+        if not room:
+            return {'msg': 'Room with id {} not found'.format(pk)}, 404
+
+        sensors = {s.id: s for s in room.sensors}
+        if not sensors:
+            return {'msg': 'Room with id {} has no sensors'.format(pk)}, 404
+
+        results = cq.rows(list(sensors))
+
+        # declare series in a fixed order, so colors stay stable
+        grid = cq.grid()
+        labels = {}
+        for key in sorted({(r.sensor_id, r.type) for r in results}):
+            grid.add_series(key)
+            labels[key] = "{} {}".format(sensors[key[0]].name, key[1])
+
+        fill_grid(grid, results, fahrenheit,
+                  by_sensor=True, max_gap=cq.max_gap)
+
+        if cq.is_delta:
+            return build_delta(grid, results, cq, labels), 200
+
+        if chart_mimetype() == PACKED_MIMETYPE:
+            return Response(pack_chart(grid, labels), mimetype=PACKED_MIMETYPE)
+
+        return build_chart(grid, labels), 200
+
+
+class RoomStreamApi(Resource):
+
+    # @jwt_required
+    def get(self, pk):
+        """
+        Stream new measurements from the sensors in this room, as Server-Sent Events.
+
+        Resume with the Last-Event-ID header (sent by EventSource on its
+        own) or the 'last_id' query arg.
+        """
+
+        room = Room.query.get(pk)
+        if not room:
+            return {'msg': 'Room with id {} not found'.format(pk)}, 404
+
+        sensor_ids = [s.id for s in room.sensors]
+        fahrenheit = settings_snapshot().fahrenheit
+
+        try:
+            return sse_response(sensor_ids, fahrenheit)
+        except ValueError as x:
+            return {'msg': str(x)}, 400
+
+
+class RoomBulkApi(Resource):
+
+    # @jwt_required
+    def post(self):
+        """Bulk create, edit and delete (see CrudInterface.bulk)."""
+
+        ser, err, code = ifc.bulk(request.get_json())
+        if err:
+            return err, code
+
+        return ser, code
+
+
 api.add_resource(RoomListApi, '')
+api.add_resource(RoomBulkApi, '/bulk')
 api.add_resource(RoomApi, '/<int:pk>')
 api.add_resource(RoomLightApi, '/<int:pk>/lights')
+api.add_resource(RoomChartApi, '/<int:pk>/chart')
+api.add_resource(RoomStreamApi, '/<int:pk>/stream')
@@ -1,4 +1,5 @@
 import json
+import datetime
 from flask import Blueprint, request, url_for, jsonify
 from flask_restful import Api, Resource
 from flask_jwt_extended import jwt_required
@@ -6,18 +7,66 @@ from flask_jwt_extended import jwt_required
 from potnanny_core.models.schedule import (ScheduleOnOff, RoomLightManager)
 from potnanny_core.schemas.schedule import ScheduleOnOffSchema
 from potnanny_core.database import db_session
+from potnanny_core.utils import datetime_for_js
 from potnanny_api.crud import CrudInterface
+from potnanny_api.utils import parse_datetime
+from potnanny_api.apps.schedule.index import ScheduleIndex, schedule_index
+from potnanny_api.apps.schedule.simulate import simulate
+from potnanny_api.conditional import conditional
+from potnanny_api.querycount import query_budget
 
 bp = Blueprint('schedule_api', __name__, url_prefix='/api/1.0/schedules')
 api = Api(bp)
-ifc = CrudInterface(db_session, ScheduleOnOff, ScheduleOnOffSchema)
+ifc = CrudInterface(db_session, ScheduleOnOff, ScheduleOnOffSchema,
+                    filters=['name', 'is_active', 'room_id'],
+                    sorts=['name', 'created'], cache_ttl=300)
+
+
+def outlet_to_json(jdata):
+    """Schedules store their outlet as json text. Encode it, if it is a dict."""
+
+    if jdata and 'outlet' in jdata and type(jdata['outlet']) is dict:
+        jdata['outlet'] = json.dumps(jdata['outlet'])
+
+
+def request_time():
+    """
+    Get the time a schedule query is for, from the 'at' query arg.
+
+    returns:
+        naive datetime (UTC). now, if 'at' is not set
+    raises:
+        ValueError if 'at' cannot be parsed
+    """
+
+    if 'at' in request.args:
+        return parse_datetime(request.args['at'])
+
+    return datetime.datetime.utcnow()
+
+
+def outlet_key(args):
+    """
+    Get the outlet a schedule query is for, from the 'outlet_type' and
+    'outlet_id' query args.
+
+    returns:
+        tuple like ('wireless', '1'), or None for all outlets
+    """
+
+    if 'outlet_id' not in args:
+        return None
+
+    return (args.get('outlet_type', 'wireless'), args['outlet_id'])
 
 
 class ScheduleListApi(Resource):
 
     # @jwt_required
+    @query_budget
+    @conditional(ifc.etag)
     def get(self):
-        ser, err, code = ifc.get()
+        ser, err, code = ifc.get(args=request.args)
         if err:
             return err, code
 
@@ -26,8 +75,7 @@ class ScheduleListApi(Resource):
     # @jwt_required
     def post(self):
         jdata = request.get_json()
-        if 'outlet' in jdata and type(jdata['outlet']) is dict:
-            jdata['outlet'] = json.dumps(jdata['outlet'])
+        outlet_to_json(jdata)
 
         data, errors = ScheduleOnOffSchema().load(jdata)
         if errors:
@@ -43,8 +91,9 @@ class ScheduleListApi(Resource):
 class ScheduleApi(Resource):
 
     # @jwt_required
+    @conditional(ifc.etag)
     def get(self, pk):
-        ser, err, code = ifc.get(pk)
+        ser, err, code = ifc.get(pk, request.args)
         if err:
             return err, code
 
@@ -53,8 +102,7 @@ class ScheduleApi(Resource):
     # @jwt_required
     def put(self, pk):
         jdata = request.get_json()
-        if 'outlet' in jdata and type(jdata['outlet']) is dict:
-            jdata['outlet'] = json.dumps(jdata['outlet'])
+        outlet_to_json(jdata)
 
         data, errors = ScheduleOnOffSchema().load(jdata)
         if errors:
@@ -75,5 +123,207 @@ class ScheduleApi(Resource):
         return ser, code
 
 
+class ScheduleBulkApi(Resource):
+
+    # @jwt_required
+    def post(self):
+        """Bulk create, edit and delete (see CrudInterface.bulk)."""
+
+        items = request.get_json()
+        if isinstance(items, list):
+            for item in items:
+                if isinstance(item, dict):
+                    outlet_to_json(item.get('data'))
+
+        ser, err, code = ifc.bulk(items)
+        if err:
+            return err, code
+
+        return ser, code
+
+
+class ScheduleNowApi(Resource):
+
+    # @jwt_required
+    def get(self):
+        """
+        Get the scheduled state of every outlet, from the schedule index.
+
+        Optional query args:
+            - at: time (ISO-8601, UTC). default is now
+            - outlet_id, outlet_type: only this outlet
+
+        returns:
+            json, list like [{"outlet": {...}, "state": 1, "schedule_id": 3,
+            "since": time of the last change, "until": time of the next
+            change}], http result code
+        """
+
+        try:
+            when = request_time()
+        except ValueError:
+            return {'msg': 'invalid time'}, 400
+
+        index = schedule_index()
+        key = outlet_key(request.args)
+        if key is not None:
+            keys = [key] if key in index.outlets else []
+        else:
+            keys = sorted(index.outlets)
+
+        results = []
+        for key in keys:
+            state = index.state(key, when)
+            for name in ['since', 'until']:
+                if state[name] is not None:
+                    state[name] = datetime_for_js(state[name])
+
+            state['outlet'] = index.outlets[key]
+            results.append(state)
+
+        if not results:
+            return {'msg': 'no scheduled outlets found'}, 404
+
+        return results, 200
+
+
+class ScheduleNextApi(Resource):
+
+    MAX_COUNT = 500
+
+    # @jwt_required
+    def get(self):
+        """
+        Get the next scheduled on/off transitions, from the schedule index.
+
+        Optional query args:
+            - at: time (ISO-8601, UTC). default is now
+            - count: number of transitions (default 10)
+            - outlet_id, outlet_type: only this outlet
+
+        returns:
+            json, list like [{"at": time, "outlet": {...}, "state": 0,
+            "schedule_id": 3}], http result code
+        """
+
+        try:
+            when = request_time()
+        except ValueError:
+            return {'msg': 'invalid time'}, 400
+
+        try:
+            count = int(request.args.get('count', 10))
+        except ValueError:
+            count = 0
+
+        if count < 1 or count > self.MAX_COUNT:
+            return {'msg': 'count must be from 1 to {}'.format(
+                self.MAX_COUNT)}, 400
+
+        index = schedule_index()
+        results = [{
+            'at': datetime_for_js(at),
+            'outlet': index.outlets[key],
+            'state': state,
+            'schedule_id': schedule_id,
+        } for at, key, state, schedule_id in index.upcoming(
+            when, count, outlet_key(request.args))]
+
+        if not results:
+            return {'msg': 'no scheduled transitions found'}, 404
+
+        return results, 200
+
+
+class ScheduleSimulateApi(Resource):
+
+    MAX_DAYS = 366
+    MAX_TIMELINE = 20000
+
+    # @jwt_required
+    def get(self):
+        """
+        Simulate all active schedules, day by day.
+
+        Optional query args:
+            - start: first day (ISO-8601, UTC). default is today
+            - days: number of days (default 30)
+            - phases: room light phases to simulate, instead of the
+              current ones, like "3:flowering,4:growth"
+            - timeline: 1 to include every on/off transition
+
+        returns:
+            json, like {"dates": [...], "outlets": [...],
+            "on_hours": [[hours on each day] for each outlet],
+            "total_on_hours": [...], "timeline": [{"at", "outlet", "state"}]}
+            where timeline "outlet" is an index into "outlets".
+            http result code
+        """
+
+        try:
+            start = datetime.datetime.utcnow()
+            if 'start' in request.args:
+                start = parse_datetime(request.args['start'])
+        except ValueError:
+            return {'msg': 'invalid start time'}, 400
+
+        try:
+            days = int(request.args.get('days', 30))
+        except ValueError:
+            days = 0
+
+        if days < 1 or days > self.MAX_DAYS:
+            return {'msg': 'days must be from 1 to {}'.format(
+                self.MAX_DAYS)}, 400
+
+        index = schedule_index()
+        if request.args.get('phases'):
+            active = {}
+            try:
+                for item in request.args['phases'].split(','):
+                    room_id, phase = item.split(':')
+                    if phase not in ['growth', 'flowering']:
+                        raise ValueError(
+                            "phase must be 'growth' or 'flowering'")
+
+                    # the same schedules RoomLightManager.switch_to_phase
+                    # (de)activates
+                    for s in RoomLightManager(int(room_id)).schedules():
+                        active[s.id] = phase in s.name
+            except ValueError as x:
+                return {'msg': 'invalid phases. {}'.format(x)}, 400
+
+            index = ScheduleIndex(ScheduleOnOff.query.all(), active)
+
+        timeline = request.args.get('timeline') in ['1', 'true']
+        sim = simulate(index, start, days, timeline)
+        if not sim['keys']:
+            return {'msg': 'no scheduled outlets found'}, 404
+
+        on_hours = [[round(m / 60.0, 2) for m in row]
+                    for row in sim['on_minutes']]
+        results = {
+            'dates': [d.isoformat() for d in sim['dates']],
+            'outlets': [index.outlets[k] for k in sim['keys']],
+            'on_hours': on_hours,
+            'total_on_hours': [round(sum(row) / 60.0, 2)
+                               for row in sim['on_minutes']],
+        }
+
+        if timeline:
+            if len(sim['timeline']) > self.MAX_TIMELINE:
+                return {'msg': 'too many transitions. simulate fewer days'}, 400
+
+            results['timeline'] = [
+                {'at': datetime_for_js(at), 'outlet': i, 'state': state}
+                for at, i, state in sim['timeline']]
+
+        return results, 200
+
+
 api.add_resource(ScheduleListApi, '')
+api.add_resource(ScheduleBulkApi, '/bulk')
+api.add_resource(ScheduleNowApi, '/now')
+api.add_resource(ScheduleNextApi, '/next')
+api.add_resource(ScheduleSimulateApi, '/simulate')
 api.add_resource(ScheduleApi, '/<int:pk>')
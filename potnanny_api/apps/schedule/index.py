@@ -0,0 +1,308 @@
+import json
+import bisect
+import logging
+import datetime
+from potnanny_core.models.schedule import ScheduleOnOff
+from potnanny_api.cache import LRUCache
+from potnanny_api.versions import TableVersions
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def day_bit(weekday):
+    """
+    Get the ScheduleOnOff.days bit of a weekday.
+
+    args:
+        - int: weekday, like datetime.weekday() (Monday is 0)
+    returns:
+        int (Sunday is 64, Monday 32, ... Saturday 1. See WeekdayMap)
+    """
+
+    return 64 >> ((weekday + 1) % 7)
+
+
+def minute_of_week(dt):
+    """
+    Get the minute of the week of a datetime. Monday 00:00 is 0.
+
+    args:
+        - datetime
+    returns:
+        int
+    """
+
+    return dt.weekday() * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+
+def week_start(dt):
+    """Get midnight of the Monday before (or on) a datetime."""
+
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - datetime.timedelta(days=dt.weekday())
+
+
+def schedule_events(schedule):
+    """
+    Get the weekly on/off events of a schedule. Like ScheduleOnOff.action_now,
+    a schedule switches its outlet on and off at the on/off times of every
+    day in its 'days' bitmask. If both are at the same minute, 'on' wins.
+
+    args:
+        - ScheduleOnOff
+    returns:
+        list of tuples, like (minute of week, state)
+    """
+
+    on = schedule.on_utc_hour * 60 + schedule.on_minute
+    off = schedule.off_utc_hour * 60 + schedule.off_minute
+    events = []
+    for weekday in range(7):
+        if not schedule.days & day_bit(weekday):
+            continue
+
+        start = weekday * MINUTES_PER_DAY
+        if off != on:
+            events.append((start + off, 0))
+        events.append((start + on, 1))
+
+    return events
+
+
+class ScheduleIndex(object):
+    """
+    Weekly index of the on/off transitions of all active schedules.
+
+    Schedules repeat every week, so each outlet's state is a step function
+    over the minute of the week. The index keeps, per outlet, the sorted
+    minutes its state changes at. The state at any time is found with a
+    binary search, instead of interpreting every schedule.
+
+    When several schedules switch the same outlet, the latest event wins,
+    like it does when the schedules run.
+
+    Usage:
+        >>> index = ScheduleIndex(ScheduleOnOff.query.all())
+        >>> index.states(datetime.datetime.utcnow())
+        >>> index.upcoming(datetime.datetime.utcnow(), 10)
+
+    Initialization args:
+        - list of ScheduleOnOff objects
+        - dict: (optional) schedule id: is_active, to use instead of the
+          schedules' own is_active (to preview changes)
+    """
+
+    def __init__(self, schedules, active=None):
+        active = active or {}
+        self.outlets = {}
+        events = {}
+        for schedule in schedules:
+            if not active.get(schedule.id, schedule.is_active):
+                continue
+
+            try:
+                outlet = json.loads(schedule.outlet)
+                key = (outlet['type'], str(outlet['id']))
+            except (TypeError, ValueError, KeyError):
+                logger.warning("schedule {} has invalid outlet data".format(
+                    schedule.id))
+                continue
+
+            outlet.pop('state', None)
+            self.outlets.setdefault(key, outlet)
+            for minute, state in schedule_events(schedule):
+                events.setdefault(key, []).append(
+                    (minute, schedule.id, state))
+
+        # per outlet: minutes its state changes at, and the new states
+        self._minutes = {}
+        self._states = {}
+        self._schedules = {}
+        self._outlet_transitions = {}
+        transitions = []
+        for key, items in events.items():
+            items.sort()
+            last_state = items[-1][2]
+            minutes, states, schedule_ids = [], [], []
+            for minute, schedule_id, state in items:
+                if minutes and minutes[-1] == minute:
+                    # same minute. the later schedule wins
+                    states[-1], schedule_ids[-1] = state, schedule_id
+                    continue
+
+                minutes.append(minute)
+                states.append(state)
+                schedule_ids.append(schedule_id)
+
+            # keep only real changes. the week wraps around, so the state
+            # before the first event is the state of the last one.
+            changes = ([], [], [])
+            previous = states[-1]
+            for minute, state, schedule_id in zip(minutes, states,
+                                                  schedule_ids):
+                if state != previous:
+                    changes[0].append(minute)
+                    changes[1].append(state)
+                    changes[2].append(schedule_id)
+                    transitions.append((minute, key, state, schedule_id))
+                previous = state
+
+            if changes[0]:
+                self._outlet_transitions[key] = [
+                    (m, key, s, sid) for m, s, sid in zip(*changes)]
+            else:
+                # always on (or always off)
+                changes = ([0], [last_state], [schedule_ids[-1]])
+
+            self._minutes[key], self._states[key], self._schedules[key] = (
+                changes)
+
+        transitions.sort()
+        self._transitions = transitions
+        self._transition_minutes = [t[0] for t in transitions]
+
+
+    def __len__(self):
+        return len(self._transitions)
+
+
+    def steps(self, key):
+        """
+        Get the weekly step function of one outlet.
+
+        args:
+            - tuple: outlet key, like ('wireless', '1')
+        returns:
+            tuple of lists, (minutes of week, states). The outlet switches to
+            states[i] at minutes[i], and keeps states[-1] from the end of
+            the week until minutes[0].
+        """
+
+        return self._minutes[key], self._states[key]
+
+
+    def state(self, key, when):
+        """
+        Get the scheduled state of one outlet.
+
+        args:
+            - tuple: outlet key, like ('wireless', '1')
+            - datetime (UTC)
+        returns:
+            dict like {'state': 1, 'schedule_id': 3, 'since': datetime,
+            'until': datetime or None}, or None if no schedule switches
+            the outlet
+        """
+
+        minutes = self._minutes.get(key)
+        if minutes is None:
+            return None
+
+        states = self._states[key]
+        i = bisect.bisect_right(minutes, minute_of_week(when)) - 1
+        since = until = None
+        if len(minutes) > 1:
+            week = datetime.timedelta(minutes=MINUTES_PER_WEEK)
+            base = week_start(when)
+            # i is -1 before the first change of the week. the state then
+            # comes from the last change of the week before.
+            since = base + datetime.timedelta(minutes=minutes[i])
+            if i < 0:
+                since -= week
+
+            if i + 1 < len(minutes):
+                until = base + datetime.timedelta(minutes=minutes[i + 1])
+            else:
+                until = base + week + datetime.timedelta(minutes=minutes[0])
+
+        return {
+            'state': states[i],
+            'schedule_id': self._schedules[key][i],
+            'since': since,
+            'until': until,
+        }
+
+
+    def states(self, when):
+        """
+        Get the scheduled state of every outlet.
+
+        args:
+            - datetime (UTC)
+        returns:
+            dict, of outlet key: dict (see state())
+        """
+
+        return {key: self.state(key, when) for key in self._minutes}
+
+
+    def upcoming(self, when, count, key=None):
+        """
+        Get the next transitions after a time.
+
+        args:
+            - datetime (UTC)
+            - int: number of transitions
+            - tuple: (optional) only transitions of this outlet key
+        returns:
+            list of tuples, like (datetime, outlet key, state, schedule id)
+        """
+
+        if key is not None:
+            items = self._outlet_transitions.get(key, [])
+            minutes = self._minutes.get(key)
+        else:
+            items = self._transitions
+            minutes = self._transition_minutes
+
+        if not items:
+            return []
+
+        base = week_start(when)
+        i = bisect.bisect_right(minutes, minute_of_week(when))
+        results = []
+        while len(results) < count:
+            week, j = divmod(i, len(items))
+            minute, outlet, state, schedule_id = items[j]
+            at = base + datetime.timedelta(
+                minutes=week * MINUTES_PER_WEEK + minute)
+            results.append((at, outlet, state, schedule_id))
+            i += 1
+
+        return results
+
+
+_cache = LRUCache(maxsize=1, ttl=300)
+
+
+def schedule_index():
+    """
+    Get the index of all active schedules.
+
+    The index is cached, and rebuilt when the schedules table version
+    changes. The ttl catches changes made outside of the api (like room
+    light phase switches).
+
+    returns:
+        ScheduleIndex
+    """
+
+    generation = _cache.generation
+    version = TableVersions.get('schedules')
+    index = _cache.get(version)
+    if index is None:
+        index = ScheduleIndex(ScheduleOnOff.query.all())
+        _cache.set(version, index, generation)
+
+    return index
+
+
+def _table_changed(name):
+    if name == 'schedules':
+        _cache.clear()
+
+
+TableVersions.listen(_table_changed)
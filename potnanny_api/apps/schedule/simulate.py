@@ -0,0 +1,165 @@
+import datetime
+from potnanny_api.apps.schedule.index import (MINUTES_PER_DAY,
+    MINUTES_PER_WEEK, week_start)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAVE_NUMPY = np is not None
+
+
+def weekday_on_minutes(steps, use_numpy=None):
+    """
+    Get the number of minutes outlets are on, for each day of the week.
+
+    args:
+        - list of (minutes, states) weekly step functions (see
+          ScheduleIndex.steps)
+        - bool: (optional) force numpy on or off. Default is on, if installed.
+    returns:
+        list of lists, one per step function, of 7 ints (Monday first)
+    """
+
+    use_numpy = HAVE_NUMPY if use_numpy is None else use_numpy
+    if not steps:
+        return []
+
+    if use_numpy:
+        # on-minutes from the start of the week up to each midnight, from
+        # the cumulative on-time of the segments between changes
+        edges = np.arange(8) * MINUTES_PER_DAY
+        results = []
+        for minutes, states in steps:
+            bounds = np.concatenate(([0], minutes, [MINUTES_PER_WEEK]))
+            on = np.concatenate(([states[-1]], states))
+            cum = np.concatenate(([0], np.cumsum(np.diff(bounds) * on)))
+            k = np.minimum(np.searchsorted(bounds, edges, side='right') - 1,
+                           len(on) - 1)
+            upto = cum[k] + (edges - bounds[k]) * on[k]
+            results.append(np.diff(upto).tolist())
+
+        return results
+
+    results = []
+    for minutes, states in steps:
+        totals = [0] * 7
+        for i, state in enumerate(states):
+            if not state:
+                continue
+
+            # on from this change to the next one. the last one wraps around
+            start = minutes[i]
+            if i + 1 < len(minutes):
+                end = minutes[i + 1]
+            else:
+                end = minutes[0] + MINUTES_PER_WEEK
+
+            while start < end:
+                day = start // MINUTES_PER_DAY
+                part = min(end, (day + 1) * MINUTES_PER_DAY) - start
+                totals[day % 7] += part
+                start += part
+
+        results.append(totals)
+
+    return results
+
+
+def transitions(steps, first, last, use_numpy=None):
+    """
+    Expand weekly step functions into the transitions in a time window.
+
+    args:
+        - list of (minutes, states) weekly step functions
+        - int: start of the window, in minutes from a Monday 00:00
+        - int: end of the window (exclusive), in minutes from the same Monday
+        - bool: (optional) force numpy on or off. Default is on, if installed.
+    returns:
+        tuple of lists, (minutes from Monday, step function indexes, states),
+        sorted by time
+    """
+
+    use_numpy = HAVE_NUMPY if use_numpy is None else use_numpy
+    weeks = -(-last // MINUTES_PER_WEEK)
+    steps = [(i, m, s) for i, (m, s) in enumerate(steps) if len(m) > 1]
+    if not steps:
+        return [], [], []
+
+    if use_numpy:
+        offsets = np.arange(weeks)[:, None] * MINUTES_PER_WEEK
+        times, outlets, states = [], [], []
+        for i, minutes, state in steps:
+            t = (offsets + np.asarray(minutes)).ravel()
+            keep = (t >= first) & (t < last)
+            times.append(t[keep])
+            outlets.append(np.full(keep.sum(), i))
+            states.append(np.tile(state, weeks)[keep])
+
+        times = np.concatenate(times)
+        order = np.argsort(times, kind='stable')
+        return (times[order].tolist(), np.concatenate(outlets)[order].tolist(),
+                np.concatenate(states)[order].tolist())
+
+    results = []
+    for week in range(weeks):
+        offset = week * MINUTES_PER_WEEK
+        for i, minutes, states in steps:
+            for minute, state in zip(minutes, states):
+                if first <= offset + minute < last:
+                    results.append((offset + minute, i, state))
+
+    results.sort(key=lambda t: t[0])
+    return tuple(list(c) for c in zip(*results)) or ([], [], [])
+
+
+def simulate(index, start, days, timeline=False, use_numpy=None):
+    """
+    Simulate the schedules of an index, day by day.
+
+    args:
+        - ScheduleIndex
+        - datetime: first day (UTC). The time of day is ignored.
+        - int: number of days
+        - bool: also expand the on/off transitions
+        - bool: (optional) force numpy on or off. Default is on, if installed.
+    returns:
+        dict, like {
+            'keys': [outlet keys],
+            'dates': [date of each day],
+            'on_minutes': [[minutes on, each day] for each outlet],
+            'timeline': [(datetime, outlet index, state)] (if requested)
+        }
+    """
+
+    use_numpy = HAVE_NUMPY if use_numpy is None else use_numpy
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    keys = sorted(index.outlets)
+    steps = [index.steps(key) for key in keys]
+    weekdays = [(day.weekday() + d) % 7 for d in range(days)]
+
+    per_weekday = weekday_on_minutes(steps, use_numpy)
+    result = {
+        'keys': keys,
+        'dates': [(day + datetime.timedelta(days=d)).date()
+                  for d in range(days)],
+        'on_minutes': [[totals[w] for w in weekdays]
+                       for totals in per_weekday],
+    }
+
+    if timeline:
+        base = week_start(day)
+        first = day.weekday() * MINUTES_PER_DAY
+        minutes, outlets, states = transitions(
+            steps, first, first + days * MINUTES_PER_DAY, use_numpy)
+
+        if use_numpy:
+            times = (np.datetime64(base, 'us') + np.array(
+                minutes, dtype='timedelta64[m]')).tolist()
+        else:
+            times = [base + datetime.timedelta(minutes=m) for m in minutes]
+
+        result['timeline'] = list(zip(times, outlets, states))
+
+    return result
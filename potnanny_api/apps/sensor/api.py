@@ -1,25 +1,40 @@
-from flask import Blueprint, request, url_for, jsonify
+from flask import (Blueprint, request, url_for, jsonify, Response,
+    stream_with_context)
 from flask_restful import Api, Resource
 from flask_jwt_extended import jwt_required
 
 from potnanny_core.models.sensor import Sensor
 from potnanny_core.schemas.sensor import SensorSchema
 from potnanny_core.database import db_session
+from potnanny_api.settings import settings_snapshot
 from potnanny_api.crud import CrudInterface
+from potnanny_api.conditional import conditional
+from potnanny_api.querycount import query_budget
+from potnanny_api.prefetch import prefetch_sensors
 from potnanny_core.models.measurement import Measurement
-from potnanny_core.utils import datetime_for_js, convert_celsius
-from potnanny_core.models.setting import TemperatureDisplay
-from potnanny_api.chart_utils import ChartColor, CHARTBASE
+from potnanny_api.chart_utils import (PACKED_MIMETYPE, ChartQuery,
+    build_chart, build_delta, chart_etag, chart_mimetype, fill_grid,
+    pack_chart)
+from potnanny_api.streams import (EXPORT_FORMATS, measurement_pages,
+    sse_response)
+from potnanny_api.utils import parse_datetime
 
 bp = Blueprint('sensor_api', __name__, url_prefix='/api/1.0/sensors')
 api = Api(bp)
-ifc = CrudInterface(db_session, Sensor, SensorSchema)
+# sensors are added by the poller, which does not clear the cache
+ifc = CrudInterface(db_session, Sensor, SensorSchema, depends=[Measurement],
+                    filters=['name', 'address', 'model', 'room_id'],
+                    sorts=['name', 'created'], cache_ttl=60,
+                    prefetch=prefetch_sensors)
+
 
 class SensorListApi(Resource):
 
     # @jwt_required
+    @query_budget
+    @conditional(ifc.etag)
     def get(self):
-        ser, err, code = ifc.get()
+        ser, err, code = ifc.get(args=request.args)
         if err:
             return err, code
 
@@ -41,8 +56,9 @@ class SensorListApi(Resource):
 class SensorApi(Resource):
 
     # @jwt_required
+    @conditional(ifc.etag)
     def get(self, pk):
-        ser, err, code = ifc.get(pk)
+        ser, err, code = ifc.get(pk, request.args)
         if err:
             return err, code
 
@@ -72,23 +88,26 @@ class SensorApi(Resource):
 class SensorChartApi(Resource):
 
     # @jwt_required
+    @conditional(chart_etag)
     def get(self, pk, prev_hours=12):
-        """Query measurements for graphing functions."""
+        """
+        Query measurements for graphing functions.
+
+        Query args are described in chart_utils.ChartQuery.
 
-        # so. much. painful. work. to. build. charts. ug!
-        chart_tracker = {}
-        chart = copy.deepcopy(CHARTBASE)
-        temp_setting = TemperatureDisplay.get()
-        now = datetime.datetime.utcnow()
+        Send 'Accept: application/x-potnanny-chart' to get a packed binary
+        payload (see chart_utils.pack_chart) instead of Chart.js json, or
+        'since' to get only what changed (see chart_utils.build_delta).
+        """
 
-        start = request.args.get('start', None)
-        end = request.args.get('start', None)
+        fahrenheit = settings_snapshot().fahrenheit
 
-        if start is None:
-            start = now - datetime.timedelta(hours=prev_hours)
+        try:
+            cq = ChartQuery(request.args, prev_hours)
+        except ValueError as x:
+            return {'msg': str(x)}, 400
 
-        if end is None:
-            end = now
+        grid = cq.grid()
 
         sensor = Sensor.query.get(pk)
         if not sensor:
@@ -100,45 +119,118 @@ class SensorChartApi(Resource):
         except:
             pass
 
-        # track which index/data group this measurement type is stored in
+        # declare series up front, so colors stay stable between requests
         for t in types:
-            if t not in chart_tracker:
-                chart_tracker[t] = len(chart_tracker)
-                chart['data']['datasets'].append({})
+            grid.add_series(t)
 
         # finally. get some results
-        results = Measurement.query.filter(
-            Measurement.sensor_id == sensor.id).filter(
-            Measurement.type.in_(types)).and_(
-            Measurement.created >= start, Measurement.created <= end).order_by(
-            Measurement.created.asc()).all()
-
-        for r in results:
-            tstamp = datetime_for_js(r.created)
-            if tstamp not in chart['data']['labels']:
-                chart['data']['labels'].append(tstamp)
-
-            value = r.value
-            if r.type == 'temperature' and temp_setting == 'fahrenheit':
-                value = convert_celsius(value)
-
-            if 'data' not in chart['data']['datasets'][chart_tracker[r.type]]:
-                chart['data']['datasets'][chart_tracker[r.type]] = {
-                    'label': r.type,
-                    'data': [],
-                    'fill': 'false',
-                    'lineTension': 0.3,
-                    'borderColor': ChartColor.index_color(chart_tracker[r.type]),
-                }
-
-            chart['data']['datasets'][chart_tracker[r.type]]['data'].append(value)
-
-        chart['options']['legend']['display'] = True
-        chart['options']['scales']['xAxes'][0]['display'] = True
+        results = cq.rows([sensor.id], types)
+
+        fill_grid(grid, results, fahrenheit,
+                  by_sensor=False, max_gap=cq.max_gap)
+
+        if cq.is_delta:
+            return build_delta(grid, results, cq), 200
+
+        if chart_mimetype() == PACKED_MIMETYPE:
+            return Response(pack_chart(grid), mimetype=PACKED_MIMETYPE)
 
+        chart = build_chart(grid)
         return chart, 200
 
 
+class SensorMeasurementApi(Resource):
+
+    # @jwt_required
+    def get(self, pk):
+        """
+        Export measurements of a sensor, streamed as they are read.
+
+        Values are exported as stored (temperature in celsius).
+
+        Optional query args:
+            - start, end: ISO datetime strings bounding the export
+            - type: comma separated measurement types
+            - format: 'ndjson' (default) or 'csv'
+            - latest: if true, return only the latest reading of each type
+        """
+
+        sensor = Sensor.query.get(pk)
+        if not sensor:
+            return {'msg': "Sensor with id '{}' not found".format(pk)}, 404
+
+        if request.args.get('latest', '').lower() in ['1', 'true', 'yes']:
+            return sensor.latest_readings(), 200
+
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return {'msg': "format must be one of [{}]".format(
+                ",".join(sorted(EXPORT_FORMATS)))}, 400
+
+        try:
+            start = request.args.get('start', None)
+            if start is not None:
+                start = parse_datetime(start)
+
+            end = request.args.get('end', None)
+            if end is not None:
+                end = parse_datetime(end)
+        except ValueError:
+            return {'msg': 'Invalid start or end datetime'}, 400
+
+        types = None
+        if request.args.get('type'):
+            types = request.args.get('type').split(',')
+
+        mimetype, serializer = EXPORT_FORMATS[fmt]
+        pages = measurement_pages([sensor.id], start, end, types)
+        resp = Response(stream_with_context(serializer(pages)),
+                        mimetype=mimetype)
+        resp.headers['Content-Disposition'] = \
+            'attachment; filename="sensor-{}-measurements.{}"'.format(pk, fmt)
+        return resp
+
+
+class SensorStreamApi(Resource):
+
+    # @jwt_required
+    def get(self, pk):
+        """
+        Stream new measurements from this sensor, as Server-Sent Events.
+
+        Resume with the Last-Event-ID header (sent by EventSource on its
+        own) or the 'last_id' query arg.
+        """
+
+        sensor = Sensor.query.get(pk)
+        if not sensor:
+            return {'msg': "Sensor with id '{}' not found".format(pk)}, 404
+
+        sensor_ids = [sensor.id]
+        fahrenheit = settings_snapshot().fahrenheit
+
+        try:
+            return sse_response(sensor_ids, fahrenheit)
+        except ValueError as x:
+            return {'msg': str(x)}, 400
+
+
+class SensorBulkApi(Resource):
+
+    # @jwt_required
+    def post(self):
+        """Bulk create, edit and delete (see CrudInterface.bulk)."""
+
+        ser, err, code = ifc.bulk(request.get_json())
+        if err:
+            return err, code
+
+        return ser, code
+
+
 api.add_resource(SensorListApi, '')
+api.add_resource(SensorBulkApi, '/bulk')
 api.add_resource(SensorApi, '/<int:pk>')
 api.add_resource(SensorChartApi, '/<int:pk>/chart')
+api.add_resource(SensorStreamApi, '/<int:pk>/stream')
+api.add_resource(SensorMeasurementApi, '/<int:pk>/measurements')
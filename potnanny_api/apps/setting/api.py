@@ -1,36 +1,41 @@
-import json
 from flask import Blueprint, request, current_app
 from flask_restful import Api, Resource
 from flask_jwt_extended import jwt_required
 
+from potnanny_core.database import db_session
+from potnanny_core.models.keychain import Keychain
 from potnanny_core.schemas.keychain import KeychainSchema
 from potnanny_core.models.setting import (PollingInterval, TemperatureDisplay,
     VesyncAccount, PrimitiveWirelessSetting, TimeDisplay)
 from potnanny_core.schemas.setting import (PollingIntervalSchema,
     TemperatureDisplaySchema, PrimitiveWirelessSettingSchema,
     VesyncAccountSchema, TimeDisplaySchema)
+from potnanny_api.versions import TableVersions
+from potnanny_api.settings import settings_snapshot
 
 
 bp = Blueprint('settings_api', __name__, url_prefix='/api/1.0/settings')
 api = Api(bp)
 
+# setting name: (setting class, schema)
+SETTINGS = {
+    'polling_interval': (PollingInterval, PollingIntervalSchema),
+    'temperature_display': (TemperatureDisplay, TemperatureDisplaySchema),
+    'primitive_wireless': (PrimitiveWirelessSetting,
+                           PrimitiveWirelessSettingSchema),
+    'vesync_account': (VesyncAccount, VesyncAccountSchema),
+    'time_display': (TimeDisplay, TimeDisplaySchema),
+}
+
 
 class SettingListApi(Resource):
 
     # @jwt_required
     def get(self):
-        data = []
-        possibles = ['polling_interval', 'temperature_display',
-            'primitive_wireless', 'vesync_account', 'time_display']
-
-        keys = Keychain.query.all()
-        if len(keys) < 1:
+        data = settings_snapshot().keys()
+        if len(data) < 1:
             return {"msg": "no data"}, 404
 
-        for obj in keys:
-            if obj.name in possibles:
-                data.append(obj)
-
         serialized, errors = KeychainSchema(many=True).dump(data)
         if errors:
             return errors, 400
@@ -42,48 +47,14 @@ class SettingApi(Resource):
 
     # @jwt_required
     def get(self, name):
-        obj = None
-        serialized = None
-        errors = None
-
-        if name == 'polling_interval':
-            obj = PollingInterval.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
-
-            serialized, errors = PollingIntervalSchema().load(json.loads(obj.data))
-
-        elif name == 'temperature_display':
-            obj = TemperatureDisplay.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
-
-            serialized, errors = TemperatureDisplaySchema().load(json.loads(obj.data))
-
-        elif name == 'time_display':
-            obj = TimeDisplay.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
-
-            serialized, errors = TimeDisplaySchema().load(json.loads(obj.data))
-
-        elif name == 'primitive_wireless':
-            obj = PrimitiveWirelessSetting.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
-
-            serialized, errors = PrimitiveWirelessSettingSchema().load(json.loads(obj.data))
-
-        elif name == 'vesync_account':
-            obj = VesyncAccount.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
-
-            serialized, errors = VesyncAccountSchema().load(json.loads(obj.data))
-
-        else:
+        if name not in SETTINGS:
             return {"msg": "Unexpected setting type"}, 404
 
+        data = settings_snapshot().get(name)
+        if data is None:
+            return {"msg": "object not found"}, 404
+
+        serialized, errors = SETTINGS[name][1]().load(data)
         if errors:
             return errors, 400
 
@@ -92,54 +63,38 @@ class SettingApi(Resource):
 
     # @jwt_required
     def put(self, name):
-        data = None
-        errors = None
-
-        if name == 'polling_interval':
-            data, errors = PollingIntervalSchema().load(request.get_json())
-            if errors:
-                return errors, 400
-
-            PollingInterval.set()
-            obj = PollingInterval.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
-
-            serialized, errors = PollingIntervalSchema().dump(json.loads(obj.data))
-
-        elif name == 'temperature_display':
-            obj = TemperatureDisplay.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
-
-            serialized, errors = TemperatureDisplaySchema().dump(json.loads(obj.data))
-
-        elif name == 'time_display':
-            obj = TimeDisplay.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
+        if name not in SETTINGS:
+            return {"msg": "Unexpected setting type"}, 404
 
-            serialized, errors = TimeDisplaySchema().dump(json.loads(obj.data))
+        setting, schema = SETTINGS[name]
+        data, errors = schema().load(request.get_json() or {})
+        if errors:
+            return errors, 400
 
-        elif name == 'primitive_wireless':
-            obj = PrimitiveWirelessSetting.get()
-            if not obj:
-                return {"msg": "object not found"}, 404
+        # set() commits, in the same transaction as the version bump
+        TableVersions.bump('settings')
+        try:
+            serialized = setting.set(**data)
+        except ValueError as x:
+            db_session.rollback()
+            return {"msg": str(x)}, 400
 
-            serialized, errors = PrimitiveWirelessSettingSchema().dump(json.loads(obj.data))
-        else:
-            return {"msg": "Unexpected setting type"}, 404
+        return serialized, 200
 
 
     # @jwt_required
     def delete(self, name):
+        if name not in SETTINGS:
+            return {"msg": "Unexpected setting type"}, 404
+
         obj = Keychain.query.filter_by(name=name).first()
         if obj:
             db_session.delete(obj)
+            TableVersions.bump('settings')
             db_session.commit()
 
         return "", 204
 
 
-api.add_resource(SettingListApi, '/settings')
-api.add_resource(SettingApi, '/settings/<name>')
+api.add_resource(SettingListApi, '')
+api.add_resource(SettingApi, '/<name>')
@@ -0,0 +1,114 @@
+import time
+import threading
+import collections
+
+
+class LRUCache(object):
+    """
+    Small in-process cache, with least-recently-used and time-to-live
+    eviction. Safe to share between threads.
+
+    Every clear() bumps a generation number. Readers that compute a value
+    from the database pass the generation they saw before reading to set(),
+    so a value read before an invalidation is never stored after it.
+
+    Usage:
+        >>> cache = LRUCache(maxsize=128, ttl=60)
+        >>> gen = cache.generation
+        >>> value = cache.get(key)
+        >>> if value is None:
+        ...     value = expensive()
+        ...     cache.set(key, value, gen)
+
+    Initialization args:
+        - int: max number of entries
+        - float: (optional) seconds an entry stays valid. None for no limit.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        """
+        Get a value, and mark it as recently used.
+
+        args:
+            - a hashable key
+            - (optional) value to return on a miss
+        returns:
+            the cached value, or default
+        """
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (item[0] is None or
+                                     item[0] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+
+            if item is not None:
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+
+    def set(self, key, value, generation=None):
+        """
+        Store a value, evicting the least recently used one if full.
+
+        args:
+            - a hashable key
+            - value
+            - int: (optional) generation seen before the value was computed.
+              The value is dropped if the cache was cleared since then.
+        returns:
+            none
+        """
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            expires = None
+            if self.ttl is not None:
+                expires = time.monotonic() + self.ttl
+
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+    def clear(self):
+        """Drop all entries."""
+
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+
+    def stats(self):
+        """
+        Get cache counters.
+
+        returns:
+            dict
+        """
+
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
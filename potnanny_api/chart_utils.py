@@ -1,3 +1,20 @@
+import sys
+import copy
+import json
+import array
+import struct
+import datetime
+from flask import request
+from sqlalchemy import func
+from potnanny_core.database import db_session
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.utils import datetime_for_js
+from potnanny_api.timegrid import EPOCH, TimeGrid
+from potnanny_api.columnar import MeasurementColumns, find_gaps, js_timestamps
+from potnanny_api.rollup import RollupManager
+from potnanny_api.utils import parse_datetime
+from potnanny_api.versions import TableVersions
+
 CHARTBASE = {
     'type': 'line',
     'options': {
@@ -42,3 +59,505 @@ class ChartColor(object):
     @classmethod
     def index_color(cls, index):
         return cls.COLORS[index % len(cls.COLORS)]
+
+
+def build_chart(grid, labels=None):
+    """
+    Build a Chart.js line chart from a TimeGrid.
+
+    args:
+        - TimeGrid
+        - dict: (optional) display label for each series key. Keys that are
+          not in the dict are labeled with str(key).
+    returns:
+        dict
+    """
+
+    chart = copy.deepcopy(CHARTBASE)
+    chart['data']['labels'] = js_timestamps(grid.seconds())
+
+    for index, key in enumerate(grid.keys()):
+        label = str(key)
+        if labels and key in labels:
+            label = labels[key]
+
+        chart['data']['datasets'].append({
+            'label': label,
+            'data': grid.values(key),
+            'fill': 'false',
+            'lineTension': 0.3,
+            'borderColor': ChartColor.index_color(index),
+        })
+
+    chart['options']['legend']['display'] = True
+    chart['options']['scales']['xAxes'][0]['display'] = True
+
+    return chart
+
+
+def fill_grid(grid, rows, fahrenheit=False, by_sensor=False, max_gap=None):
+    """
+    Add measurement rows to a TimeGrid, through the columnar (vectorized)
+    post-processing stage.
+
+    args:
+        - TimeGrid
+        - list of rows (see ChartQuery.rows)
+        - bool: convert temperatures to fahrenheit
+        - bool: key series by (sensor_id, type) instead of type
+        - int: (optional) break chart lines where a series has no data for
+          more than this many seconds
+    returns:
+        none
+    """
+
+    cols = MeasurementColumns(rows)
+    if fahrenheit:
+        cols.convert_temperature()
+
+    for key, seconds, values in cols.split(by_sensor):
+        grid.add_many(key, seconds, values)
+        if max_gap:
+            for s in find_gaps(seconds, max_gap):
+                grid.add_break(s)
+
+
+def build_delta(grid, rows, cq, labels=None):
+    """
+    Build a delta chart response, for clients polling with a 'since' cursor.
+
+    The client should drop labels (and their values) older than
+    'expire_before', then merge in these labels. A label may be one the
+    client already has (another series reported into the same bucket), in
+    which case non-null values replace the old ones. The 'cursor' is sent
+    back as 'since' on the next poll.
+
+    args:
+        - TimeGrid, filled with the new rows
+        - list: the new rows
+        - ChartQuery
+        - dict: (optional) display label for each series key
+    returns:
+        dict
+    """
+
+    cursor = cq.since
+    if rows:
+        cursor = max(r.id for r in rows)
+    elif not isinstance(cursor, int):
+        cursor = datetime_for_js(cursor)
+
+    datasets = []
+    for key in grid.keys():
+        label = str(key)
+        if labels and key in labels:
+            label = labels[key]
+
+        datasets.append({'label': label, 'data': grid.values(key)})
+
+    return {
+        'cursor': cursor,
+        'expire_before': datetime_for_js(cq.start),
+        'labels': js_timestamps(grid.seconds()),
+        'datasets': datasets,
+    }
+
+
+PACKED_MIMETYPE = 'application/x-potnanny-chart'
+
+
+def chart_mimetype():
+    """
+    Negotiate the chart representation from the request Accept header.
+
+    returns:
+        str ('application/json' unless the client prefers PACKED_MIMETYPE)
+    """
+
+    return request.accept_mimetypes.best_match(
+        ['application/json', PACKED_MIMETYPE], default='application/json')
+
+
+def chart_etag(**kwargs):
+    """
+    Validator for the chart endpoints (see conditional.conditional). The
+    newest measurement id (of any sensor, so the primary key index answers
+    it), the settings version, the negotiated format, and the chart window.
+
+    The window is resolved like the chart resolves it (relative to now,
+    when start or end are not given), in buckets of the chart interval. So
+    old points age out of the chart even when no new ones arrive.
+    """
+
+    try:
+        cq = ChartQuery(request.args, kwargs.get('prev_hours', 12))
+    except ValueError:
+        # the chart answers with a 400
+        return None
+
+    window = [int((dt - EPOCH).total_seconds()) // cq.interval
+              for dt in (cq.start, cq.end)]
+    last_id = db_session.query(func.max(Measurement.id)).scalar()
+    return [last_id, TableVersions.get('settings'), chart_mimetype(), window]
+
+
+def pack_chart(grid, labels=None):
+    """
+    Pack a TimeGrid into a compact little-endian columnar buffer.
+
+    Layout (every array starts on a multiple of its item size, so a browser
+    can wrap it in a typed array without copying):
+
+        offset 0    4 bytes   magic b'PNC1'
+        offset 4    uint32    n, number of points
+        offset 8    uint32    m, number of series
+        offset 12   uint32    length of the labels block
+        offset 16   bytes     labels, a utf-8 json list of m strings,
+                              padded with spaces to a multiple of 8
+        ...         int64[n]  timestamps, epoch seconds (UTC)
+        ...         m x float32[n] series values, NaN where there is no data
+
+    args:
+        - TimeGrid
+        - dict: (optional) display label for each series key
+    returns:
+        bytes
+    """
+
+    keys = grid.keys()
+    names = [labels.get(k, str(k)) if labels else str(k) for k in keys]
+    label_block = json.dumps(names).encode('utf-8')
+    label_block += b' ' * (-len(label_block) % 8)
+
+    stamps = array.array('q', [b * grid.interval for b in grid.buckets()])
+    columns = []
+    for key in keys:
+        columns.append(array.array('f', [float('nan') if v is None else v
+                                         for v in grid.values(key)]))
+
+    if sys.byteorder != 'little':
+        for a in [stamps] + columns:
+            a.byteswap()
+
+    parts = [struct.pack('<4sIII', b'PNC1', len(stamps), len(keys),
+                         len(label_block)), label_block, stamps.tobytes()]
+    parts += [c.tobytes() for c in columns]
+    return b''.join(parts)
+
+
+def lttb_indices(xs, ys, threshold):
+    """
+    Downsample a series with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are always kept. Every bucket in between keeps
+    the single point that forms the largest triangle with the previously
+    selected point and the average of the next bucket, which preserves the
+    visual shape of the line.
+
+    args:
+        - list: x values (numeric, sorted ascending)
+        - list: y values
+        - int: maximum number of points to keep
+    returns:
+        list of int (indices of the points to keep, ascending)
+    """
+
+    n = len(xs)
+    if threshold >= n or n < 3:
+        return list(range(n))
+
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 0)]
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+
+    for i in range(threshold - 2):
+        # average point of the next bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+
+        # pick the point in this bucket with the largest triangle area
+        ax = xs[a]
+        ay = ys[a]
+        max_area = -1
+        next_a = int(i * every) + 1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+
+        selected.append(next_a)
+        a = next_a
+
+    selected.append(n - 1)
+    return selected
+
+
+def minmax_indices(xs, ys, threshold):
+    """
+    Downsample a series by keeping the min and max point of each bucket.
+
+    Unlike LTTB, this keeps every spike in the data (the min/max envelope),
+    at the cost of two points per bucket. Like LTTB, the first and last
+    points are always kept.
+
+    args:
+        - list: x values (sorted ascending)
+        - list: y values
+        - int: maximum number of points to keep
+    returns:
+        list of int (indices of the points to keep, ascending)
+    """
+
+    n = len(ys)
+    if threshold >= n or n < 3:
+        return list(range(n))
+
+    if threshold < 4:
+        return [0, n - 1][:max(threshold, 0)]
+
+    # the points between the first and last share the rest, two per bucket
+    buckets = (threshold - 2) // 2
+    every = (n - 2) / buckets
+    selected = [0]
+
+    for i in range(buckets):
+        start = int(i * every) + 1
+        end = min(int((i + 1) * every) + 1, n - 1)
+        if start >= end:
+            continue
+
+        lo = hi = start
+        for j in range(start + 1, end):
+            if ys[j] < ys[lo]:
+                lo = j
+            elif ys[j] > ys[hi]:
+                hi = j
+
+        selected += sorted({lo, hi})
+
+    selected.append(n - 1)
+    return selected
+
+
+DOWNSAMPLERS = {
+    'lttb': lttb_indices,
+    'minmax': minmax_indices,
+}
+
+
+def downsample_measurements(rows, max_points, method='lttb'):
+    """
+    Downsample measurement rows, separately for each sensor and measurement
+    type.
+
+    args:
+        - list of Measurement objects (sorted by created)
+        - int: maximum number of points to keep per series
+        - str: downsampling method ('lttb'|'minmax')
+    returns:
+        list of Measurement objects, sorted by created
+    raises:
+        ValueError if method is unknown
+    """
+
+    if method not in DOWNSAMPLERS:
+        raise ValueError("Unknown downsampling method '{}'".format(method))
+
+    series = {}
+    for r in rows:
+        series.setdefault((r.sensor_id, r.type), []).append(r)
+
+    results = []
+    for group in series.values():
+        xs = [(r.created - EPOCH).total_seconds() for r in group]
+        ys = [r.value for r in group]
+        results += [group[i] for i in DOWNSAMPLERS[method](xs, ys, max_points)]
+
+    results.sort(key=lambda r: r.created)
+    return results
+
+
+class ChartQuery(object):
+    """
+    Common query args of the chart endpoints, parsed from the request.
+
+    Query args:
+        - start, end: ISO datetime strings bounding the chart window
+        - max_points (or resolution): downsample each series to at most this
+          many points
+        - method: downsampling method, 'lttb' (default) or 'minmax'
+        - interval: seconds per label on the shared time axis (default=60)
+        - fill: 'previous' to carry values forward over gaps, instead of
+          leaving them empty (null)
+        - rollup: 'auto' (default) picks the coarsest rollup table that still
+          gives enough points for the window. 'raw', 'minute', 'hour' or
+          'day' force a source.
+        - gap: break chart lines where a series has no data for more than
+          this many seconds (default is 30 minutes, or 3 intervals if that
+          is longer). 0 turns it off.
+        - since: delta mode. The cursor (a measurement id, or an ISO
+          datetime) returned by the previous request. Only rows added after
+          it are queried, from the raw measurements, and the response is a
+          delta (see build_delta) instead of a whole chart.
+
+    Initialization args:
+        - request args (a MultiDict)
+        - int: window size in hours, when no start is given (default=12)
+    raises:
+        ValueError (with a message for the client) if any arg is invalid
+    """
+
+    ROLLUPS = ['auto', 'raw'] + [r[0] for r in RollupManager.RESOLUTIONS]
+
+    def __init__(self, args, prev_hours=12):
+        now = datetime.datetime.utcnow()
+
+        try:
+            self.start = args.get('start', None)
+            if self.start is not None:
+                self.start = parse_datetime(self.start)
+
+            self.end = args.get('end', None)
+            if self.end is not None:
+                self.end = parse_datetime(self.end)
+        except ValueError:
+            raise ValueError('Invalid start or end datetime')
+
+        if self.start is None:
+            self.start = now - datetime.timedelta(hours=prev_hours)
+
+        if self.end is None:
+            self.end = now
+
+        self.max_points = args.get('max_points', args.get('resolution', None))
+        if self.max_points is not None:
+            if not self.max_points.isdigit() or int(self.max_points) < 2:
+                raise ValueError('max_points must be an integer >= 2')
+            self.max_points = int(self.max_points)
+
+        self.method = args.get('method', 'lttb')
+        if self.method not in DOWNSAMPLERS:
+            raise ValueError("method must be one of [{}]".format(
+                ",".join(sorted(DOWNSAMPLERS))))
+
+        self.rollup = args.get('rollup', 'auto')
+        if self.rollup not in self.ROLLUPS:
+            raise ValueError("rollup must be one of [{}]".format(
+                ",".join(self.ROLLUPS)))
+
+        if self.rollup == 'auto':
+            self.rollup = RollupManager.choose(self.start, self.end,
+                                               self.max_points)
+        elif self.rollup == 'raw':
+            self.rollup = None
+
+        self.interval = self._int_arg(args, 'interval', 60, 1)
+        if self.rollup is not None:
+            self.interval = max(self.interval,
+                                RollupManager.seconds(self.rollup))
+
+        self.fill = args.get('fill', None)
+
+        self.since = args.get('since', None)
+        if self.since is not None:
+            if self.since.isdigit():
+                self.since = int(self.since)
+            else:
+                try:
+                    self.since = parse_datetime(self.since)
+                except ValueError:
+                    raise ValueError('since must be a measurement id or datetime')
+
+            # deltas are made of raw rows, a handful at a time
+            self.rollup = None
+            self.interval = self._int_arg(args, 'interval', 60, 1)
+            self.max_points = None
+
+        self.max_gap = self._int_arg(args, 'gap',
+                                     max(1800, 3 * self.interval), 0)
+
+        # validate interval and fill now, rather than after querying
+        self.grid()
+
+    @staticmethod
+    def _int_arg(args, name, default, minimum):
+        """
+        Parse an optional integer query arg. Unlike args.get(type=int), an
+        invalid value is an error rather than the default.
+        """
+
+        value = args.get(name, None)
+        if value is None:
+            return default
+
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+
+        if value is None or value < minimum:
+            raise ValueError('{} must be an integer >= {}'.format(
+                name, minimum))
+
+        return value
+
+    def grid(self):
+        """Get a new, empty TimeGrid for this chart."""
+
+        return TimeGrid(interval=self.interval, fill=self.fill)
+
+    @property
+    def is_delta(self):
+        return self.since is not None
+
+    def rows(self, sensor_ids, types=None):
+        """
+        Query (and downsample) the chart rows of one or more sensors, with
+        one query.
+
+        args:
+            - list of sensor ids
+            - list: (optional) measurement types. Default is every type
+              except 'battery'.
+        returns:
+            list of (id, sensor_id, type, value, created) named tuples,
+            sorted by created
+        """
+
+        if self.rollup is None:
+            query = db_session.query(
+                Measurement.id, Measurement.sensor_id, Measurement.type,
+                Measurement.value, Measurement.created).filter(
+                Measurement.sensor_id.in_(sensor_ids)).filter(
+                Measurement.value.isnot(None)).filter(
+                Measurement.created >= self.start,
+                Measurement.created <= self.end)
+            if types is None:
+                query = query.filter(Measurement.type != 'battery')
+            else:
+                query = query.filter(Measurement.type.in_(types))
+
+            if isinstance(self.since, int):
+                query = query.filter(Measurement.id > self.since)
+            elif self.since is not None:
+                query = query.filter(Measurement.created > self.since)
+
+            results = query.order_by(Measurement.created.asc()).all()
+        else:
+            results = RollupManager.query(self.rollup, sensor_ids, types,
+                                          self.start, self.end)
+            if types is None:
+                results = [r for r in results if r.type != 'battery']
+
+        if self.max_points is not None:
+            results = downsample_measurements(results, self.max_points,
+                                              self.method)
+
+        return results
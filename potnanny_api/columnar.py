@@ -0,0 +1,170 @@
+import datetime
+from potnanny_api.timegrid import EPOCH
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAVE_NUMPY = np is not None
+
+
+class MeasurementColumns(object):
+    """
+    Column-oriented copy of measurement rows, for vectorized post-processing.
+
+    Unit conversion, gap detection and splitting into series are done on
+    whole columns with numpy when it is installed. Without numpy the same
+    operations run on plain lists, with the same results.
+
+    Usage:
+        >>> cols = MeasurementColumns(rows)
+        >>> cols.convert_temperature()
+        >>> for key, seconds, values in cols.split(by_sensor=True):
+        ...     grid.add_many(key, seconds, values)
+
+    Initialization args:
+        - list of rows with sensor_id, type, value and created attributes
+          (Measurement objects or query result tuples). Rows without a
+          value (Measurement.value is nullable) are skipped.
+        - bool: (optional) force numpy on or off. Default is on, if installed.
+    """
+
+    def __init__(self, rows, use_numpy=None):
+        self.use_numpy = HAVE_NUMPY if use_numpy is None else use_numpy
+        if self.use_numpy and not HAVE_NUMPY:
+            raise RuntimeError("numpy is not installed")
+
+        rows = [r for r in rows if r.value is not None]
+        count = len(rows)
+        index = {}
+        codes = [index.setdefault(r.type, len(index)) for r in rows]
+        self.types = sorted(index)
+
+        if self.use_numpy:
+            # converting datetimes one by one is much faster than letting
+            # numpy parse a list of them into datetime64
+            remap = np.array([self.types.index(t) for t in index],
+                             dtype=np.int32)
+            self.codes = remap[np.array(codes, dtype=np.int32)] \
+                if count else np.zeros(0, dtype=np.int32)
+            self.sensor_ids = np.fromiter(
+                (r.sensor_id for r in rows), dtype=np.int64, count=count)
+            self.values = np.fromiter(
+                (r.value for r in rows), dtype=np.float64, count=count)
+            self.seconds = np.fromiter(
+                ((r.created - EPOCH).total_seconds() for r in rows),
+                dtype=np.float64, count=count).astype(np.int64)
+        else:
+            remap = [self.types.index(t) for t in index]
+            self.codes = [remap[c] for c in codes]
+            self.sensor_ids = [r.sensor_id for r in rows]
+            self.values = [r.value for r in rows]
+            self.seconds = [int((r.created - EPOCH).total_seconds())
+                            for r in rows]
+
+    def __len__(self):
+        return len(self.values)
+
+    def convert_temperature(self):
+        """Convert temperature values from celsius to fahrenheit, in place."""
+
+        if 'temperature' not in self.types:
+            return
+
+        code = self.types.index('temperature')
+        if self.use_numpy:
+            mask = self.codes == code
+            self.values[mask] = np.round(self.values[mask] * 1.8 + 32, 1)
+        else:
+            self.values = [round(v * 1.8 + 32, 1) if c == code else v
+                           for c, v in zip(self.codes, self.values)]
+
+    def split(self, by_sensor=False):
+        """
+        Split the columns into one series per measurement type (or per
+        sensor and type).
+
+        args:
+            - bool: key series by (sensor_id, type) instead of type
+        returns:
+            list of (key, seconds, values) tuples, sorted by key
+        """
+
+        results = []
+        if not len(self):
+            return results
+
+        if self.use_numpy:
+            if by_sensor:
+                ntypes = len(self.types)
+                keys, inverse = np.unique(
+                    self.sensor_ids * ntypes + self.codes, return_inverse=True)
+                inverse = inverse.reshape(-1)
+                labels = [(int(k // ntypes), self.types[int(k % ntypes)])
+                          for k in keys]
+            else:
+                inverse = self.codes
+                labels = self.types
+
+            order = np.argsort(inverse, kind='stable')
+            bounds = np.searchsorted(inverse[order], np.arange(len(labels) + 1))
+            for i, key in enumerate(labels):
+                idx = order[bounds[i]:bounds[i + 1]]
+                results.append((key, self.seconds[idx], self.values[idx]))
+        else:
+            groups = {}
+            for sid, code, sec, val in zip(self.sensor_ids, self.codes,
+                                           self.seconds, self.values):
+                key = (sid, self.types[code]) if by_sensor else self.types[code]
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = ([], [])
+                group[0].append(sec)
+                group[1].append(val)
+
+            for key in sorted(groups):
+                results.append((key, groups[key][0], groups[key][1]))
+
+        return results
+
+
+def find_gaps(seconds, max_gap):
+    """
+    Find gaps in a sorted series of timestamps.
+
+    args:
+        - list or array of epoch seconds, sorted
+        - int: gaps longer than this many seconds are reported
+    returns:
+        list of epoch seconds, the last timestamp before each gap
+    """
+
+    if len(seconds) < 2:
+        return []
+
+    if HAVE_NUMPY and isinstance(seconds, np.ndarray):
+        idx = np.nonzero(np.diff(seconds) > max_gap)[0]
+        return seconds[idx].tolist()
+
+    return [a for a, b in zip(seconds, seconds[1:]) if b - a > max_gap]
+
+
+def js_timestamps(seconds):
+    """
+    Encode epoch seconds like potnanny_core.utils.datetime_for_js does.
+
+    args:
+        - list of ints (epoch seconds, UTC)
+    returns:
+        list of str (like '2019-01-01T12:00:00+00:00')
+    """
+
+    if HAVE_NUMPY:
+        stamps = np.datetime_as_string(
+            np.array(seconds, dtype=np.int64).astype('datetime64[s]'),
+            unit='s')
+        return [s + '+00:00' for s in stamps.tolist()]
+
+    return [(EPOCH + datetime.timedelta(seconds=s)).isoformat() + '+00:00'
+            for s in seconds]
@@ -0,0 +1,22 @@
+import click
+from flask.cli import AppGroup
+from potnanny_api.rollup import RollupManager
+
+
+rollup_cli = AppGroup('rollup', help='Manage measurement rollup tables.')
+
+
+@rollup_cli.command('update')
+def rollup_update():
+    """Roll up measurements added since the last update."""
+
+    count = RollupManager.update()
+    click.echo("rolled up {} new measurements".format(count))
+
+
+@rollup_cli.command('backfill')
+def rollup_backfill():
+    """Rebuild all rollups from existing measurements."""
+
+    count = RollupManager.backfill()
+    click.echo("rolled up {} measurements".format(count))
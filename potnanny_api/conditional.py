@@ -0,0 +1,85 @@
+import json
+import hashlib
+import functools
+from flask import request, Response
+
+
+def make_etag(*parts):
+    """
+    Build an ETag value from any json-able parts.
+
+    args:
+        - anything
+    returns:
+        str
+    """
+
+    buf = json.dumps(parts, default=str, sort_keys=True)
+    return hashlib.md5(buf.encode('utf-8')).hexdigest()
+
+
+def conditional(etag_func):
+    """
+    Decorator for Resource GET methods, to answer conditional requests.
+
+    etag_func is called with the same keyword args as the method (like 'pk')
+    and should return a validator built from cheap queries only. If the
+    client already holds that version (If-None-Match), a 304 is returned
+    without calling the method at all. Otherwise the method runs and its
+    response gets an ETag header. The request path and query string are
+    always part of the tag.
+
+    Usage:
+        >>> class RoomListApi(Resource):
+        ...     @conditional(ifc.etag)
+        ...     def get(self):
+        ...         ...
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            value = etag_func(**kwargs)
+            if value is None:
+                return func(*args, **kwargs)
+
+            tag = make_etag(request.full_path, value)
+            headers = {'ETag': '"{}"'.format(tag), 'Cache-Control': 'no-cache'}
+            if request.if_none_match.contains(tag):
+                return '', 304, headers
+
+            return add_headers(func(*args, **kwargs), headers)
+
+        return wrapper
+
+    return decorator
+
+
+def add_headers(rv, headers):
+    """
+    Add headers to the return value of a Resource method, on success only.
+
+    args:
+        - a Response, or (data, code[, headers]) tuple, or data
+        - dict
+    returns:
+        same type as rv
+    """
+
+    if isinstance(rv, Response):
+        if rv.status_code == 200:
+            rv.headers.extend(headers)
+        return rv
+
+    if not isinstance(rv, tuple):
+        return rv, 200, headers
+
+    if len(rv) == 2 and rv[1] == 200:
+        return rv[0], rv[1], headers
+
+    if len(rv) == 3 and rv[1] == 200:
+        merged = dict(rv[2] or {})
+        merged.update(headers)
+        return rv[0], rv[1], merged
+
+    return rv
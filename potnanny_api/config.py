@@ -25,9 +25,38 @@ class BaseConfig(object):
     JWT_REFRESH_COOKIE_PATH = '/token/refresh'
     JWT_COOKIE_CSRF_PROTECT = False
 
+    # live measurement streams (server-sent events)
+    STREAM_POLL_SECONDS = 5
+    STREAM_MAX_SECONDS = 600
+
+    # outlet switching. commands must finish within the timeout (seconds)
+    OUTLET_SWITCH_TIMEOUT = 10
+    OUTLET_SWITCH_WORKERS = 4
+    # commands for the last known state of an outlet are skipped. schedules
+    # and actions switch outlets too, so known states expire (seconds)
+    OUTLET_STATE_TTL = 60
+
+    # outlet discovery cache. lists older than the ttl are refreshed in the
+    # background, lists older than the max age are never returned (seconds)
+    OUTLET_DISCOVERY_TTL = 60
+    OUTLET_DISCOVERY_MAX_AGE = 3600
+
+    # SQL statement counting (see querycount.py)
+    QUERY_COUNT_DEBUG = False
+    MAX_LIST_QUERIES = 15
+
+    # background jobs (see jobs.py). inline jobs run before submit() returns
+    JOB_WORKERS = 2
+    JOBS_INLINE = False
+
+    # seconds between background rollup updates (see rollup.py). 0 turns
+    # the updater thread off, then run 'flask rollup update' from cron
+    ROLLUP_INTERVAL = 60
+
 
 class Development(BaseConfig, CoreDevelopment):
     DEBUG = True
+    QUERY_COUNT_DEBUG = True
 
 
 class Testing(BaseConfig, CoreTesting):
@@ -35,6 +64,9 @@ class Testing(BaseConfig, CoreTesting):
     WTF_CSRF_ENABLED = False
     JWT_HEADER_TYPE = 'Bearer'
     JWT_BLACKLIST_ENABLED = False
+    QUERY_COUNT_DEBUG = True
+    JOBS_INLINE = True
+    ROLLUP_INTERVAL = 0
 
 
 class Production(BaseConfig, CoreProduction):
@@ -1,4 +1,14 @@
 
+import datetime
+import contextlib
+from sqlalchemy import and_, or_, inspect
+from sqlalchemy.orm import load_only
+from potnanny_api.cache import LRUCache
+from potnanny_api.serializer import compile_schema
+from potnanny_api.utils import parse_datetime
+from potnanny_api.versions import TableVersions
+
+
 class CrudInterface(object):
     """
     Class that handles the CRUD type object operations, data serialization and
@@ -8,46 +18,359 @@ class CrudInterface(object):
         - sqlalchemy db session
         - a class
         - the marshmallow schema class used to validate/serialize class objects
+        - list: (optional) other model classes the serialized data depends on,
+          like nested relationships. Used to build ETags.
+        - list: (optional) column names lists can be filtered on
+        - list: (optional) column names lists can be sorted by
+        - float: (optional) seconds to cache results of get(). Default is no
+          caching. Results are cached under the same table fingerprint the
+          ETag is built from, so rows added by other processes (like the
+          poller) or bumped by them are seen right away. Writes through any
+          CrudInterface (or anything else that bumps TableVersions) also
+          clear the cache of every interface that depends on the changed
+          table. The TTL bounds how long rows edited in place by other
+          programs, without a bump, can go unseen.
+        - int: (optional) max number of cached results
+        - list: (optional) loader options for queries, like selectinload(),
+          so relationships the schema dumps are not loaded one by one
+        - function: (optional) called with the loaded objects before they
+          are serialized. Returns a context manager (see prefetch.py).
+        - list: (optional) model classes that deleting an object cascades
+          into (through ORM relationships). Their tables are bumped too, so
+          caches and ETags of those tables see the rows go.
     """
 
-    def __init__(self, session, objclass, objschema):
+    # largest page a list query can ask for
+    MAX_LIMIT = 1000
+
+    # filter operators, as in '?created__gte=2019-01-01'
+    OPERATORS = {
+        'eq': lambda c, v: c == v,
+        'ne': lambda c, v: c != v,
+        'lt': lambda c, v: c < v,
+        'lte': lambda c, v: c <= v,
+        'gt': lambda c, v: c > v,
+        'gte': lambda c, v: c >= v,
+        'in': lambda c, v: c.in_(v),
+    }
+
+    # query args that are not filters. '_' is a cache buster, like jQuery's
+    RESERVED = ['after_id', 'limit', 'fields', 'sort', '_']
+
+    # most operations one bulk() call can apply
+    MAX_BULK = 500
+    BULK_OPS = ['create', 'update', 'delete']
+
+    # interfaces with a cache, to clear when their tables change
+    _cached = []
+
+    def __init__(self, session, objclass, objschema, depends=None,
+                 filters=None, sorts=None, cache_ttl=None, cache_size=128,
+                 loader_options=None, prefetch=None, cascades=None):
         self._objclass = objclass
         self._objschema = objschema
         self._db = session
+        self._depends = depends or []
+        self._columns = {c.key: c for c in inspect(objclass).column_attrs}
+        self._filters = filters or []
+        self._sorts = sorts or []
+        self._loader_options = loader_options or []
+        self._prefetch = prefetch
+        self._cascades = cascades or []
+        self._dumpers = {}
+        self._cache = None
+        if cache_ttl is not None:
+            self._cache = LRUCache(cache_size, cache_ttl)
+            self._tables = set(m.__tablename__
+                               for m in [objclass] + self._depends)
+            CrudInterface._cached.append(self)
+
+
+    @classmethod
+    def _table_changed(cls, name):
+        for ifc in cls._cached:
+            if name in ifc._tables:
+                ifc._cache.clear()
+
+
+    @classmethod
+    def cache_stats(cls):
+        """
+        Get the cache counters of all interfaces with a cache.
+
+        returns:
+            dict, of table name: dict of counters
+        """
+
+        return {ifc._objclass.__tablename__: ifc._cache.stats()
+                for ifc in cls._cached}
+
+
+    def etag(self, pk=None):
+        """
+        Cheap validator for the results of get(), built without loading the
+        objects. Changes when this table or any dependency changes, and
+        once a day (for fields computed from the current date).
+
+        args:
+            - int: (optional)
+        returns:
+            list
+        """
+
+        return [
+            self._objclass.__tablename__,
+            pk,
+            datetime.date.today().isoformat(),
+            self._fingerprint(),
+        ]
 
 
-    def get(self, pk=None):
+    def _fingerprint(self):
+        return TableVersions.fingerprint(self._objclass, *self._depends)
+
+
+    def get(self, pk=None, args=None):
         """
         GET object/objects
 
+        Lists can be paged, projected, filtered and sorted with query args:
+            - limit: max number of objects to return
+            - after_id: return objects after the one with this id (keyset
+              paging). The next page starts after the last id of this one.
+            - fields: comma separated fields to load and serialize
+            - sort: a sortable column, or '-column' for descending
+            - <column>=value, or <column>__<op>=value (op is one of eq, ne,
+              lt, lte, gt, gte, in), for filterable columns. 'in' takes a
+              comma separated list. Other args are rejected, except a '_'
+              cache buster.
+
         args:
             - int: (optional)
+            - dict: (optional) query args, like request.args
         returns:
-            tuple: (data, errors, http_code)
+            tuple: (data, errors, http_code). With a cache, data is shared
+            between callers, so treat it as read-only.
         """
 
+        args = args or {}
+        if self._cache is None:
+            return self._get(pk, args)
+
+        # keyed on the fingerprint, so a body is never served under an ETag
+        # of newer data
+        key = (pk if pk is None else int(pk), tuple(sorted(args.items())),
+               datetime.date.today(), self._fingerprint())
+        generation = self._cache.generation
+        result = self._cache.get(key)
+        if result is None:
+            result = self._get(pk, args)
+            if result[2] == 200 and not result[1]:
+                self._cache.set(key, result, generation)
+
+        return result
+
+
+    def _get(self, pk, args):
         http_code = 200
         data = None
         errors = None
 
+        try:
+            only = self._parse_fields(args.get('fields'))
+        except ValueError as x:
+            return (None, {"msg": str(x)}, 400)
+
+        dump = self.dumper(only)
+        prefetch = self._prefetch
+        query = self._objclass.query
+        if only is not None and all(f in self._columns for f in only):
+            # only plain columns. fields computed from others, or
+            # relationships, could need the rest of the row.
+            prefetch = None
+            if pk is None and self._dumper(only)[1]:
+                # rows are dumped straight from the column tuples, without
+                # building ORM objects at all
+                query = self._db.query(
+                    *[getattr(self._objclass, f) for f in only])
+            else:
+                query = query.options(load_only(*only))
+        elif self._loader_options:
+            query = query.options(*self._loader_options)
+
         if pk is None:
-            r = self._objclass.query.all()
-            if not r:
+            try:
+                query = self._list_query(query, args)
+            except ValueError as x:
+                return (None, {"msg": str(x)}, 400)
+
+            r = query.all()
+            if not r and not args:
                 return (None, {"msg": "no data"}, 404)
 
-            data, errors = self._objschema(many=True).dump(r)
+            with self._prefetched(prefetch, r):
+                data, errors = dump(r, many=True)
+
             if errors:
                 http_code = 400
         else:
-            obj = self._objclass.query.get(int(pk))
+            obj = query.get(int(pk))
             if not obj:
                 return (None, {"msg": "object does not exist"}, 404)
 
-            data, errors = self._objschema().dump(obj)
+            with self._prefetched(prefetch, [obj]):
+                data, errors = dump(obj)
 
         return (data, errors, http_code)
 
 
+    @staticmethod
+    def _prefetched(prefetch, objects):
+        if prefetch is None:
+            return contextlib.suppress()
+
+        return prefetch(objects)
+
+
+    def dumper(self, only=None):
+        """
+        Get the dump function for this interface's schema. Schemas are
+        compiled (see serializer.compile_schema) the first time they are
+        used, when possible. Others use plain marshmallow.
+
+        args:
+            - list: (optional) names of the fields to dump
+        returns:
+            function: f(obj, many=False) -> (data, errors)
+        """
+
+        return self._dumper(only)[0]
+
+
+    def _dumper(self, only=None):
+        key = tuple(only) if only else None
+        entry = self._dumpers.get(key)
+        if entry is None:
+            schema_args = {'only': only} if only else {}
+            dump = compile_schema(self._objschema(**schema_args))
+            compiled = dump is not None
+            if not compiled:
+                dump = lambda obj, many=False: self._objschema(
+                    **schema_args).dump(obj, many=many)
+
+            entry = self._dumpers[key] = (dump, compiled)
+
+        return entry
+
+
+    def _parse_fields(self, value):
+        if not value:
+            return None
+
+        only = [f.strip() for f in value.split(',') if f.strip()]
+        known = self._objschema().fields
+        for f in only:
+            if f not in known:
+                raise ValueError("Unknown field '{}'".format(f))
+
+        return only
+
+
+    def _coerce(self, name, value):
+        column = self._columns[name].columns[0]
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return value
+
+        try:
+            if python_type is bool:
+                if value.lower() in ['1', 'true', 'yes']:
+                    return True
+                if value.lower() in ['0', 'false', 'no']:
+                    return False
+                raise ValueError()
+            if python_type is datetime.datetime:
+                return parse_datetime(value)
+            return python_type(value)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid value for '{}'".format(name))
+
+
+    def _list_query(self, query, args):
+        for key in args:
+            if key in self.RESERVED:
+                continue
+
+            name, _, op = key.partition('__')
+            op = op or 'eq'
+            if name not in self._filters or op not in self.OPERATORS:
+                raise ValueError("Cannot filter on '{}'".format(key))
+
+            if op == 'in':
+                value = [self._coerce(name, v)
+                         for v in args.get(key).split(',')]
+            else:
+                value = self._coerce(name, args.get(key))
+
+            query = query.filter(
+                self.OPERATORS[op](getattr(self._objclass, name), value))
+
+        pk_col = self._objclass.id
+        sort = args.get('sort') or 'id'
+        desc = sort.startswith('-')
+        name = sort.lstrip('-')
+        if name != 'id' and name not in self._sorts:
+            raise ValueError("Cannot sort by '{}'".format(name))
+
+        sort_col = getattr(self._objclass, name)
+
+        after_id = args.get('after_id')
+        if after_id is not None:
+            try:
+                after_id = int(after_id)
+            except ValueError:
+                raise ValueError("after_id must be an integer")
+
+            if name == 'id':
+                query = query.filter(
+                    pk_col < after_id if desc else pk_col > after_id)
+            else:
+                # keyset on (sort column, id), so ties are not skipped
+                after = self._db.query(sort_col).filter(
+                    pk_col == after_id).first()
+                if after is None:
+                    raise ValueError("after_id does not exist")
+
+                value = after[0]
+                if desc:
+                    query = query.filter(or_(sort_col < value, and_(
+                        sort_col == value, pk_col < after_id)))
+                else:
+                    query = query.filter(or_(sort_col > value, and_(
+                        sort_col == value, pk_col > after_id)))
+
+        if desc:
+            query = query.order_by(sort_col.desc(), pk_col.desc())
+        else:
+            query = query.order_by(sort_col.asc(), pk_col.asc())
+
+        limit = args.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+
+            if limit < 1 or limit > self.MAX_LIMIT:
+                raise ValueError("limit must be between 1 and {}".format(
+                    self.MAX_LIMIT))
+
+            query = query.limit(limit)
+
+        return query
+
+
     def create(self, data):
         """
         CREATE object
@@ -62,11 +385,12 @@ class CrudInterface(object):
         try:
             obj = self._objclass(**data)
             self._db.add(obj)
+            TableVersions.bump(self._objclass.__tablename__)
             self._db.commit()
         except Exception as x:
             return (None, x, 400)
 
-        data, errors = self._objschema().dump(obj)
+        data, errors = self.dumper()(obj)
         if errors:
             http_code = 400
 
@@ -96,8 +420,9 @@ class CrudInterface(object):
         except:
             pass
 
+        TableVersions.bump(self._objclass.__tablename__)
         self._db.commit()
-        data, errors = self._objschema().dump(obj)
+        data, errors = self.dumper()(obj)
         if errors:
             http_code = 400
 
@@ -120,5 +445,128 @@ class CrudInterface(object):
             return(None, {"msg": "object does not exist"}, 404)
 
         self._db.delete(obj)
+        TableVersions.bump(*self._deleted_tables())
         self._db.commit()
         return("", None, 204)
+
+
+    def _deleted_tables(self):
+        """Names of the tables a delete changes, this one and cascades."""
+
+        return [self._objclass.__tablename__] + [
+            m.__tablename__ for m in self._cascades]
+
+
+    def bulk(self, items):
+        """
+        Create, edit and delete many objects in one transaction.
+
+        Every item is validated first. If any item fails, nothing is
+        changed, and the per-item results tell which items failed and why.
+
+        args:
+            - list of dicts, like:
+                {"op": "create", "data": {...}}
+                {"op": "update", "id": 1, "data": {...}} (data can be partial)
+                {"op": "delete", "id": 1}
+        returns:
+            tuple: (data, errors, http_code). data (or errors, on failure)
+            is a list with one {"op", "id", "code", "data"|"errors"} result
+            per item, in order.
+        """
+
+        if not isinstance(items, list) or not items:
+            return (None, {"msg": "expected a list of operations"}, 400)
+
+        if len(items) > self.MAX_BULK:
+            return (None, {"msg": "at most {} operations allowed".format(
+                self.MAX_BULK)}, 400)
+
+        plan = []
+        results = []
+        for item in items:
+            op = pk = data = errors = None
+            if isinstance(item, dict):
+                op = item.get('op')
+
+            if op not in self.BULK_OPS:
+                errors = {"op": ["must be one of {}".format(self.BULK_OPS)]}
+            elif op != 'create':
+                try:
+                    pk = int(item.get('id'))
+                except (TypeError, ValueError):
+                    errors = {"id": ["an integer id is required"]}
+
+            if not errors and op != 'delete':
+                data, errors = self._objschema().load(
+                    item.get('data') or {}, partial=(op == 'update'))
+
+            plan.append((op, pk, data))
+            results.append({"op": op, "id": pk, "code": 400, "errors": errors}
+                           if errors else None)
+
+        # load every object to update or delete, in a few queries
+        existing = {}
+        ids = list({pk for op, pk, data in plan if pk is not None})
+        for i in range(0, len(ids), 500):
+            for obj in self._objclass.query.filter(
+                    self._objclass.id.in_(ids[i:i + 500])).all():
+                existing[obj.id] = obj
+
+        deleted = set()
+        for i, (op, pk, data) in enumerate(plan):
+            if results[i] or pk is None:
+                continue
+
+            if pk not in existing or pk in deleted:
+                results[i] = {"op": op, "id": pk, "code": 404,
+                              "errors": {"msg": "object does not exist"}}
+            elif op == 'delete':
+                deleted.add(pk)
+
+        if any(results):
+            for i, (op, pk, data) in enumerate(plan):
+                if results[i] is None:
+                    results[i] = {"op": op, "id": pk, "code": 424, "errors": {
+                        "msg": "not applied, because other operations failed"}}
+
+            return (None, results, 400)
+
+        objects = []
+        try:
+            for op, pk, data in plan:
+                obj = existing.get(pk)
+                if op == 'create':
+                    obj = self._objclass(**data)
+                    self._db.add(obj)
+                elif op == 'update':
+                    for k, v in data.items():
+                        setattr(obj, k, v)
+                else:
+                    self._db.delete(obj)
+
+                objects.append(obj)
+
+            if any(op == 'delete' for op, pk, data in plan):
+                TableVersions.bump(*self._deleted_tables())
+            else:
+                TableVersions.bump(self._objclass.__tablename__)
+            self._db.commit()
+        except Exception as x:
+            self._db.rollback()
+            return (None, {"msg": str(x)}, 400)
+
+        results = []
+        dump = self.dumper()
+        for (op, pk, data), obj in zip(plan, objects):
+            if op == 'delete':
+                results.append({"op": op, "id": pk, "code": 204})
+                continue
+
+            data, errors = dump(obj)
+            results.append({"op": op, "id": obj.id, "code": 200, "data": data})
+
+        return (results, None, 200)
+
+
+TableVersions.listen(CrudInterface._table_changed)
@@ -0,0 +1,305 @@
+import json
+import datetime
+import collections
+from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey, func
+from sqlalchemy.orm import relationship, backref
+from potnanny_core.database import Base, db_session
+from potnanny_core.models.grow import Grow
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.models.sensor import Sensor
+from potnanny_core.models.schedule import RoomLightManager
+from potnanny_core.utils import datetime_for_js
+from potnanny_api.apps.schedule.index import ScheduleIndex
+
+
+class GrowReport(Base):
+    """
+    Summary statistics of a grow, computed once (usually when it ends), so
+    viewing a finished grow does not rescan its measurements.
+
+    'data' is json text (see build_report). A report is deleted with its
+    grow (also when a room delete cascades to the grow).
+    """
+
+    __tablename__ = 'grow_reports'
+
+    id = Column(Integer, primary_key=True)
+    data = Column(Text, nullable=False)
+    created = Column(DateTime, default=func.now())
+
+    # relationships
+    grow_id = Column(Integer, ForeignKey('grows.id', ondelete='CASCADE'),
+                     nullable=False, unique=True)
+    grow = relationship(Grow, backref=backref(
+        'report', uselist=False, cascade='all,delete'))
+
+    def __repr__(self):
+        return "<GrowReport({})>".format(self.grow_id)
+
+
+class Histogram(object):
+    """
+    Streaming summary of a series of values: count, min, max, mean, and
+    percentiles from a histogram of 'resolution' wide bins. Memory depends
+    on the spread of the values, not on how many there are.
+
+    Usage:
+        >>> h = Histogram()
+        >>> for v in values:
+        ...     h.add(v)
+        >>> h.summary()
+
+    Initialization args:
+        - float: (optional) bin width. percentiles are within half of it
+    """
+
+    PERCENTILES = [10, 25, 50, 75, 90]
+
+    def __init__(self, resolution=0.1):
+        self.resolution = resolution
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._bins = collections.Counter()
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        self._bins[int(round(value / self.resolution))] += 1
+
+    def percentile(self, p):
+        """Get the value below which p percent of the values fall."""
+
+        if not self.count:
+            return None
+
+        rank = p / 100.0 * (self.count - 1)
+        seen = 0
+        for b in sorted(self._bins):
+            seen += self._bins[b]
+            if seen > rank:
+                return min(max(b * self.resolution, self.min), self.max)
+
+        return self.max
+
+    def summary(self):
+        """
+        Get the summary statistics.
+
+        returns:
+            dict, like {'count': 10, 'min':.., 'max':.., 'mean':.., 'p10':..}
+        """
+
+        data = {'count': self.count, 'min': None, 'max': None, 'mean': None}
+        if self.count:
+            data['min'] = round(self.min, 2)
+            data['max'] = round(self.max, 2)
+            data['mean'] = round(self.total / self.count, 2)
+
+        for p in self.PERCENTILES:
+            value = self.percentile(p)
+            data['p{}'.format(p)] = value if value is None else round(value, 2)
+
+        return data
+
+
+class LightClock(object):
+    """
+    Lights on/off state of a light schedule, for increasing times. Only
+    looks up the schedule index again when the next transition is passed.
+
+    Initialization args:
+        - ScheduleIndex with the light schedule
+        - tuple: outlet key of the lights
+    """
+
+    def __init__(self, index, key):
+        self.index = index
+        self.key = key
+        self._state = None
+        self._until = None
+
+    def is_on(self, when):
+        if self._state is None or (self._until is not None and
+                                   when >= self._until):
+            state = self.index.state(self.key, when)
+            self._state = bool(state['state'])
+            self._until = state['until']
+
+        return self._state
+
+    def on_hours(self, start, end):
+        """Get the hours the lights are on, between two times."""
+
+        seconds = 0.0
+        when = start
+        while when < end:
+            state = self.index.state(self.key, when)
+            until = min(state['until'] or end, end)
+            if state['state']:
+                seconds += (until - when).total_seconds()
+            when = until
+
+        return round(seconds / 3600.0, 2)
+
+
+def grow_phases(grow, now=None):
+    """
+    Get the time windows of the phases of a grow.
+
+    args:
+        - Grow
+        - datetime: (optional) end of unfinished phases. default is now
+    returns:
+        list of tuples, like ('growth', start, end)
+    """
+
+    end = grow.ended or now or datetime.datetime.utcnow()
+    if not grow.transitioned:
+        return [('growth', grow.started, end)]
+
+    return [('growth', grow.started, grow.transitioned),
+            ('flowering', grow.transitioned, end)]
+
+
+def light_clocks(room_id):
+    """
+    Get a LightClock for the growth and flowering light schedules of a room.
+
+    args:
+        - int: room id
+    returns:
+        dict, of phase: LightClock. phases without a schedule are missing
+    """
+
+    clocks = {}
+    for schedule in RoomLightManager(room_id).schedules():
+        for phase in ['growth', 'flowering']:
+            if phase not in schedule.name:
+                continue
+
+            # as if this phase's schedule were the active one
+            index = ScheduleIndex([schedule], {schedule.id: True})
+            for key in index.outlets:
+                clocks[phase] = LightClock(index, key)
+
+    return clocks
+
+
+def build_report(grow, now=None, batch_size=5000):
+    """
+    Compute the summary statistics of a grow, in one pass over the
+    measurements of its room's sensors.
+
+    For each phase: the light on-hours, and min/max/mean/percentiles of each
+    measurement type, overall and split into lights on (day) and off (night).
+    Temperatures are in celsius, like in the database.
+
+    args:
+        - Grow
+        - datetime: (optional) end of unfinished phases. default is now
+        - int: rows fetched from the database at a time
+    returns:
+        dict
+    """
+
+    phases = grow_phases(grow, now)
+    clocks = light_clocks(grow.room_id) if grow.room_id else {}
+    sensor_ids = [row[0] for row in db_session.query(Sensor.id).filter(
+        Sensor.room_id == grow.room_id)]
+
+    stats = collections.defaultdict(Histogram)
+    count = 0
+    if sensor_ids:
+        rows = db_session.query(
+            Measurement.type, Measurement.value, Measurement.created).filter(
+            Measurement.sensor_id.in_(sensor_ids)).filter(
+            Measurement.type != 'battery').filter(
+            Measurement.created >= phases[0][1]).filter(
+            Measurement.created < phases[-1][2]).order_by(
+            Measurement.created).yield_per(batch_size)
+
+        # rows come in time order, so the phase only ever moves forward
+        p = 0
+        for mtype, value, created in rows:
+            if value is None:
+                continue
+
+            while created >= phases[p][2]:
+                p += 1
+
+            phase = phases[p][0]
+            count += 1
+            stats[(phase, mtype, 'all')].add(value)
+            clock = clocks.get(phase)
+            if clock is not None:
+                period = 'day' if clock.is_on(created) else 'night'
+                stats[(phase, mtype, period)].add(value)
+
+    report = {
+        'grow_id': grow.id,
+        'room_id': grow.room_id,
+        'started': datetime_for_js(grow.started),
+        'transitioned': None,
+        'ended': None,
+        'measurements': count,
+        'temperature_unit': 'celsius',
+        'phases': {},
+    }
+
+    if grow.transitioned:
+        report['transitioned'] = datetime_for_js(grow.transitioned)
+    if grow.ended:
+        report['ended'] = datetime_for_js(grow.ended)
+
+    for phase, start, end in phases:
+        clock = clocks.get(phase)
+        report['phases'][phase] = {
+            'start': datetime_for_js(start),
+            'end': datetime_for_js(end),
+            'days': round((end - start).total_seconds() / 86400.0, 2),
+            'light_hours': clock.on_hours(start, end) if clock else None,
+            'stats': {},
+        }
+
+    for (phase, mtype, period), hist in sorted(stats.items()):
+        report['phases'][phase]['stats'].setdefault(mtype, {})[period] = (
+            hist.summary())
+
+    return report
+
+
+def save_report(grow_id, now=None):
+    """
+    Build the report of a grow, and store it (replacing an older one).
+
+    args:
+        - int: grow id
+        - datetime: (optional) end of unfinished phases. default is now
+    returns:
+        GrowReport
+    raises:
+        ValueError if the grow is not found
+    """
+
+    grow = Grow.query.get(grow_id)
+    if not grow:
+        raise ValueError("Grow with id %d not found" % grow_id)
+
+    data = json.dumps(build_report(grow, now))
+    obj = GrowReport.query.filter_by(grow_id=grow_id).first()
+    if obj is None:
+        obj = GrowReport(grow_id=grow_id, data=data)
+        db_session.add(obj)
+    else:
+        obj.data = data
+        obj.created = datetime.datetime.utcnow()
+
+    db_session.commit()
+    return obj
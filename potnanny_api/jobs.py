@@ -0,0 +1,188 @@
+import json
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from marshmallow import Schema, fields
+from sqlalchemy import Column, Integer, String, Text, DateTime, func
+from potnanny_core.database import Base, db_session
+
+logger = logging.getLogger(__name__)
+
+
+class Job(Base):
+    """
+    A unit of background work, and its outcome.
+
+    Jobs are stored, so any worker process can report their status. 'args'
+    and 'result' are json text.
+    """
+
+    __tablename__ = 'jobs'
+
+    STATES = ['queued', 'running', 'done', 'failed']
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(48), nullable=False)
+    status = Column(String(16), nullable=False, default='queued')
+    args = Column(Text, nullable=False, default='{}')
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created = Column(DateTime, default=func.now())
+    started = Column(DateTime, nullable=True)
+    finished = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return "<Job({},{})>".format(self.name, self.status)
+
+
+class JobSchema(Schema):
+    class META:
+        strict = True
+
+    id = fields.Integer(dump_only=True)
+    name = fields.Str(dump_only=True)
+    status = fields.Str(dump_only=True)
+    args = fields.Method("load_args", dump_only=True)
+    result = fields.Method("load_result", dump_only=True)
+    error = fields.Str(dump_only=True)
+    created = fields.DateTime(dump_only=True)
+    started = fields.DateTime(dump_only=True)
+    finished = fields.DateTime(dump_only=True)
+
+    def load_args(self, obj):
+        return json.loads(obj.args or '{}')
+
+    def load_result(self, obj):
+        if obj.result is None:
+            return None
+
+        return json.loads(obj.result)
+
+
+class JobRunner(object):
+    """
+    Run registered functions in background threads, and record each run in
+    a Job row.
+
+    Functions are registered by name, and called with keyword args that
+    must be json serializable. Their return value (also json serializable)
+    is stored as the job result. An exception marks the job failed.
+
+    Jobs run in this process only. A job that was queued or running when
+    its process stopped stays in that state.
+
+    Usage:
+        >>> @runner.task('grow_phase')
+        ... def switch_phase(grow_id, phase):
+        ...     ...
+        >>> job = runner.submit('grow_phase', grow_id=1, phase='flowering')
+
+    Initialization args:
+        - int: (optional) number of worker threads
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self.inline = False
+        self._tasks = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+
+    def init_app(self, app):
+        """
+        Configure from the app config (JOB_WORKERS, JOBS_INLINE).
+
+        args:
+            - flask app
+        returns:
+            none
+        """
+
+        self.max_workers = app.config.get('JOB_WORKERS', self.max_workers)
+        self.inline = app.config.get('JOBS_INLINE', False)
+
+
+    def task(self, name):
+        """
+        Decorator, to register a function as a job task.
+
+        args:
+            - str: task name
+        """
+
+        def decorator(func):
+            self._tasks[name] = func
+            return func
+
+        return decorator
+
+
+    def submit(self, name, **kwargs):
+        """
+        Queue a job. Commits the current session.
+
+        args:
+            - str: registered task name
+            - keyword args for the task
+        returns:
+            Job
+        raises:
+            KeyError if the task is not registered
+        """
+
+        if name not in self._tasks:
+            raise KeyError("unknown job task '{}'".format(name))
+
+        job = Job(name=name, status='queued', args=json.dumps(kwargs))
+        db_session.add(job)
+        db_session.commit()
+
+        if self.inline:
+            self._run(job.id)
+        else:
+            self._executor().submit(self._run, job.id)
+
+        return job
+
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='job')
+
+            return self._pool
+
+
+    def _run(self, job_id):
+        try:
+            job = Job.query.get(job_id)
+            job.status = 'running'
+            job.started = datetime.datetime.utcnow()
+            db_session.commit()
+
+            try:
+                result = self._tasks[job.name](**json.loads(job.args))
+                job = Job.query.get(job_id)
+                job.result = json.dumps(result)
+                job.status = 'done'
+            except Exception as x:
+                logger.exception("job {} ({}) failed".format(job_id, job.name))
+                db_session.rollback()
+                job = Job.query.get(job_id)
+                job.error = str(x) or type(x).__name__
+                job.status = 'failed'
+
+            job.finished = datetime.datetime.utcnow()
+            db_session.commit()
+        except Exception:
+            logger.exception("job {} could not be run".format(job_id))
+        finally:
+            if not self.inline:
+                # worker threads get their own scoped session. don't leak it.
+                db_session.remove()
+
+
+runner = JobRunner()
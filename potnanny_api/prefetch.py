@@ -0,0 +1,134 @@
+"""
+Batch versions of per-object model methods that run their own queries
+(Sensor.measurement_types, Room.environment). Serializing a list calls
+those once per object. These functions compute the values for a whole
+list in one query, and override() makes the objects return them.
+"""
+
+import contextlib
+from sqlalchemy import func
+from potnanny_core.database import db_session
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.utils import convert_celsius
+from potnanny_api.settings import settings_snapshot
+
+
+def measurement_types(sensors):
+    """
+    Batch version of Sensor.measurement_types.
+
+    args:
+        - list of Sensor objects
+    returns:
+        dict, of sensor id: sorted list of measurement types
+    """
+
+    results = {s.id: [] for s in sensors}
+    if not results:
+        return results
+
+    rows = db_session.query(Measurement.sensor_id, Measurement.type).filter(
+        Measurement.sensor_id.in_(list(results))).group_by(
+        Measurement.sensor_id, Measurement.type).order_by(
+        Measurement.type).all()
+
+    for sensor_id, mtype in rows:
+        results[sensor_id].append(mtype)
+
+    return results
+
+
+def environments(rooms):
+    """
+    Batch version of Room.environment. The latest value of each measurement
+    type, from any sensor in the room.
+
+    args:
+        - list of Room objects (with their sensors loaded)
+    returns:
+        dict, of room id: dict like {'temperature': 20.0, 'humidity': 51.2}
+    """
+
+    results = {r.id: {} for r in rooms}
+    sensor_rooms = {s.id: r.id for r in rooms for s in r.sensors}
+    if not sensor_rooms:
+        return results
+
+    rows = db_session.query(
+        Measurement.sensor_id, Measurement.type, Measurement.value,
+        func.max(Measurement.created)).filter(
+        Measurement.sensor_id.in_(list(sensor_rooms))).filter(
+        Measurement.type != 'battery').group_by(
+        Measurement.sensor_id, Measurement.type).all()
+
+    fahrenheit = settings_snapshot().fahrenheit
+    latest = {}
+    for sensor_id, mtype, value, created in rows:
+        key = (sensor_rooms[sensor_id], mtype)
+        if key in latest and latest[key][0] >= created:
+            continue
+
+        latest[key] = (created, value)
+
+    for (room_id, mtype), (created, value) in latest.items():
+        # all db temp measurements are in celsius. always
+        if fahrenheit and mtype == 'temperature':
+            value = convert_celsius(value)
+
+        results[room_id][mtype] = value
+
+    return results
+
+
+@contextlib.contextmanager
+def override(objects, name, values, default=None):
+    """
+    Temporarily replace a method of some objects with precomputed results.
+
+    args:
+        - list of objects
+        - str: method name
+        - dict, of object id: value the method should return
+        - (optional) value for objects missing from the dict
+    """
+
+    for obj in objects:
+        value = values.get(obj.id, default)
+        obj.__dict__[name] = lambda value=value: value
+
+    try:
+        yield
+    finally:
+        for obj in objects:
+            obj.__dict__.pop(name, None)
+
+
+def prefetch_sensors(sensors):
+    """
+    CrudInterface prefetch function for sensors.
+
+    args:
+        - list of Sensor objects
+    returns:
+        context manager
+    """
+
+    return override(sensors, 'measurement_types', measurement_types(sensors),
+                    [])
+
+
+def prefetch_rooms(rooms):
+    """
+    CrudInterface prefetch function for rooms (and their nested sensors).
+
+    args:
+        - list of Room objects
+    returns:
+        context manager
+    """
+
+    sensors = [s for r in rooms for s in r.sensors]
+    stack = contextlib.ExitStack()
+    stack.enter_context(override(rooms, 'environment', environments(rooms), {}))
+    stack.enter_context(prefetch_sensors(sensors))
+    return stack
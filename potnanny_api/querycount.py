@@ -0,0 +1,76 @@
+import functools
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised (in testing mode) when a view runs too many SQL statements."""
+    pass
+
+
+def init_app(app, engine):
+    """
+    Count SQL statements per request.
+
+    With QUERY_COUNT_DEBUG set, every response gets an X-Query-Count header.
+
+    args:
+        - flask app
+        - sqlalchemy engine
+    returns:
+        none
+    """
+
+    event.listen(engine, 'before_cursor_execute', _count_statement)
+
+    @app.after_request
+    def add_query_count(response):
+        if current_app.config.get('QUERY_COUNT_DEBUG'):
+            response.headers['X-Query-Count'] = str(query_count())
+
+        return response
+
+
+def _count_statement(conn, cursor, statement, parameters, context, many):
+    # statements run outside of a request (poller, streams) are not counted
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def query_count():
+    """Number of SQL statements run so far in this app context."""
+
+    return g.get('query_count', 0)
+
+
+def query_budget(func):
+    """
+    Decorator for Resource methods that should run a fixed number of SQL
+    statements, no matter how many rows they return (like list endpoints).
+
+    In testing mode, a method that runs more than MAX_LIST_QUERIES
+    statements raises QueryBudgetExceeded, so N+1 query patterns fail the
+    tests instead of slowly creeping in.
+
+    Usage:
+        >>> class RoomListApi(Resource):
+        ...     @query_budget
+        ...     @conditional(ifc.etag)
+        ...     def get(self):
+        ...         ...
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = query_count()
+        rv = func(*args, **kwargs)
+
+        budget = current_app.config.get('MAX_LIST_QUERIES')
+        used = query_count() - start
+        if current_app.testing and budget and used > budget:
+            raise QueryBudgetExceeded("{} ran {} SQL statements (max {})".format(
+                func.__qualname__, used, budget))
+
+        return rv
+
+    return wrapper
@@ -0,0 +1,456 @@
+import json
+import logging
+import datetime
+import threading
+import collections
+from sqlalchemy import (Column, Integer, String, Float, DateTime, ForeignKey,
+    UniqueConstraint, tuple_)
+from potnanny_core.database import Base, db_session
+from potnanny_core.models.keychain import Keychain
+from potnanny_core.models.measurement import Measurement
+
+logger = logging.getLogger(__name__)
+
+# a chart row of a rollup, like a Measurement ('value' is the bucket mean)
+RollupRow = collections.namedtuple('RollupRow', [
+    'id', 'sensor_id', 'type', 'value', 'created'])
+
+# measurements not rolled up yet, aggregated like a rollup
+PendingRollup = collections.namedtuple('PendingRollup', [
+    'sensor_id', 'type', 'bucket', 'count', 'sum', 'min', 'max'])
+
+
+class MeasurementRollup(Base):
+    """
+    Pre-aggregated measurements, per sensor/type/time bucket.
+
+    Rows quack like a Measurement ('type', 'created', 'value'), so chart code
+    can use them in place of raw measurements. 'value' is the bucket mean.
+    """
+
+    __tablename__ = 'measurement_rollups'
+    __table_args__ = (
+        UniqueConstraint('resolution', 'sensor_id', 'type', 'bucket'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    resolution = Column(String(8), nullable=False)
+    type = Column(String(24), nullable=False)
+    bucket = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    min = Column(Float)
+    max = Column(Float)
+    sum = Column(Float, nullable=False, default=0.0)
+    last = Column(Float)
+    last_created = Column(DateTime)
+
+    # relationships
+    sensor_id = Column(Integer, ForeignKey('sensors.id'), nullable=False)
+
+    def __repr__(self):
+        return "<MeasurementRollup({},{},{})>".format(
+            self.resolution,
+            self.type,
+            self.bucket)
+
+    @property
+    def created(self):
+        return self.bucket
+
+    @property
+    def value(self):
+        if not self.count:
+            return None
+
+        return self.sum / self.count
+
+
+class RollupManager(object):
+    """
+    Class to maintain the measurement rollup tables.
+
+    Rollups are updated incrementally. The id of the last measurement that
+    was rolled up is kept in the Keychain, and each update only aggregates
+    measurements added since then. The Keychain row is updated with a
+    compare-and-set in the same transaction as the rollups, so two processes
+    updating at the same time cannot count a measurement twice.
+
+    Only the RollupUpdater (or 'flask rollup update') writes rollups. Reads
+    aggregate the measurements past the watermark on the fly (see pending),
+    so they are complete without writing anything.
+    """
+
+    KEY_NAME = 'measurement_rollup'
+
+    # coarsest first
+    RESOLUTIONS = [
+        ('day', 86400),
+        ('hour', 3600),
+        ('minute', 60),
+    ]
+
+    # a chart should have at least this many points per series
+    MIN_POINTS = 200
+
+    BATCH_SIZE = 5000
+
+    _lock = threading.Lock()
+
+    @classmethod
+    def seconds(cls, resolution):
+        """Width of a rollup bucket, in seconds."""
+
+        return dict(cls.RESOLUTIONS)[resolution]
+
+    @staticmethod
+    def floor(dt, resolution):
+        """
+        Get the start of the rollup bucket that a datetime falls in.
+
+        args:
+            - datetime
+            - str: (minute|hour|day)
+        returns:
+            datetime
+        """
+
+        if resolution == 'minute':
+            return dt.replace(second=0, microsecond=0)
+        elif resolution == 'hour':
+            return dt.replace(minute=0, second=0, microsecond=0)
+        elif resolution == 'day':
+            return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        raise ValueError("Unknown rollup resolution '{}'".format(resolution))
+
+    @classmethod
+    def choose(cls, start, end, min_points=None):
+        """
+        Choose the coarsest rollup that still gives enough points for a
+        chart window.
+
+        args:
+            - datetime: window start
+            - datetime: window end
+            - int: (optional) minimum points per series (default=MIN_POINTS)
+        returns:
+            str (minute|hour|day), or None if raw measurements should be used
+        """
+
+        if min_points is None:
+            min_points = cls.MIN_POINTS
+
+        window = (end - start).total_seconds()
+        for name, seconds in cls.RESOLUTIONS:
+            if window / seconds >= min_points:
+                return name
+
+        return None
+
+    @classmethod
+    def watermark(cls):
+        """Get the id of the last measurement that was rolled up."""
+
+        obj = Keychain.query.filter_by(name=cls.KEY_NAME).first()
+        if not obj:
+            return 0
+
+        return json.loads(obj.data)['last_id']
+
+    @classmethod
+    def update(cls, batch_size=None):
+        """
+        Roll up all measurements added since the last update.
+
+        args:
+            - int: (optional) measurements to aggregate per transaction
+        returns:
+            int (number of measurements rolled up)
+        """
+
+        if batch_size is None:
+            batch_size = cls.BATCH_SIZE
+
+        total = 0
+        with cls._lock:
+            while True:
+                count = cls._update_batch(batch_size)
+                if not count:
+                    break
+
+                total += count
+
+        return total
+
+    @classmethod
+    def backfill(cls, batch_size=None):
+        """
+        Delete all rollups, and rebuild them from the raw measurements.
+
+        args:
+            - int: (optional) measurements to aggregate per transaction
+        returns:
+            int (number of measurements rolled up)
+        """
+
+        with cls._lock:
+            MeasurementRollup.query.delete()
+            Keychain.query.filter_by(name=cls.KEY_NAME).delete()
+            db_session.commit()
+
+        return cls.update(batch_size)
+
+    @classmethod
+    def _update_batch(cls, batch_size):
+        obj = Keychain.query.populate_existing().filter_by(
+            name=cls.KEY_NAME).first()
+        if not obj:
+            obj = Keychain(name=cls.KEY_NAME, data=json.dumps({'last_id': 0}))
+            db_session.add(obj)
+            db_session.commit()
+
+        old_data = obj.data
+        last_id = json.loads(old_data)['last_id']
+
+        rows = db_session.query(
+            Measurement.id, Measurement.sensor_id, Measurement.type,
+            Measurement.value, Measurement.created).filter(
+            Measurement.id > last_id).order_by(
+            Measurement.id.asc()).limit(batch_size).all()
+
+        if not rows:
+            return 0
+
+        # aggregate the batch in memory first
+        acc = cls._aggregate(rows, [r[0] for r in cls.RESOLUTIONS])
+
+        # then merge it into the existing rollups. populate_existing(), so
+        # rows another process updated are not stale in our identity map.
+        existing = {}
+        keys = list(acc)
+        for i in range(0, len(keys), 500):
+            for r in MeasurementRollup.query.populate_existing().filter(tuple_(
+                    MeasurementRollup.resolution, MeasurementRollup.sensor_id,
+                    MeasurementRollup.type, MeasurementRollup.bucket).in_(
+                    keys[i:i + 500])).all():
+                existing[(r.resolution, r.sensor_id, r.type, r.bucket)] = r
+
+        for key, item in acc.items():
+            r = existing.get(key)
+            if r is None:
+                db_session.add(MeasurementRollup(
+                    resolution=key[0], sensor_id=key[1], type=key[2],
+                    bucket=key[3], count=item[0], min=item[1], max=item[2],
+                    sum=item[3], last=item[4], last_created=item[5]))
+                continue
+
+            r.count += item[0]
+            r.min = min(r.min, item[1])
+            r.max = max(r.max, item[2])
+            r.sum += item[3]
+            if r.last_created is None or item[5] >= r.last_created:
+                r.last = item[4]
+                r.last_created = item[5]
+
+        db_session.flush()
+        updated = Keychain.query.filter_by(
+            name=cls.KEY_NAME, data=old_data).update(
+            {'data': json.dumps({'last_id': rows[-1].id})},
+            synchronize_session=False)
+
+        if not updated:
+            # someone else rolled up this batch first
+            db_session.rollback()
+            return 0
+
+        db_session.commit()
+        return len(rows)
+
+    @classmethod
+    def _aggregate(cls, rows, resolutions):
+        """
+        Aggregate measurements per rollup bucket, in memory.
+
+        args:
+            - list of rows with sensor_id, type, value and created
+            - list of resolutions (minute|hour|day)
+        returns:
+            dict, of (resolution, sensor_id, type, bucket): list like
+            [count, min, max, sum, last, last_created]
+        """
+
+        acc = {}
+        for row in rows:
+            if row.sensor_id is None or row.value is None or row.created is None:
+                continue
+
+            for name in resolutions:
+                key = (name, row.sensor_id, row.type,
+                       cls.floor(row.created, name))
+                item = acc.get(key)
+                if item is None:
+                    acc[key] = [1, row.value, row.value, row.value,
+                                row.value, row.created]
+                    continue
+
+                item[0] += 1
+                item[1] = min(item[1], row.value)
+                item[2] = max(item[2], row.value)
+                item[3] += row.value
+                if row.created >= item[5]:
+                    item[4] = row.value
+                    item[5] = row.created
+
+        return acc
+
+    @classmethod
+    def pending(cls, resolution, sensor_ids, types, start, end):
+        """
+        Aggregate the measurements that are not rolled up yet (added after
+        the watermark), for the same buckets a rollup query would return.
+
+        args:
+            - str: (minute|hour|day)
+            - list of sensor ids
+            - list of measurement types (None for all types)
+            - datetime: window start
+            - datetime: window end
+        returns:
+            list of PendingRollup tuples, like (sensor_id, type, bucket,
+            count, sum, min, max)
+        """
+
+        # buckets that start by the end of the window, like query()
+        until = cls.floor(end, resolution) + datetime.timedelta(
+            seconds=cls.seconds(resolution))
+        query = db_session.query(
+            Measurement.sensor_id, Measurement.type, Measurement.value,
+            Measurement.created).filter(
+            Measurement.id > cls.watermark()).filter(
+            Measurement.sensor_id.in_(sensor_ids)).filter(
+            Measurement.created >= cls.floor(start, resolution),
+            Measurement.created < until)
+        if types is not None:
+            query = query.filter(Measurement.type.in_(types))
+
+        acc = cls._aggregate(query.all(), [resolution])
+        return [PendingRollup(key[1], key[2], key[3], item[0], item[3],
+                              item[1], item[2])
+                for key, item in acc.items()]
+
+    @classmethod
+    def query(cls, resolution, sensor_ids, types, start, end):
+        """
+        Query rollups for a chart window.
+
+        args:
+            - str: (minute|hour|day)
+            - list of sensor ids
+            - list of measurement types (None for all types)
+            - datetime: window start
+            - datetime: window end
+        returns:
+            list of RollupRow tuples, like (id, sensor_id, type, value,
+            created), where value is the bucket mean and created the bucket
+            start, sorted by bucket. Measurements not rolled up yet are
+            included (buckets only they fill have no id).
+        """
+
+        query = db_session.query(
+            MeasurementRollup.id, MeasurementRollup.sensor_id,
+            MeasurementRollup.type, MeasurementRollup.bucket,
+            MeasurementRollup.count, MeasurementRollup.sum).filter(
+            MeasurementRollup.resolution == resolution).filter(
+            MeasurementRollup.sensor_id.in_(sensor_ids)).filter(
+            MeasurementRollup.bucket >= cls.floor(start, resolution),
+            MeasurementRollup.bucket <= end)
+        if types is not None:
+            query = query.filter(MeasurementRollup.type.in_(types))
+
+        buckets = collections.OrderedDict()
+        for r in query.order_by(MeasurementRollup.bucket.asc()):
+            buckets[(r.sensor_id, r.type, r.bucket)] = [r.id, r.count, r.sum]
+
+        # read after the rollups. if an update commits in between, its
+        # measurements are missed by this read, but never counted twice
+        pending = cls.pending(resolution, sensor_ids, types, start, end)
+        for p in pending:
+            item = buckets.setdefault((p.sensor_id, p.type, p.bucket),
+                                      [None, 0, 0.0])
+            item[1] += p.count
+            item[2] += p.sum
+
+        rows = [RollupRow(item[0], key[0], key[1], item[2] / item[1], key[2])
+                for key, item in buckets.items()]
+        if pending:
+            rows.sort(key=lambda r: r.created)
+
+        return rows
+
+
+class RollupUpdater(object):
+    """
+    Background thread that keeps the rollups up to date, so requests only
+    read what is already rolled up.
+
+    Every worker process may run one. The compare-and-set in
+    RollupManager._update_batch keeps them from counting a measurement
+    twice. Without it (interval 0), run 'flask rollup update' from cron.
+
+    Initialization args:
+        - float: (optional) seconds between updates
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+
+    def init_app(self, app):
+        """
+        Configure from the app config (ROLLUP_INTERVAL), and start the
+        thread if the interval is not 0.
+
+        args:
+            - flask app
+        returns:
+            none
+        """
+
+        self.interval = app.config.get('ROLLUP_INTERVAL', self.interval)
+        if self.interval:
+            self.start()
+
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._loop, name='rollup-updater', daemon=True)
+            self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                RollupManager.update()
+            except Exception:
+                logger.exception("rollup update failed")
+                db_session.rollback()
+            finally:
+                # the updater thread gets its own scoped session
+                db_session.remove()
+
+            self._stop.wait(self.interval)
+
+
+updater = RollupUpdater()
@@ -0,0 +1,183 @@
+from marshmallow import Schema, fields, missing, utils
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+from marshmallow.exceptions import RegistryError
+
+
+# fields whose _serialize() only looks at the value, so the compiled dumper
+# can call it directly
+PLAIN_FIELDS = (fields.Field, fields.Raw, fields.Boolean, fields.Dict,
+                fields.List, fields.Number, fields.Integer, fields.Float,
+                fields.Decimal, fields.String, fields.UUID, fields.Email,
+                fields.Url, fields.DateTime, fields.LocalDateTime, fields.Date,
+                fields.Time, fields.TimeDelta)
+
+
+def compile_schema(schema):
+    """
+    Build a fast dump function for a marshmallow schema instance.
+
+    The schema is introspected once. The returned function reads each field
+    straight off the object and converts common types (int, float, str,
+    datetime) inline, instead of going through marshmallow's per-field
+    accessor, error store and field wrappers. Method and Nested fields are
+    supported, nested schemas are compiled too.
+
+    Schemas that cannot be reproduced exactly (dump hooks, custom accessors,
+    custom field classes, Meta 'fields'/'additional', ...) are not compiled.
+
+    args:
+        - marshmallow Schema instance
+    returns:
+        a function like schema.dump: f(obj, many=False) -> (data, errors).
+        It falls back to schema.dump if serialization fails, so errors are
+        reported the usual way. None if the schema cannot be compiled.
+    """
+
+    dump_one = _compile(schema)
+    if dump_one is None:
+        return None
+
+    def dump(obj, many=False):
+        try:
+            if many:
+                return [dump_one(o) for o in obj], {}
+
+            return dump_one(obj), {}
+        except Exception:
+            return schema.dump(obj, many=many)
+
+    return dump
+
+
+def _compile(schema):
+    cls = type(schema)
+    opts = schema.opts
+    processors = getattr(cls, '__processors__', {})
+    for tag in [PRE_DUMP, POST_DUMP]:
+        if processors.get((tag, False)) or processors.get((tag, True)):
+            return None
+
+    if (opts.fields or opts.additional or opts.dateformat or schema.prefix or
+            cls.get_attribute is not Schema.get_attribute or
+            cls.on_bind_field is not Schema.on_bind_field):
+        return None
+
+    entries = []
+    for name, field in schema.fields.items():
+        if field.load_only:
+            continue
+
+        getter = _field_getter(name, field, schema)
+        if getter is None:
+            return None
+
+        entries.append((field.dump_to or name, getter))
+
+    def dump_one(obj):
+        data = {}
+        for key, getter in entries:
+            value = getter(obj)
+            if value is not missing:
+                data[key] = value
+
+        return data
+
+    return dump_one
+
+
+def _field_getter(name, field, schema):
+    if type(field) is fields.Method:
+        if not field.serialize_method_name:
+            return lambda obj: missing
+
+        method = getattr(schema, field.serialize_method_name)
+
+        def get_method(obj):
+            try:
+                return method(obj)
+            except AttributeError:
+                return missing
+
+        return get_method
+
+    if type(field) is fields.Nested:
+        convert = _nested_converter(field)
+    elif type(field) in PLAIN_FIELDS:
+        convert = _value_converter(field)
+    else:
+        convert = None
+
+    attr = field.attribute or name
+    if convert is None or '.' in attr:
+        return None
+
+    default = field.default
+
+    def get_value(obj):
+        # same lookup order as marshmallow: obj[attr], then getattr()
+        if isinstance(obj, dict):
+            value = obj.get(attr, missing)
+        else:
+            value = getattr(obj, attr, missing)
+            if callable(value):
+                value = value()
+
+        if value is missing:
+            if callable(default):
+                return default()
+            return default
+
+        return convert(value)
+
+    return get_value
+
+
+def _value_converter(field):
+    kind = type(field)
+    if kind is fields.Integer and not field.as_string:
+        return lambda v: v if v is None else int(v)
+
+    if kind is fields.Float and not field.as_string:
+        return lambda v: v if v is None else float(v)
+
+    if kind is fields.String:
+        def convert_str(v):
+            if v is None or type(v) is str:
+                return v
+            return utils.ensure_text_type(v)
+
+        return convert_str
+
+    if (kind is fields.DateTime and field.dateformat in [None, 'iso'] and
+            not field.localtime):
+        def convert_datetime(v):
+            if v is None:
+                return None
+            if v.tzinfo is None:
+                # what utils.isoformat() gives for naive (UTC) datetimes
+                return v.isoformat() + '+00:00'
+            return utils.isoformat(v)
+
+        return convert_datetime
+
+    return lambda v: field._serialize(v, None, None)
+
+
+def _nested_converter(field):
+    if isinstance(field.only, str):
+        return None
+
+    try:
+        nested = field.schema
+    except RegistryError:
+        # nested schema class not imported (yet)
+        return None
+
+    dump_one = _compile(nested)
+    if dump_one is None:
+        return None
+
+    if field.many:
+        return lambda v: v if v is None else [dump_one(o) for o in v]
+
+    return lambda v: v if v is None else dump_one(v)
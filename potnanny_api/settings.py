@@ -0,0 +1,126 @@
+import json
+import copy
+import logging
+from potnanny_core.models.keychain import Keychain
+from potnanny_api.cache import LRUCache
+from potnanny_api.versions import TableVersions
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsSnapshot(object):
+    """
+    All user settings, read from the Keychain with one query, and parsed
+    once.
+
+    Settings that are not stored yet read as their defaults, like the core
+    setting classes return them (without storing them).
+
+    Usage:
+        >>> snap = settings_snapshot()
+        >>> snap.fahrenheit
+        False
+        >>> snap.get('polling_interval')
+        {'minutes': 5}
+
+    Initialization args:
+        - list of Keychain objects
+    """
+
+    NAMES = ['polling_interval', 'temperature_display', 'primitive_wireless',
+             'vesync_account', 'time_display']
+
+    DEFAULTS = {
+        'polling_interval': {'minutes': 5},
+        'temperature_display': {'display': 'celsius'},
+    }
+
+    def __init__(self, keys):
+        self._keys = {}
+        self._data = {}
+        for obj in keys:
+            if obj.name not in self.NAMES:
+                continue
+
+            try:
+                self._data[obj.name] = json.loads(obj.data)
+            except (TypeError, ValueError):
+                logger.warning("setting '{}' has invalid data".format(
+                    obj.name))
+                continue
+
+            self._keys[obj.name] = {'id': obj.id, 'name': obj.name,
+                                    'data': obj.data}
+
+        self.temperature_display = self.get('temperature_display').get(
+            'display', 'celsius')
+
+
+    def __contains__(self, name):
+        return name in self._data
+
+
+    def get(self, name, default=None):
+        """
+        Get the data of a setting.
+
+        args:
+            - str: setting name
+            - (optional) value if the setting is not stored, and has no
+              default
+        returns:
+            dict (a copy, safe to change), or default
+        """
+
+        if name in self._data:
+            return copy.deepcopy(self._data[name])
+
+        if name in self.DEFAULTS:
+            return copy.deepcopy(self.DEFAULTS[name])
+
+        return default
+
+
+    def keys(self):
+        """
+        Get the stored settings, like Keychain rows.
+
+        returns:
+            list of dicts, like {'id': 1, 'name':.., 'data': json text}
+        """
+
+        return [self._keys[n] for n in self.NAMES if n in self._keys]
+
+
+    @property
+    def fahrenheit(self):
+        return self.temperature_display == 'fahrenheit'
+
+
+# snapshots are checked against the settings version, so changes made
+# through the api by any process are seen right away. the ttl bounds how
+# long changes made without a version bump go unseen.
+_cache = LRUCache(maxsize=1, ttl=30)
+
+
+def settings_snapshot():
+    """
+    Get the snapshot of all settings.
+
+    The snapshot is cached under the settings table version, so a read is
+    one version lookup, and settings are only parsed again after a change
+    (SettingApi bumps the version), or after the cache ttl.
+
+    returns:
+        SettingsSnapshot
+    """
+
+    generation = _cache.generation
+    key = TableVersions.get('settings')
+    snap = _cache.get(key)
+    if snap is None:
+        snap = SettingsSnapshot(Keychain.query.filter(
+            Keychain.name.in_(SettingsSnapshot.NAMES)).all())
+        _cache.set(key, snap, generation)
+
+    return snap
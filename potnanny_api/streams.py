@@ -0,0 +1,202 @@
+import io
+import csv
+import json
+import time
+from flask import request, current_app, Response, stream_with_context
+from sqlalchemy import func
+from potnanny_core.database import db_session
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.utils import datetime_for_js, convert_celsius
+
+
+def measurement_pages(sensor_ids, start=None, end=None, types=None,
+                      after_id=0, page_size=1000):
+    """
+    Generate pages of measurement rows, oldest first.
+
+    Pages are read with keyset pagination on the primary key, one short
+    query per page, so memory stays bounded and no read transaction is held
+    open while the client downloads (which would block the poller from
+    writing to sqlite).
+
+    args:
+        - list of sensor ids
+        - datetime: (optional) window start
+        - datetime: (optional) window end
+        - list: (optional) measurement types
+        - int: (optional) only rows with an id greater than this
+        - int: (optional) rows per page
+    yields:
+        list of (id, sensor_id, type, value, created) tuples
+    """
+
+    while True:
+        query = db_session.query(
+            Measurement.id, Measurement.sensor_id, Measurement.type,
+            Measurement.value, Measurement.created).filter(
+            Measurement.sensor_id.in_(sensor_ids)).filter(
+            Measurement.id > after_id)
+
+        if start is not None:
+            query = query.filter(Measurement.created >= start)
+        if end is not None:
+            query = query.filter(Measurement.created <= end)
+        if types:
+            query = query.filter(Measurement.type.in_(types))
+
+        rows = query.order_by(Measurement.id.asc()).limit(page_size).all()
+        db_session.commit()
+        if not rows:
+            return
+
+        yield rows
+        if len(rows) < page_size:
+            return
+
+        after_id = rows[-1].id
+
+
+def measurement_dict(row, fahrenheit=False):
+    value = row.value
+    if fahrenheit and row.type == 'temperature':
+        value = convert_celsius(value)
+
+    return {
+        'id': row.id,
+        'sensor_id': row.sensor_id,
+        'type': row.type,
+        'value': value,
+        'created': datetime_for_js(row.created),
+    }
+
+
+def ndjson_lines(pages):
+    """
+    Serialize pages of measurement rows as newline delimited json.
+
+    args:
+        - iterable of row lists (see measurement_pages)
+    yields:
+        str
+    """
+
+    for rows in pages:
+        yield "".join(json.dumps(measurement_dict(r)) + "\n" for r in rows)
+
+
+def csv_lines(pages):
+    """
+    Serialize pages of measurement rows as csv, with a header line.
+
+    args:
+        - iterable of row lists (see measurement_pages)
+    yields:
+        str
+    """
+
+    fields = ['id', 'sensor_id', 'type', 'value', 'created']
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields)
+    writer.writeheader()
+
+    for rows in pages:
+        for r in rows:
+            writer.writerow(measurement_dict(r))
+
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def last_measurement_id():
+    """Get the id of the newest measurement, or 0 if there are none."""
+
+    return db_session.query(func.max(Measurement.id)).scalar() or 0
+
+
+def sse_events(sensor_ids, last_id, fahrenheit=False, poll_seconds=5,
+               max_seconds=600, heartbeat_seconds=30):
+    """
+    Generate Server-Sent Events for measurements added after last_id.
+
+    Measurements are written by the poller, in another process, so the
+    database is polled with a cheap primary key range query. Every event id
+    is the measurement id, so a reconnecting EventSource resumes where it
+    left off (Last-Event-ID). The stream ends after max_seconds, so it does
+    not hold a worker forever; browsers reconnect on their own.
+
+    args:
+        - list of sensor ids
+        - int: send measurements with an id greater than this
+        - bool: convert temperatures to fahrenheit
+        - int: seconds between database polls
+        - int: seconds before the stream is closed
+        - int: seconds of silence before a keep-alive comment is sent
+    yields:
+        str
+    """
+
+    yield "retry: {}\n\n".format(poll_seconds * 1000)
+
+    started = time.time()
+    quiet = 0
+    while time.time() - started < max_seconds:
+        for rows in measurement_pages(sensor_ids, after_id=last_id):
+            quiet = 0
+            last_id = rows[-1].id
+            yield "".join(
+                "id: {}\nevent: measurement\ndata: {}\n\n".format(
+                    r.id, json.dumps(measurement_dict(r, fahrenheit)))
+                for r in rows)
+
+        if quiet >= heartbeat_seconds:
+            quiet = 0
+            yield ": keep-alive\n\n"
+
+        time.sleep(poll_seconds)
+        quiet += poll_seconds
+
+
+def sse_response(sensor_ids, fahrenheit=False):
+    """
+    Build a streaming SSE Response for the current request.
+
+    The resume cursor is the Last-Event-ID header, or the 'last_id' query
+    arg. Without one, only measurements added from now on are sent.
+
+    args:
+        - list of sensor ids
+        - bool: convert temperatures to fahrenheit
+    returns:
+        Response
+    raises:
+        ValueError if the resume cursor is not an integer
+    """
+
+    cursor = request.headers.get('Last-Event-ID',
+                                 request.args.get('last_id', None))
+    if cursor is None:
+        last_id = last_measurement_id()
+    elif cursor.isdigit():
+        last_id = int(cursor)
+    else:
+        raise ValueError("Last-Event-ID must be a measurement id")
+
+    events = sse_events(
+        sensor_ids, last_id, fahrenheit,
+        poll_seconds=current_app.config['STREAM_POLL_SECONDS'],
+        max_seconds=current_app.config['STREAM_MAX_SECONDS'])
+
+    resp = Response(stream_with_context(events), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+    'csv': ('text/csv', csv_lines),
+}
@@ -0,0 +1,224 @@
+import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class TimeGrid(object):
+    """
+    Align several measurement series onto one shared time axis.
+
+    Every value is snapped to a bucket of 'interval' seconds, so series that
+    are sampled a few seconds apart (like temperature and humidity from the
+    same sensor reading) land on the same label. Buckets are kept in dicts,
+    so adding rows is one linear pass no matter how many labels there are.
+
+    Usage:
+        >>> grid = TimeGrid(interval=60)
+        >>> for row in results:
+        ...     grid.add(row.type, row.created, row.value)
+        >>> grid.timestamps()
+        [datetime(2019, 1, 1, 12, 0), datetime(2019, 1, 1, 12, 5), ...]
+        >>> grid.values('temperature')
+        [21.5, None, ...]
+
+    Initialization args:
+        - int: bucket size, in seconds (default=60)
+        - str: how to fill buckets a series has no value for. None leaves a
+          gap (null), 'previous' carries the last value forward.
+        - bool: dense. If True, the axis contains every bucket from the first
+          to the last one, not only the buckets that have data.
+    """
+
+    FILLS = [None, 'previous']
+
+    def __init__(self, interval=60, fill=None, dense=False):
+        if int(interval) < 1:
+            raise ValueError("interval must be at least 1 second")
+
+        if fill not in self.FILLS:
+            raise ValueError("fill must be one of {}".format(self.FILLS))
+
+        self.interval = int(interval)
+        self.fill = fill
+        self.dense = dense
+        self._series = {}
+        self._breaks = set()
+        self._axis = None
+
+
+    def bucket(self, dt):
+        """
+        Get the bucket number of a datetime.
+
+        args:
+            - naive datetime (UTC)
+        returns:
+            int
+        """
+
+        return int((dt - EPOCH).total_seconds()) // self.interval
+
+
+    def add_series(self, key):
+        """
+        Declare a series, so it keeps its position even if it has no data.
+
+        args:
+            - a hashable series key (like 'temperature')
+        returns:
+            none
+        """
+
+        if key not in self._series:
+            self._series[key] = {}
+
+
+    def add(self, key, dt, value):
+        """
+        Add one value to a series. Values that fall in the same bucket are
+        averaged.
+
+        args:
+            - a hashable series key (like 'temperature')
+            - naive datetime (UTC)
+            - float
+        returns:
+            none
+        """
+
+        buckets = self._series.get(key)
+        if buckets is None:
+            buckets = self._series[key] = {}
+
+        b = self.bucket(dt)
+        if b in buckets:
+            total, count = buckets[b]
+            buckets[b] = (total + value, count + 1)
+        else:
+            buckets[b] = (value, 1)
+
+        self._axis = None
+
+
+    def add_many(self, key, seconds, values):
+        """
+        Add a whole series at once. Bucketing and averaging are vectorized
+        when numpy arrays are passed in.
+
+        args:
+            - a hashable series key (like 'temperature')
+            - list or array of epoch seconds (UTC)
+            - list or array of floats
+        returns:
+            none
+        """
+
+        buckets = self._series.get(key)
+        if buckets is None:
+            buckets = self._series[key] = {}
+
+        if np is not None and isinstance(seconds, np.ndarray):
+            if not len(seconds):
+                return
+
+            uniq, inverse = np.unique(seconds // self.interval,
+                                      return_inverse=True)
+            sums = np.bincount(inverse, weights=values)
+            counts = np.bincount(inverse)
+            pairs = zip(uniq.tolist(), sums.tolist(), counts.tolist())
+        else:
+            pairs = ((s // self.interval, v, 1) for s, v in zip(seconds, values))
+
+        for b, total, count in pairs:
+            if b in buckets:
+                old = buckets[b]
+                buckets[b] = (old[0] + total, old[1] + count)
+            else:
+                buckets[b] = (total, count)
+
+        self._axis = None
+
+
+    def add_break(self, seconds):
+        """
+        Force a gap into the chart, in the bucket that follows a timestamp.
+        Every series without a value in that bucket gets None there (even
+        with fill='previous'), so chart lines are not drawn across it.
+
+        args:
+            - int: epoch seconds (UTC) of the last value before the gap
+        returns:
+            none
+        """
+
+        self._breaks.add(int(seconds) // self.interval + 1)
+        self._axis = None
+
+
+    def keys(self):
+        """List of series keys, in the order they were added."""
+
+        return list(self._series)
+
+
+    def buckets(self):
+        """Sorted list of bucket numbers on the shared axis."""
+
+        if self._axis is None:
+            seen = set(self._breaks)
+            for buckets in self._series.values():
+                seen.update(buckets)
+
+            if not seen:
+                self._axis = []
+            elif self.dense:
+                self._axis = list(range(min(seen), max(seen) + 1))
+            else:
+                self._axis = sorted(seen)
+
+        return self._axis
+
+
+    def seconds(self):
+        """List of epoch seconds (UTC), one per bucket on the axis."""
+
+        return [b * self.interval for b in self.buckets()]
+
+
+    def timestamps(self):
+        """List of naive datetimes (UTC), one per bucket on the axis."""
+
+        return [EPOCH + datetime.timedelta(seconds=b * self.interval)
+                for b in self.buckets()]
+
+
+    def values(self, key):
+        """
+        Get the values of a series, aligned to the shared axis.
+
+        args:
+            - a series key
+        returns:
+            list of floats, with None (or the previous value, depending on
+            the fill setting) where the series has no data.
+        """
+
+        buckets = self._series.get(key, {})
+        results = []
+        last = None
+        for b in self.buckets():
+            pair = buckets.get(b)
+            if pair is None:
+                if b in self._breaks:
+                    last = None
+                results.append(last if self.fill == 'previous' else None)
+            else:
+                last = pair[0] if pair[1] == 1 else pair[0] / pair[1]
+                results.append(last)
+
+        return results
@@ -0,0 +1,24 @@
+import datetime
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO-8601 datetime string, like the ones sent by javascript.
+
+    args:
+        - str (like "2019-05-01T12:00:00" or "2019-05-01T12:00:00.000Z")
+    returns:
+        naive datetime object, in UTC
+    raises:
+        ValueError if the string cannot be parsed
+    """
+
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return dt
@@ -0,0 +1,112 @@
+from sqlalchemy import Integer, cast, event, func
+from sqlalchemy.orm import Session
+from potnanny_core.database import db_session
+from potnanny_core.models.keychain import Keychain
+
+
+class TableVersions(object):
+    """
+    Change counters for database tables, stored in the Keychain.
+
+    Counters are bumped inside the transaction that makes the change, so
+    every worker process sees the same value after the commit. Readers use
+    them as a cheap "has anything changed?" check.
+
+    In-process caches can listen() for changes. Listeners are called after
+    the commit, so they never see a change that was rolled back.
+    """
+
+    PREFIX = 'version:'
+
+    # session.info key of the tables bumped in the current transaction
+    INFO_KEY = 'bumped_tables'
+
+    _listeners = []
+
+    @classmethod
+    def listen(cls, func):
+        """
+        Call a function after each commit that bumped a table counter.
+
+        args:
+            - callable, called with the table name
+        returns:
+            none
+        """
+
+        cls._listeners.append(func)
+
+    @classmethod
+    def bump(cls, *names):
+        """
+        Increment the counters of one or more tables. Does not commit, so
+        call this before committing the change itself.
+
+        args:
+            - str: table names
+        returns:
+            none
+        """
+
+        for name in names:
+            key = cls.PREFIX + name
+            updated = Keychain.query.filter_by(name=key).update(
+                {Keychain.data: cast(Keychain.data, Integer) + 1},
+                synchronize_session=False)
+            if not updated:
+                db_session.add(Keychain(name=key, data='1'))
+
+        db_session.info.setdefault(cls.INFO_KEY, set()).update(names)
+
+    @classmethod
+    def get(cls, *names):
+        """
+        Get the counters of one or more tables.
+
+        args:
+            - str: table names
+        returns:
+            tuple of ints, in the same order as the names
+        """
+
+        keys = [cls.PREFIX + n for n in names]
+        rows = dict(db_session.query(Keychain.name, Keychain.data).filter(
+            Keychain.name.in_(keys)).all())
+
+        return tuple(int(rows.get(k) or 0) for k in keys)
+
+    @classmethod
+    def fingerprint(cls, *models):
+        """
+        Get a cheap fingerprint of the contents of one or more tables.
+
+        Combines the change counters with the highest id of each table, so
+        rows inserted by other programs (like sensors found by the poller)
+        change the fingerprint too.
+
+        args:
+            - model classes
+        returns:
+            tuple
+        """
+
+        versions = cls.get(*[m.__tablename__ for m in models])
+        max_ids = db_session.query(
+            *[db_session.query(func.max(m.id)).as_scalar() for m in models]
+            ).one()
+
+        return versions + tuple(max_ids)
+
+
+# core's db_session is made by a plain function, so listen on all Sessions
+@event.listens_for(Session, 'after_commit')
+def _notify_listeners(session):
+    names = session.info.pop(TableVersions.INFO_KEY, None)
+    for name in names or []:
+        for listener in TableVersions._listeners:
+            listener(name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_bumps(session):
+    session.info.pop(TableVersions.INFO_KEY, None)
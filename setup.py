@@ -20,4 +20,7 @@ setup(
         'flask-wtf',
         'potnanny-core==0.2.9',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
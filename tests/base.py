@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from flask_jwt_extended import create_access_token
+from potnanny_api import create_app
+from potnanny_api.config import Testing
+from potnanny_api.crud import CrudInterface
+from potnanny_core.database import db_session
+
+
+class Config(Testing):
+    SQLALCHEMY_DATABASE_URI = "sqlite:///"
+    POTNANNY_PLUGIN_PATH = os.path.join(tempfile.gettempdir(),
+                                        "potnanny-plugins")
+    JWT_TOKEN_LOCATION = ['headers']
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Test case with an app on a fresh in-memory database, and a test client
+    that sends a login token.
+
+    Subclasses add their rows in seed().
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # the plugin loader needs the directory, even with no plugins
+        os.makedirs(os.path.join(Config.POTNANNY_PLUGIN_PATH, 'action'),
+                    exist_ok=True)
+        cls.app = create_app(Config)
+
+        # caches outlive the app. a fresh database has the same versions
+        # and ids as the last one
+        for ifc in CrudInterface._cached:
+            ifc._cache.clear()
+
+        cls.seed()
+        with cls.app.app_context():
+            cls.token = create_access_token(identity='admin')
+
+
+    @classmethod
+    def tearDownClass(cls):
+        db_session.remove()
+
+
+    @classmethod
+    def seed(cls):
+        pass
+
+
+    def setUp(self):
+        self.client = self.app.test_client()
+        self.headers = {'Authorization': 'Bearer {}'.format(self.token)}
+
+
+    def get(self, url):
+        return self.client.get(url, headers=self.headers)
+
+
+    def post(self, url, data=None):
+        return self.client.post(url, json=data, headers=self.headers)
@@ -0,0 +1,102 @@
+from potnanny_api.crud import CrudInterface
+from potnanny_core.database import db_session
+from potnanny_core.models.room import Room
+from tests.base import AppTestCase
+
+URL = '/api/1.0/rooms/bulk'
+
+
+class BulkTest(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Room.query.delete()
+        for name in ['one', 'two', 'three']:
+            db_session.add(Room(name=name))
+
+        db_session.commit()
+        self.ids = {r.name: r.id for r in Room.query}
+
+
+    def names(self):
+        db_session.expire_all()
+        return sorted(r.name for r in Room.query)
+
+
+    def test_applies_every_operation(self):
+        rv = self.post(URL, [
+            {'op': 'create', 'data': {'name': 'four'}},
+            {'op': 'update', 'id': self.ids['one'], 'data': {'name': 'uno'}},
+            {'op': 'delete', 'id': self.ids['two']},
+        ])
+        self.assertEqual(rv.status_code, 200, rv.get_data(as_text=True))
+
+        results = rv.get_json()
+        self.assertEqual([r['code'] for r in results], [200, 200, 204])
+        self.assertEqual(results[0]['data']['name'], 'four')
+        self.assertEqual(results[1]['id'], self.ids['one'])
+        self.assertEqual(self.names(), ['four', 'three', 'uno'])
+
+
+    def test_missing_objects_fail_the_whole_batch(self):
+        rv = self.post(URL, [
+            {'op': 'create', 'data': {'name': 'four'}},
+            {'op': 'update', 'id': 999, 'data': {'name': 'x'}},
+            {'op': 'delete', 'id': self.ids['two']},
+            {'op': 'delete', 'id': self.ids['two']},
+        ])
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual([r['code'] for r in rv.get_json()],
+                         [424, 404, 424, 404])
+        self.assertEqual(self.names(), ['one', 'three', 'two'])
+
+
+    def test_invalid_operations_fail_the_whole_batch(self):
+        rv = self.post(URL, [
+            {'op': 'update', 'id': self.ids['one'], 'data': {'name': 'uno'}},
+            {'op': 'rename', 'id': self.ids['two']},
+            {'op': 'delete'},
+            {'op': 'create', 'data': {}},
+        ])
+        self.assertEqual(rv.status_code, 400)
+
+        results = rv.get_json()
+        self.assertEqual([r['code'] for r in results], [424, 400, 400, 400])
+        self.assertIn('op', results[1]['errors'])
+        self.assertIn('id', results[2]['errors'])
+        self.assertIn('name', results[3]['errors'])
+        self.assertEqual(self.names(), ['one', 'three', 'two'])
+
+
+    def test_error_while_applying_rolls_back(self):
+        self.assertEqual(self.get('/api/1.0/rooms').status_code, 200)
+
+        # valid operations, but the last breaks the unique room name
+        # constraint when the batch is committed
+        rv = self.post(URL, [
+            {'op': 'create', 'data': {'name': 'four'}},
+            {'op': 'update', 'id': self.ids['one'], 'data': {'name': 'uno'}},
+            {'op': 'delete', 'id': self.ids['two']},
+            {'op': 'create', 'data': {'name': 'three'}},
+        ])
+        self.assertEqual(rv.status_code, 400)
+        self.assertIn('msg', rv.get_json())
+        self.assertEqual(self.names(), ['one', 'three', 'two'])
+
+        # and the cached list was not changed by them
+        rv = self.get('/api/1.0/rooms')
+        self.assertEqual(sorted(r['name'] for r in rv.get_json()),
+                         ['one', 'three', 'two'])
+
+
+    def test_batch_size(self):
+        rv = self.post(URL, [])
+        self.assertEqual(rv.status_code, 400)
+
+        rv = self.post(URL, {'op': 'delete', 'id': 1})
+        self.assertEqual(rv.status_code, 400)
+
+        rv = self.post(URL, [{'op': 'delete', 'id': self.ids['one']}] *
+                       (CrudInterface.MAX_BULK + 1))
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(self.names(), ['one', 'three', 'two'])
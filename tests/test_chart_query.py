@@ -0,0 +1,41 @@
+from werkzeug.datastructures import MultiDict
+from potnanny_api.chart_utils import ChartQuery
+from tests.base import AppTestCase
+
+
+def chart_query(**kwargs):
+    kwargs.setdefault('rollup', 'raw')
+    return ChartQuery(MultiDict(kwargs))
+
+
+class ChartQueryTest(AppTestCase):
+
+    def test_defaults(self):
+        cq = chart_query()
+        self.assertEqual(cq.interval, 60)
+        self.assertEqual(cq.max_gap, 1800)
+
+        cq = chart_query(interval='900', gap='0')
+        self.assertEqual(cq.interval, 900)
+        self.assertEqual(cq.max_gap, 0)
+
+        cq = chart_query(interval='900', since='12')
+        self.assertEqual(cq.interval, 900)
+        self.assertEqual(cq.max_gap, 2700)
+
+
+    def test_invalid_numbers(self):
+        for args in [{'interval': 'abc'}, {'interval': '0'},
+                     {'interval': '1.5'}, {'interval': 'abc', 'since': '1'},
+                     {'gap': 'abc'}, {'gap': '-1'}]:
+            with self.subTest(args=args):
+                with self.assertRaises(ValueError):
+                    chart_query(**args)
+
+
+    def test_invalid_args_are_a_bad_request(self):
+        for query in ['interval=abc', 'gap=x', 'interval=abc&since=1']:
+            with self.subTest(query=query):
+                rv = self.get('/api/1.0/sensors/1/chart?' + query)
+                self.assertEqual(rv.status_code, 400)
+                self.assertIn('must be an integer', rv.get_json()['msg'])
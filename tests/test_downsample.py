@@ -0,0 +1,80 @@
+import math
+import datetime
+import unittest
+import collections
+from potnanny_api.chart_utils import (DOWNSAMPLERS, lttb_indices,
+    minmax_indices, downsample_measurements)
+
+Row = collections.namedtuple('Row', ['sensor_id', 'type', 'value', 'created'])
+
+
+def wave(n):
+    xs = [float(i * 60) for i in range(n)]
+    ys = [20 + 5 * math.sin(i / 40.0) + (i % 7) * 0.1 for i in range(n)]
+    return xs, ys
+
+
+class DownsampleTest(unittest.TestCase):
+
+    def test_indices(self):
+        for name, func in sorted(DOWNSAMPLERS.items()):
+            for n in [3, 4, 10, 101, 1000]:
+                xs, ys = wave(n)
+                for threshold in [2, 3, 4, 5, 10, 99, 500]:
+                    with self.subTest(method=name, n=n, threshold=threshold):
+                        idx = func(xs, ys, threshold)
+                        self.assertLessEqual(len(idx), threshold)
+                        self.assertEqual(idx, sorted(set(idx)))
+                        self.assertEqual(idx[0], 0)
+                        self.assertEqual(idx[-1], n - 1)
+                        if threshold >= n:
+                            self.assertEqual(idx, list(range(n)))
+
+
+    def test_short_series(self):
+        for name, func in sorted(DOWNSAMPLERS.items()):
+            with self.subTest(method=name):
+                self.assertEqual(func([], [], 10), [])
+                self.assertEqual(func([0.0], [1.0], 10), [0])
+                self.assertEqual(func([0.0, 1.0], [1.0, 2.0], 10), [0, 1])
+
+
+    def test_lttb_fills_threshold(self):
+        xs, ys = wave(1000)
+        self.assertEqual(len(lttb_indices(xs, ys, 100)), 100)
+
+
+    def test_spikes_are_kept(self):
+        xs, ys = wave(1000)
+        ys[500] = 100.0
+        ys[700] = -100.0
+        self.assertIn(500, lttb_indices(xs, ys, 50))
+
+        idx = minmax_indices(xs, ys, 50)
+        self.assertIn(500, idx)
+        self.assertIn(700, idx)
+
+
+    def test_measurements_per_series(self):
+        start = datetime.datetime(2019, 1, 1)
+        rows = []
+        for i in range(500):
+            t = start + datetime.timedelta(minutes=i)
+            rows.append(Row(1, 'temperature', 20 + i % 5, t))
+            rows.append(Row(2, 'temperature', 30 + i % 3, t))
+            rows.append(Row(1, 'humidity', 50 + i % 9, t))
+
+        for method in sorted(DOWNSAMPLERS):
+            with self.subTest(method=method):
+                result = downsample_measurements(rows, 40, method)
+                counts = collections.Counter(
+                    (r.sensor_id, r.type) for r in result)
+                self.assertEqual(len(counts), 3)
+                self.assertTrue(all(c <= 40 for c in counts.values()))
+                self.assertEqual([r.created for r in result],
+                                 sorted(r.created for r in result))
+
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            downsample_measurements([], 10, 'average')
@@ -0,0 +1,205 @@
+import json
+import random
+import datetime
+import unittest
+from potnanny_api.grow_report import (GrowReport, Histogram, build_report,
+    grow_phases, save_report)
+from potnanny_core.database import db_session
+from potnanny_core.models.grow import Grow
+from potnanny_core.models.room import Room
+from potnanny_core.models.sensor import Sensor
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.models.schedule import ScheduleOnOff
+from tests.base import AppTestCase
+
+MONDAY = datetime.datetime(2019, 1, 7)
+
+
+def at(days=0, hours=0, minutes=0):
+    return MONDAY + datetime.timedelta(days=days, hours=hours,
+                                       minutes=minutes)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(Histogram().summary(), {
+            'count': 0, 'min': None, 'max': None, 'mean': None, 'p10': None,
+            'p25': None, 'p50': None, 'p75': None, 'p90': None})
+
+
+    def test_percentile_ranks(self):
+        h = Histogram()
+        for v in [5, 3, 1, 4, 2]:
+            h.add(v)
+
+        self.assertEqual([h.percentile(p) for p in [0, 25, 50, 90, 100]],
+                         [1, 2, 3, 4, 5])
+
+
+    def test_percentiles(self):
+        rng = random.Random(7)
+        for resolution in [0.1, 0.5]:
+            values = [rng.gauss(22, 3) for i in range(2000)]
+            h = Histogram(resolution)
+            for v in values:
+                h.add(v)
+
+            values.sort()
+            for p in [0, 1, 10, 25, 50, 75, 90, 99, 100]:
+                with self.subTest(resolution=resolution, p=p):
+                    expected = values[int(p / 100.0 * (len(values) - 1))]
+                    self.assertAlmostEqual(h.percentile(p), expected,
+                                           delta=resolution / 2 + 1e-9)
+
+            summary = h.summary()
+            self.assertEqual(summary['count'], 2000)
+            self.assertEqual(summary['min'], round(values[0], 2))
+            self.assertEqual(summary['max'], round(values[-1], 2))
+            self.assertEqual(summary['mean'], round(sum(values) / 2000, 2))
+
+
+    def test_percentiles_stay_within_the_values(self):
+        h = Histogram(1.0)
+        for v in [20.4, 20.3, 20.45]:
+            h.add(v)
+
+        # every value falls in the bin at 20.0
+        self.assertEqual(h.percentile(10), 20.3)
+        self.assertEqual(h.percentile(90), 20.3)
+        self.assertEqual(h.summary()['max'], 20.45)
+
+
+class BuildReportTest(AppTestCase):
+
+    @classmethod
+    def seed(cls):
+        room = Room(name='room')
+        other = Room(name='other room')
+        db_session.add_all([room, other])
+        db_session.flush()
+
+        sensor = Sensor(name='sensor', address='aa:bb', room_id=room.id)
+        elsewhere = Sensor(name='sensor', address='cc:dd', room_id=other.id)
+        db_session.add_all([sensor, elsewhere])
+        db_session.flush()
+
+        outlet = json.dumps({'type': 'wireless', 'id': '1'})
+        db_session.add_all([
+            ScheduleOnOff(name='lights growth schedule', room_id=room.id,
+                          outlet=outlet, is_active=False, days=127,
+                          on_utc_hour=6, on_minute=0,
+                          off_utc_hour=0, off_minute=0),
+            ScheduleOnOff(name='lights flowering schedule', room_id=room.id,
+                          outlet=outlet, is_active=True, days=127,
+                          on_utc_hour=8, on_minute=0,
+                          off_utc_hour=20, off_minute=0),
+        ])
+
+        # every 20 minutes, from a day before the grow to a day after
+        cls.rows = []
+        for i in range(6 * 24 * 3):
+            created = at(-1, minutes=i * 20)
+            for mtype, value in [('temperature', 20 + i % 9),
+                                 ('humidity', 40 + i % 23)]:
+                cls.rows.append((mtype, float(value), created))
+                db_session.add(Measurement(sensor_id=sensor.id, type=mtype,
+                                           value=value, created=created))
+
+            db_session.add(Measurement(sensor_id=sensor.id, type='battery',
+                                       value=90, created=created))
+            db_session.add(Measurement(sensor_id=elsewhere.id,
+                                       type='temperature', value=99,
+                                       created=created))
+
+        grow = Grow(name='grow', room_id=room.id, started=at(0, 3),
+                    transitioned=at(2, 3), ended=at(4, 3))
+        db_session.add(grow)
+        db_session.commit()
+        cls.grow_id = grow.id
+
+
+    def expected(self, grow):
+        """Stats split by phase and lights, from the raw rows."""
+
+        lights = {'growth': (6, 24), 'flowering': (8, 20)}
+        acc = {}
+        for mtype, value, created in self.rows:
+            if not grow.started <= created < grow.ended:
+                continue
+
+            if created < grow.transitioned:
+                phase = 'growth'
+            else:
+                phase = 'flowering'
+
+            on, off = lights[phase]
+            period = 'day' if on <= created.hour < off else 'night'
+            for key in [(phase, mtype, 'all'), (phase, mtype, period)]:
+                acc.setdefault(key, []).append(value)
+
+        return {k: {'count': len(v), 'min': min(v), 'max': max(v),
+                    'mean': round(sum(v) / len(v), 2)}
+                for k, v in acc.items()}
+
+
+    def test_phases(self):
+        grow = Grow(started=at(0), transitioned=None, ended=None)
+        self.assertEqual(grow_phases(grow, at(1)), [('growth', at(0), at(1))])
+
+        grow.transitioned = at(1)
+        grow.ended = at(3)
+        self.assertEqual(grow_phases(grow, at(9)), [
+            ('growth', at(0), at(1)), ('flowering', at(1), at(3))])
+
+
+    def test_report(self):
+        grow = Grow.query.get(self.grow_id)
+        report = build_report(grow, batch_size=50)
+        expected = self.expected(grow)
+
+        self.assertEqual(report['measurements'],
+                         sum(v['count'] for (p, t, period), v in
+                             expected.items() if period == 'all'))
+        self.assertEqual(sorted(report['phases']), ['flowering', 'growth'])
+
+        growth = report['phases']['growth']
+        self.assertEqual(growth['days'], 2.0)
+        self.assertEqual(growth['light_hours'], 36.0)
+        flowering = report['phases']['flowering']
+        self.assertEqual(flowering['days'], 2.0)
+        self.assertEqual(flowering['light_hours'], 24.0)
+
+        found = {}
+        for phase, data in report['phases'].items():
+            self.assertEqual(sorted(data['stats']),
+                             ['humidity', 'temperature'])
+            for mtype, periods in data['stats'].items():
+                for period, summary in periods.items():
+                    found[(phase, mtype, period)] = {
+                        k: summary[k] for k in ['count', 'min', 'max', 'mean']}
+
+        self.assertEqual(found, expected)
+
+
+    def test_unfinished_grow(self):
+        ended = Grow.query.get(self.grow_id)
+        grow = Grow(room_id=ended.room_id, started=ended.started)
+        report = build_report(grow, now=at(1, 3))
+
+        self.assertEqual(list(report['phases']), ['growth'])
+        self.assertIsNone(report['ended'])
+        growth = report['phases']['growth']
+        self.assertEqual(growth['light_hours'], 18.0)
+        self.assertEqual(growth['stats']['temperature']['all']['count'], 72)
+
+
+    def test_save_replaces_the_report(self):
+        save_report(self.grow_id)
+        save_report(self.grow_id)
+        reports = GrowReport.query.filter_by(grow_id=self.grow_id).all()
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(json.loads(reports[0].data)['grow_id'], self.grow_id)
+
+        with self.assertRaises(ValueError):
+            save_report(self.grow_id + 100)
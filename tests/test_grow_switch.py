@@ -0,0 +1,57 @@
+import datetime
+from potnanny_api.grow_report import GrowReport
+from potnanny_core.database import db_session
+from potnanny_core.models.room import Room
+from potnanny_core.models.sensor import Sensor
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.models.grow import Grow
+from tests.base import AppTestCase
+
+
+class GrowSwitchTest(AppTestCase):
+
+    @classmethod
+    def seed(cls):
+        now = datetime.datetime.utcnow()
+        room = Room(name='room')
+        db_session.add(room)
+        db_session.flush()
+
+        sensor = Sensor(name='sensor', address='aa:bb', room_id=room.id)
+        db_session.add(sensor)
+        db_session.flush()
+        for i in range(60):
+            db_session.add(Measurement(
+                sensor_id=sensor.id, type='temperature', value=20 + i % 5,
+                created=now - datetime.timedelta(minutes=i)))
+
+        grow = Grow(name='grow', room_id=room.id,
+                    started=now - datetime.timedelta(days=3))
+        db_session.add(grow)
+        db_session.commit()
+        cls.grow_id = grow.id
+
+
+    def test_switch_to_end(self):
+        rv = self.post('/api/1.0/grows/{}/switch'.format(self.grow_id),
+                       {'phase': 'end'})
+        self.assertEqual(rv.status_code, 202, rv.get_data(as_text=True))
+
+        body = rv.get_json()
+        self.assertEqual(body['grow']['id'], self.grow_id)
+        self.assertIsNotNone(body['grow']['ended'])
+        self.assertEqual(body['job']['name'], 'grow_report')
+        self.assertIn('Location', rv.headers)
+
+        # jobs run inline in testing
+        self.assertEqual(body['job']['status'], 'done')
+        self.assertIsNotNone(
+            GrowReport.query.filter_by(grow_id=self.grow_id).first())
+        rv = self.get('/api/1.0/grows/{}/report'.format(self.grow_id))
+        self.assertEqual(rv.status_code, 200)
+
+
+    def test_switch_rejects_unknown_phase(self):
+        rv = self.post('/api/1.0/grows/{}/switch'.format(self.grow_id),
+                       {'phase': 'harvest'})
+        self.assertEqual(rv.status_code, 400)
@@ -0,0 +1,128 @@
+import json
+import datetime
+from potnanny_api.jobs import Job
+from potnanny_api.querycount import QueryBudgetExceeded
+from potnanny_core.database import db_session
+from potnanny_core.models.room import Room
+from potnanny_core.models.sensor import Sensor
+from potnanny_core.models.measurement import Measurement
+from potnanny_core.models.action import Action
+from potnanny_core.models.trigger import Trigger
+from potnanny_core.models.grow import Grow
+from potnanny_core.models.schedule import ScheduleOnOff
+from tests.base import AppTestCase
+
+
+# enough rows that a query per row (or per relationship of a row) runs
+# past MAX_LIST_QUERIES
+ROOMS = 20
+LIST_URLS = [
+    '/api/1.0/rooms',
+    '/api/1.0/sensors',
+    '/api/1.0/actions',
+    '/api/1.0/grows',
+    '/api/1.0/schedules',
+    '/api/1.0/jobs',
+]
+
+
+class ListQueryTest(AppTestCase):
+
+    @classmethod
+    def seed(cls):
+        now = datetime.datetime.utcnow()
+        for i in range(ROOMS):
+            room = Room(name='room {}'.format(i))
+            db_session.add(room)
+            db_session.flush()
+
+            for j in range(2):
+                sensor = Sensor(name='sensor {}.{}'.format(i, j),
+                                address='{:02x}:{:02x}'.format(i, j),
+                                room_id=room.id)
+                db_session.add(sensor)
+                db_session.flush()
+                for mtype, value in [('temperature', 22.5), ('humidity', 55)]:
+                    db_session.add(Measurement(sensor_id=sensor.id, type=mtype,
+                                               value=value, created=now))
+
+            action = Action(name='action {}'.format(i),
+                            measurement_type='temperature', plugin='Test',
+                            room_id=room.id)
+            db_session.add(action)
+            db_session.flush()
+            db_session.add(Trigger(action_id=action.id))
+
+            db_session.add(Grow(name='grow {}'.format(i), room_id=room.id,
+                                started=now - datetime.timedelta(days=30)))
+            db_session.add(ScheduleOnOff(
+                name='lights {}'.format(i), room_id=room.id,
+                outlet=json.dumps({'type': 'wireless', 'id': str(i)}),
+                on_utc_hour=6, off_utc_hour=18))
+            db_session.add(Job(name='grow_report', status='done'))
+
+        db_session.commit()
+
+
+    def assertListOk(self, url, count=None):
+        rv = self.get(url)
+        self.assertEqual(rv.status_code, 200, rv.get_data(as_text=True))
+        self.assertLessEqual(int(rv.headers['X-Query-Count']),
+                             self.app.config['MAX_LIST_QUERIES'])
+        if count is not None:
+            self.assertEqual(len(rv.get_json()), count)
+
+        return rv
+
+
+    def test_lists_within_budget(self):
+        expected = {'/api/1.0/sensors': ROOMS * 2}
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                self.assertListOk(url, expected.get(url, ROOMS))
+
+
+    def test_paged_and_filtered_lists_within_budget(self):
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                self.assertListOk(url + '?limit=5&after_id=3', 5)
+                self.assertListOk(url + '?name__ne=x&sort=-name')
+
+
+    def test_budget_is_enforced(self):
+        budget = self.app.config['MAX_LIST_QUERIES']
+        self.app.config['MAX_LIST_QUERIES'] = 1
+        try:
+            with self.assertRaises(QueryBudgetExceeded):
+                self.get('/api/1.0/rooms?_=budget')
+        finally:
+            self.app.config['MAX_LIST_QUERIES'] = budget
+
+
+    def test_cache_buster_is_ignored(self):
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                self.assertListOk(url + '?_=1699999')
+
+
+    def test_unknown_filter_is_rejected(self):
+        for query in ['foo__eq=1', 'room_ids=3', '__=1']:
+            with self.subTest(query=query):
+                rv = self.get('/api/1.0/rooms?' + query)
+                self.assertEqual(rv.status_code, 400)
+
+
+    def test_rows_added_outside_the_api_are_listed(self):
+        # like the poller, which does not bump table versions
+        first = self.assertListOk('/api/1.0/sensors')
+        sensor = Sensor(name='found', address='ff:ff', room_id=1)
+        db_session.add(sensor)
+        db_session.commit()
+        try:
+            rv = self.client.get('/api/1.0/sensors', headers=dict(
+                self.headers, **{'If-None-Match': first.headers['ETag']}))
+            self.assertEqual(rv.status_code, 200)
+            self.assertIn('found', [s['name'] for s in rv.get_json()])
+        finally:
+            db_session.delete(sensor)
+            db_session.commit()
@@ -0,0 +1,130 @@
+import time
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from potnanny_api.apps.outlet.commands import OutletCommandQueue
+
+
+class FakeController(object):
+    """Records switched states. Sends block until the gate is opened."""
+
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.sent = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def switch_outlet(self, outlet):
+        self.gate.wait(5)
+        self.sent.append(outlet['state'])
+        return self.ok
+
+
+def outlet(state, id='1'):
+    return {'id': id, 'type': 'wireless', 'state': state}
+
+
+class OutletCommandQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = OutletCommandQueue()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.oc = FakeController()
+
+
+    def tearDown(self):
+        self.oc.gate.set()
+        self.pool.shutdown(wait=True)
+
+
+    def submit(self, state, id='1', deadline=None, **kwargs):
+        if deadline is None:
+            deadline = time.monotonic() + 10
+
+        return self.queue.submit(self.oc, outlet(state, id), deadline,
+                                 self.pool, **kwargs)
+
+
+    def test_rapid_toggles_send_the_final_state(self):
+        self.oc.gate.clear()
+        first, how = self.submit(1)
+        self.assertEqual(how, 'queued')
+
+        second, how = self.submit(0)
+        self.assertEqual(how, 'queued')
+        third, how = self.submit(1, force=True)
+        self.assertEqual(how, 'coalesced')
+        fourth, how = self.submit(0)
+        self.assertEqual(how, 'coalesced')
+        self.assertIs(third, second)
+        self.assertIs(fourth, second)
+        self.assertEqual(self.queue.stats()['depth'], 2)
+
+        self.oc.gate.set()
+        self.assertEqual(first.result(5)[3], 1)
+        self.assertEqual(second.result(5)[3], 0)
+        self.assertEqual(self.oc.sent, [1, 0])
+
+        stats = self.queue.stats()
+        self.assertEqual(stats['submitted'], 4)
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(stats['coalesced'], 2)
+        self.assertEqual(stats['depth'], 0)
+
+
+    def test_same_state_joins_the_running_command(self):
+        self.oc.gate.clear()
+        first, how = self.submit(1)
+        second, how = self.submit(1)
+        self.assertEqual(how, 'coalesced')
+        self.assertIs(second, first)
+
+        self.oc.gate.set()
+        self.assertTrue(first.result(5)[0])
+        self.assertEqual(self.oc.sent, [1])
+
+
+    def test_toggle_back_is_not_sent(self):
+        self.oc.gate.clear()
+        first, how = self.submit(1)
+        second, how = self.submit(0)
+        self.submit(1)
+
+        self.oc.gate.set()
+        first.result(5)
+        self.assertEqual(second.result(5), (True, None, 0.0, 1))
+        self.assertEqual(self.oc.sent, [1])
+        self.assertEqual(self.queue.stats()['skipped'], 1)
+
+
+    def test_known_state_is_skipped(self):
+        self.submit(1)[0].result(5)
+
+        future, how = self.submit(1)
+        self.assertEqual(how, 'skipped')
+        self.assertEqual(future.result(5), (True, None, 0.0, 1))
+
+        # other outlets, forced commands and expired states are sent
+        self.assertEqual(self.submit(1, id='2')[1], 'queued')
+        self.submit(1, force=True)[0].result(5)
+        self.submit(1, state_ttl=-1)[0].result(5)
+        self.queue.forget('wireless', '1')
+        self.submit(1)[0].result(5)
+        self.assertEqual(self.oc.sent, [1, 1, 1, 1, 1])
+
+
+    def test_failed_commands_forget_the_state(self):
+        self.oc.ok = False
+        ok, error, ms, state = self.submit(1)[0].result(5)
+        self.assertFalse(ok)
+        self.assertEqual(error, 'failed to switch outlet')
+
+        self.assertEqual(self.submit(1)[1], 'queued')
+        self.assertEqual(self.queue.stats()['failed'], 1)
+
+
+    def test_late_commands_are_dropped(self):
+        future, how = self.submit(1, deadline=time.monotonic() - 1)
+        self.assertEqual(future.result(5), (False, 'timed out', 0.0, 1))
+        self.assertEqual(self.oc.sent, [])
+        self.assertEqual(self.queue.stats()['dropped'], 1)
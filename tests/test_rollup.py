@@ -0,0 +1,178 @@
+import json
+import datetime
+from unittest import mock
+from potnanny_api.rollup import MeasurementRollup, RollupManager
+from potnanny_core.database import db_session
+from potnanny_core.models.keychain import Keychain
+from potnanny_core.models.room import Room
+from potnanny_core.models.sensor import Sensor
+from potnanny_core.models.measurement import Measurement
+from tests.base import AppTestCase
+
+
+def raw_means(sensor_id, resolution):
+    """Bucket means of the raw measurements, like a rollup query."""
+
+    acc = {}
+    for m in Measurement.query.filter_by(sensor_id=sensor_id):
+        key = (m.type, RollupManager.floor(m.created, resolution))
+        item = acc.setdefault(key, [0, 0.0])
+        item[0] += 1
+        item[1] += m.value
+
+    return {k: total / count for k, (count, total) in acc.items()}
+
+
+def raw_rollups():
+    """Every rollup, computed from scratch from the raw measurements."""
+
+    acc = {}
+    for m in Measurement.query.order_by(Measurement.id):
+        for name, seconds in RollupManager.RESOLUTIONS:
+            key = (name, m.sensor_id, m.type,
+                   RollupManager.floor(m.created, name))
+            item = acc.get(key)
+            if item is None:
+                acc[key] = [1, m.value, m.value, m.value, m.value, m.created]
+                continue
+
+            item[0] += 1
+            item[1] = min(item[1], m.value)
+            item[2] = max(item[2], m.value)
+            item[3] += m.value
+            if m.created >= item[5]:
+                item[4], item[5] = m.value, m.created
+
+    return {k: (v[0], v[1], v[2], round(v[3], 6), v[4])
+            for k, v in acc.items()}
+
+
+def stored_rollups():
+    return {(r.resolution, r.sensor_id, r.type, r.bucket):
+            (r.count, r.min, r.max, round(r.sum, 6), r.last)
+            for r in MeasurementRollup.query}
+
+
+class RollupTest(AppTestCase):
+
+    MINUTES = 600
+
+    @classmethod
+    def seed(cls):
+        room = Room(name='room')
+        db_session.add(room)
+        db_session.flush()
+
+        sensor = Sensor(name='sensor', address='aa:bb', room_id=room.id)
+        db_session.add(sensor)
+        db_session.commit()
+        cls.sensor_id = sensor.id
+
+        # two types a minute, the last at least a minute ago
+        cls.now = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+        for i in range(cls.MINUTES, 0, -1):
+            t = cls.now - datetime.timedelta(minutes=i, seconds=-10)
+            db_session.add(Measurement(sensor_id=sensor.id, type='temperature',
+                                       value=20 + i % 7, created=t))
+            db_session.add(Measurement(sensor_id=sensor.id, type='humidity',
+                                       value=50 + i % 11, created=t))
+
+        db_session.commit()
+
+
+    def setUp(self):
+        super().setUp()
+        RollupManager.backfill()
+        self.assertEqual(RollupManager.watermark(), self.MINUTES * 2)
+
+
+    def tearDown(self):
+        Measurement.query.filter(
+            Measurement.id > self.MINUTES * 2).delete()
+        db_session.commit()
+
+
+    def add_minutes(self, minutes):
+        for i in range(minutes):
+            t = self.now + datetime.timedelta(minutes=i, seconds=30)
+            for mtype, value in [('temperature', 25), ('humidity', 60)]:
+                db_session.add(Measurement(sensor_id=self.sensor_id,
+                                           type=mtype, value=value + i % 3,
+                                           created=t))
+
+        db_session.commit()
+
+
+    def query(self, resolution):
+        return RollupManager.query(
+            resolution, [self.sensor_id], None,
+            self.now - datetime.timedelta(hours=24),
+            self.now + datetime.timedelta(hours=24))
+
+
+    def test_incremental_updates_match_raw_aggregates(self):
+        self.assertEqual(stored_rollups(), raw_rollups())
+
+        # new rows land in buckets that already have rollups, and in new
+        # ones, over several small batches
+        self.add_minutes(90)
+        self.assertEqual(RollupManager.update(batch_size=7), 180)
+        self.assertEqual(RollupManager.watermark(), self.MINUTES * 2 + 180)
+        self.assertEqual(stored_rollups(), raw_rollups())
+        self.assertEqual(RollupManager.update(), 0)
+
+
+    def test_compare_and_set_skips_a_batch_taken_by_another_process(self):
+        self.add_minutes(10)
+        before = stored_rollups()
+        aggregate = RollupManager._aggregate
+
+        def racing(rows, resolutions):
+            # another process commits the same batch, moving the watermark
+            Keychain.query.filter_by(name=RollupManager.KEY_NAME).update(
+                {'data': json.dumps({'last_id': rows[-1].id})},
+                synchronize_session=False)
+            return aggregate(rows, resolutions)
+
+        with mock.patch.object(RollupManager, '_aggregate', racing):
+            self.assertEqual(RollupManager.update(), 0)
+
+        # nothing of the batch was written, and it is not lost
+        self.assertEqual(stored_rollups(), before)
+        self.assertEqual(RollupManager.watermark(), self.MINUTES * 2)
+        self.assertEqual(RollupManager.update(), 20)
+        self.assertEqual(stored_rollups(), raw_rollups())
+
+
+    def test_query_includes_measurements_not_rolled_up(self):
+        self.add_minutes(90)
+        for resolution in ['minute', 'hour', 'day']:
+            with self.subTest(resolution=resolution):
+                rows = self.query(resolution)
+                self.assertEqual(
+                    {(r.type, r.created): round(r.value, 6) for r in rows},
+                    {k: round(v, 6) for k, v in raw_means(
+                        self.sensor_id, resolution).items()})
+                self.assertEqual([r.created for r in rows],
+                                 sorted(r.created for r in rows))
+
+
+    def test_chart_reads_do_not_write(self):
+        self.add_minutes(600)
+        watermark = RollupManager.watermark()
+        count = MeasurementRollup.query.count()
+
+        url = '/api/1.0/sensors/{}/chart'.format(self.sensor_id)
+        end = (self.now + datetime.timedelta(minutes=600)).isoformat()
+        start = (self.now - datetime.timedelta(minutes=600)).isoformat()
+        args = '?start={}&end={}&rollup='.format(start, end)
+        minute = self.get(url + args + 'minute')
+        raw = self.get(url + args + 'raw')
+        self.assertEqual(minute.status_code, 200)
+        self.assertEqual(raw.status_code, 200)
+
+        # the newest minutes are charted, though not rolled up yet
+        self.assertEqual(len(minute.get_json()['data']['labels']),
+                         len(raw.get_json()['data']['labels']))
+        self.assertEqual(RollupManager.watermark(), watermark)
+        self.assertEqual(MeasurementRollup.query.count(), count)
@@ -0,0 +1,145 @@
+import json
+import datetime
+import unittest
+from potnanny_core.models.schedule import ScheduleOnOff
+from potnanny_core.models.weekday import WeekdayMap
+from potnanny_api.apps.schedule.index import (ScheduleIndex, day_bit,
+    minute_of_week, week_start)
+
+MONDAY = datetime.datetime(2019, 1, 7)
+KEY = ('wireless', '1')
+
+
+def schedule(id, on, off, days=127, outlet_id='1', is_active=True):
+    return ScheduleOnOff(
+        id=id, name='schedule {}'.format(id), is_active=is_active, days=days,
+        outlet=json.dumps({'type': 'wireless', 'id': outlet_id}),
+        on_utc_hour=on[0], on_minute=on[1],
+        off_utc_hour=off[0], off_minute=off[1])
+
+
+def simulate(schedules, start, minutes):
+    """
+    Run the schedules minute by minute, like the scheduler does (with
+    core's action_now), and record the outlet state after each minute.
+    """
+
+    state = None
+    results = []
+    for i in range(minutes):
+        now = start + datetime.timedelta(minutes=i)
+        for s in schedules:
+            action = s.action_now(now)
+            if action is not None:
+                state = action['outlet']['state']
+
+        results.append((now, state))
+
+    return results
+
+
+class ScheduleIndexTest(unittest.TestCase):
+
+    def test_day_bit_matches_weekday_map(self):
+        for i in range(7):
+            day = MONDAY + datetime.timedelta(days=i)
+            self.assertEqual(WeekdayMap.DAYS[day_bit(day.weekday())],
+                             day.strftime('%A'))
+
+
+    def test_week_helpers(self):
+        sunday = MONDAY + datetime.timedelta(days=6, hours=23, minutes=59)
+        self.assertEqual(minute_of_week(MONDAY), 0)
+        self.assertEqual(minute_of_week(sunday), 7 * 24 * 60 - 1)
+        self.assertEqual(week_start(sunday), MONDAY)
+        self.assertEqual(week_start(MONDAY), MONDAY)
+
+
+    def check_against_scheduler(self, schedules):
+        # the first week settles the state, the second is compared
+        week = 7 * 24 * 60
+        index = ScheduleIndex(schedules)
+        simulated = simulate(schedules, MONDAY, 2 * week)
+        for now, state in simulated[week:]:
+            self.assertEqual(index.state(KEY, now)['state'], state,
+                             'at {}'.format(now))
+
+        changes = [(now, state) for (now, state), (_, before) in zip(
+            simulated[week:], simulated[week - 1:]) if state != before]
+        for now, state in simulated[week::97]:
+            expected = [c for c in changes if c[0] > now][:3]
+            if len(expected) < 3:
+                continue
+
+            upcoming = index.upcoming(now, 3, KEY)
+            self.assertEqual([(u[0], u[2]) for u in upcoming], expected,
+                             'after {}'.format(now))
+
+
+    def test_daily_schedule(self):
+        self.check_against_scheduler([schedule(1, (6, 0), (18, 30))])
+
+
+    def test_overnight_schedule(self):
+        self.check_against_scheduler([schedule(1, (20, 0), (6, 0))])
+
+
+    def test_some_days(self):
+        # Saturday, Sunday and Monday, over the week boundary
+        self.check_against_scheduler([
+            schedule(1, (22, 0), (2, 0), days=64 | 32 | 1)])
+
+
+    def test_overlapping_schedules(self):
+        self.check_against_scheduler([
+            schedule(1, (6, 0), (18, 0)),
+            schedule(2, (12, 0), (14, 0), days=8 | 4),
+            schedule(3, (23, 0), (23, 30), days=64),
+        ])
+
+
+    def test_wrap_around_the_week(self):
+        index = ScheduleIndex([schedule(1, (20, 0), (6, 0))])
+        early_monday = MONDAY + datetime.timedelta(hours=2)
+        state = index.state(KEY, early_monday)
+        self.assertEqual(state['state'], 1)
+        self.assertEqual(state['since'], MONDAY - datetime.timedelta(hours=4))
+        self.assertEqual(state['until'], MONDAY + datetime.timedelta(hours=6))
+
+        late_sunday = MONDAY + datetime.timedelta(days=6, hours=21)
+        state = index.state(KEY, late_sunday)
+        self.assertEqual(state['until'],
+                         MONDAY + datetime.timedelta(days=7, hours=6))
+
+        upcoming = index.upcoming(late_sunday, 3)
+        self.assertEqual([(u[0], u[2]) for u in upcoming], [
+            (MONDAY + datetime.timedelta(days=7, hours=6), 0),
+            (MONDAY + datetime.timedelta(days=7, hours=20), 1),
+            (MONDAY + datetime.timedelta(days=8, hours=6), 0),
+        ])
+
+
+    def test_outlets_and_inactive_schedules(self):
+        index = ScheduleIndex([
+            schedule(1, (6, 0), (18, 0)),
+            schedule(2, (8, 0), (9, 0), outlet_id='2'),
+            schedule(3, (0, 0), (23, 0), is_active=False),
+        ])
+        noon = MONDAY + datetime.timedelta(hours=12)
+        self.assertEqual(sorted(index.states(noon)), [KEY, ('wireless', '2')])
+        self.assertEqual(index.state(('wireless', '3'), noon), None)
+        self.assertEqual(len(index), 28)
+
+        # previewing schedule 1 as inactive
+        index = ScheduleIndex([schedule(1, (6, 0), (18, 0))],
+                              active={1: False})
+        self.assertEqual(index.state(KEY, noon), None)
+        self.assertEqual(index.upcoming(noon, 5), [])
+
+
+    def test_always_on(self):
+        index = ScheduleIndex([schedule(1, (6, 0), (6, 0))])
+        state = index.state(KEY, MONDAY)
+        self.assertEqual(state['state'], 1)
+        self.assertIsNone(state['until'])
+        self.assertEqual(index.upcoming(MONDAY, 5), [])
@@ -0,0 +1,59 @@
+import json
+from sqlalchemy import event
+from potnanny_api.settings import settings_snapshot
+from potnanny_api.versions import TableVersions
+from potnanny_core import database
+from potnanny_core.database import db_session
+from potnanny_core.models.keychain import Keychain
+from tests.base import AppTestCase
+
+
+class SettingsTest(AppTestCase):
+
+    def tearDown(self):
+        Keychain.query.filter_by(name='temperature_display').delete()
+        db_session.commit()
+
+
+    def count_statements(self, func):
+        count = [0]
+        def counter(*args):
+            count[0] += 1
+
+        event.listen(database.engine, 'before_cursor_execute', counter)
+        try:
+            func()
+        finally:
+            event.remove(database.engine, 'before_cursor_execute', counter)
+
+        return count[0]
+
+
+    def test_warm_reads_only_check_the_version(self):
+        settings_snapshot()
+        self.assertEqual(self.count_statements(settings_snapshot), 1)
+
+
+    def test_api_changes_are_seen(self):
+        self.assertFalse(settings_snapshot().fahrenheit)
+        rv = self.client.put('/api/1.0/settings/temperature_display',
+                             json={'display': 'fahrenheit'})
+        self.assertEqual(rv.status_code, 200)
+        self.assertTrue(settings_snapshot().fahrenheit)
+
+        rv = self.client.delete('/api/1.0/settings/temperature_display')
+        self.assertEqual(rv.status_code, 204)
+        self.assertFalse(settings_snapshot().fahrenheit)
+
+
+    def test_changes_by_other_processes_are_seen(self):
+        self.assertFalse(settings_snapshot().fahrenheit)
+
+        # like SettingApi in another worker: no listener runs in this one
+        db_session.add(Keychain(name='temperature_display',
+                                data=json.dumps({'display': 'fahrenheit'})))
+        TableVersions.bump('settings')
+        db_session.info.pop(TableVersions.INFO_KEY)
+        db_session.commit()
+
+        self.assertTrue(settings_snapshot().fahrenheit)
@@ -0,0 +1,132 @@
+import datetime
+import unittest
+import collections
+from potnanny_api.timegrid import np, TimeGrid
+from potnanny_api.chart_utils import fill_grid
+
+Row = collections.namedtuple('Row', ['sensor_id', 'type', 'value', 'created'])
+
+START = datetime.datetime(2019, 1, 1, 12, 0)
+
+
+def at(minutes, seconds=0):
+    return START + datetime.timedelta(minutes=minutes, seconds=seconds)
+
+
+class TimeGridTest(unittest.TestCase):
+
+    def test_values_in_one_bucket_are_averaged(self):
+        grid = TimeGrid(interval=60)
+        grid.add('temperature', at(0, 5), 20.0)
+        grid.add('temperature', at(0, 50), 22.0)
+        grid.add('humidity', at(0, 12), 50.0)
+        grid.add('humidity', at(1, 0), 52.0)
+
+        self.assertEqual(grid.timestamps(), [at(0), at(1)])
+        self.assertEqual(grid.values('temperature'), [21.0, None])
+        self.assertEqual(grid.values('humidity'), [50.0, 52.0])
+        self.assertEqual(grid.keys(), ['temperature', 'humidity'])
+
+
+    def test_gaps(self):
+        grid = TimeGrid(interval=60)
+        grid.add('temperature', at(0), 20.0)
+        grid.add('temperature', at(3), 23.0)
+        grid.add('humidity', at(1), 50.0)
+
+        self.assertEqual(grid.timestamps(), [at(0), at(1), at(3)])
+        self.assertEqual(grid.values('temperature'), [20.0, None, 23.0])
+
+        grid = TimeGrid(interval=60, fill='previous')
+        grid.add('temperature', at(0), 20.0)
+        grid.add('temperature', at(3), 23.0)
+        grid.add('humidity', at(1), 50.0)
+        self.assertEqual(grid.values('temperature'), [20.0, 20.0, 23.0])
+        self.assertEqual(grid.values('humidity'), [None, 50.0, 50.0])
+
+
+    def test_dense_axis(self):
+        grid = TimeGrid(interval=60, dense=True)
+        grid.add('temperature', at(0), 20.0)
+        grid.add('temperature', at(3), 23.0)
+
+        self.assertEqual(grid.timestamps(), [at(i) for i in range(4)])
+        self.assertEqual(grid.values('temperature'),
+                         [20.0, None, None, 23.0])
+
+
+    def test_breaks_stop_fill(self):
+        grid = TimeGrid(interval=60, fill='previous')
+        grid.add('temperature', at(0), 20.0)
+        grid.add('temperature', at(5), 25.0)
+        grid.add('humidity', at(2), 50.0)
+        grid.add_break((at(0) - datetime.datetime(1970, 1, 1)).total_seconds())
+
+        self.assertEqual(grid.timestamps(), [at(0), at(1), at(2), at(5)])
+        self.assertEqual(grid.values('temperature'),
+                         [20.0, None, None, 25.0])
+
+
+    def test_series_without_data(self):
+        grid = TimeGrid(interval=300)
+        grid.add_series('battery')
+        grid.add('temperature', at(7), 20.0)
+
+        self.assertEqual(grid.keys(), ['battery', 'temperature'])
+        self.assertEqual(grid.timestamps(), [at(5)])
+        self.assertEqual(grid.values('battery'), [None])
+        self.assertEqual(grid.values('missing'), [None])
+
+
+    def test_add_many_matches_add(self):
+        rows = [(at(i // 3, (i * 17) % 60), 20.0 + i % 4) for i in range(300)]
+        seconds = [int((dt - datetime.datetime(1970, 1, 1)).total_seconds())
+                   for dt, v in rows]
+        values = [v for dt, v in rows]
+
+        one = TimeGrid(interval=120)
+        for dt, v in rows:
+            one.add('t', dt, v)
+
+        inputs = [(seconds, values)]
+        if np is not None:
+            inputs.append((np.array(seconds, dtype=np.int64),
+                           np.array(values, dtype=np.float64)))
+
+        for s, v in inputs:
+            with self.subTest(numpy=not isinstance(s, list)):
+                many = TimeGrid(interval=120)
+                many.add_many('t', s, v)
+                self.assertEqual(many.buckets(), one.buckets())
+                self.assertEqual(
+                    [round(x, 9) for x in many.values('t')],
+                    [round(x, 9) for x in one.values('t')])
+
+
+    def test_invalid_args(self):
+        with self.assertRaises(ValueError):
+            TimeGrid(interval=0)
+        with self.assertRaises(ValueError):
+            TimeGrid(fill='next')
+
+
+    def test_fill_grid_breaks_long_gaps(self):
+        rows = [Row(1, 'temperature', 20.0, at(i)) for i in range(5)]
+        rows += [Row(1, 'temperature', 21.0, at(i)) for i in range(60, 63)]
+
+        grid = TimeGrid(interval=60, fill='previous')
+        fill_grid(grid, rows, max_gap=1800)
+        values = grid.values('temperature')
+        self.assertEqual(len(grid.buckets()), 9)
+        self.assertEqual(values[:5], [20.0] * 5)
+        self.assertIsNone(values[5])
+        self.assertEqual(values[6:], [21.0] * 3)
+
+
+    def test_fill_grid_fahrenheit(self):
+        rows = [Row(1, 'temperature', 20.0, at(0)),
+                Row(1, 'humidity', 50.0, at(0))]
+        grid = TimeGrid(interval=60)
+        fill_grid(grid, rows, fahrenheit=True, by_sensor=True)
+        self.assertEqual(grid.values((1, 'temperature')), [68.0])
+        self.assertEqual(grid.values((1, 'humidity')), [50.0])